@@ -21,6 +21,7 @@ import flags
 from genetic_algorithm import GAGeneration
 from pipeline_process import PipelineProcess
 import pipeline_worker
+from results_store import StageResults
 from steering import Steering
 from task import BUILD_STAGE
 from task import Task
@@ -42,6 +43,8 @@ OUTPUT = 'OUTPUT'
 DEFAULT_OUTPUT = 'output'
 CONF = 'CONF'
 DEFAULT_CONF = 'conf'
+RESULTS = 'RESULTS'
+DEFAULT_RESULTS = 'results.db'
 NUM_BUILDER = 'NUM_BUILDER'
 DEFAULT_NUM_BUILDER = 1
 NUM_TESTER = 'NUM_TESTER'
@@ -54,6 +57,12 @@ NUM_TRIALS = 'NUM_TRIALS'
 DEFAULT_NUM_TRIALS = 20
 MUTATION_RATE = 'MUTATION_RATE'
 DEFAULT_MUTATION_RATE = 0.01
+MIN_MEASUREMENTS = 'MIN_MEASUREMENTS'
+DEFAULT_MIN_MEASUREMENTS = 1
+MAX_MEASUREMENTS = 'MAX_MEASUREMENTS'
+DEFAULT_MAX_MEASUREMENTS = 1
+PRECISION = 'PRECISION'
+DEFAULT_PRECISION = 0
 
 
 def _ProcessGA(meta_data):
@@ -78,6 +87,11 @@ def _ProcessGA(meta_data):
   else:
     conf_file = meta_data[CONF]
 
+  if RESULTS not in meta_data:
+    results_file = DEFAULT_RESULTS
+  else:
+    results_file = meta_data[RESULTS]
+
   if NUM_BUILDER not in meta_data:
     num_builders = DEFAULT_NUM_BUILDER
   else:
@@ -108,11 +122,29 @@ def _ProcessGA(meta_data):
   else:
     mutation_rate = meta_data[MUTATION_RATE]
 
+  if MIN_MEASUREMENTS not in meta_data:
+    min_measurements = DEFAULT_MIN_MEASUREMENTS
+  else:
+    min_measurements = meta_data[MIN_MEASUREMENTS]
+
+  if MAX_MEASUREMENTS not in meta_data:
+    max_measurements = DEFAULT_MAX_MEASUREMENTS
+  else:
+    max_measurements = meta_data[MAX_MEASUREMENTS]
+
+  if PRECISION not in meta_data:
+    precision = DEFAULT_PRECISION
+  else:
+    precision = meta_data[PRECISION]
+
   specs = flags.ReadConf(conf_file)
 
   # Initiate the build/test command and the log directory.
   Task.InitLogCommand(build_cmd, test_cmd, output_file)
 
+  # Initiate the repeated measurement of the test costs.
+  Task.InitTestMode(min_measurements, max_measurements, precision)
+
   # Initiate the build/test command and the log directory.
   GAGeneration.InitMetaData(stop_threshold, num_chromosomes, num_trials, specs,
                             mutation_rate)
@@ -123,7 +155,7 @@ def _ProcessGA(meta_data):
   generations = [GAGeneration(generation_tasks, set([]), 0)]
 
   # Execute the experiment.
-  _StartExperiment(num_builders, num_testers, generations)
+  _StartExperiment(num_builders, num_testers, generations, results_file)
 
 
 def _ParseJson(file_name):
@@ -144,13 +176,15 @@ def _ParseJson(file_name):
       _ProcessGA(experiments[experiment])
 
 
-def _StartExperiment(num_builders, num_testers, generations):
+def _StartExperiment(num_builders, num_testers, generations, results_file):
   """Set up the experiment environment and execute the framework.
 
   Args:
     num_builders: number of concurrent builders.
     num_testers: number of concurrent testers.
     generations: the initial generation for the framework.
+    results_file: the database of the build and test results. The results of
+      earlier experiments in it are reused instead of building/testing again.
   """
 
   manager = multiprocessing.Manager()
@@ -163,11 +197,15 @@ def _StartExperiment(num_builders, num_testers, generations):
   test_steering = manager.Queue()
 
   # Set up the processes for the builder, tester and steering algorithm module.
-  build_process = PipelineProcess(num_builders, 'builder', {}, BUILD_STAGE,
+  build_process = PipelineProcess(num_builders, 'builder',
+                                  StageResults(results_file, BUILD_STAGE),
+                                  BUILD_STAGE,
                                   steering_build, pipeline_worker.Helper,
                                   pipeline_worker.Worker, build_test)
 
-  test_process = PipelineProcess(num_testers, 'tester', {}, TEST_STAGE,
+  test_process = PipelineProcess(num_testers, 'tester',
+                                 StageResults(results_file, TEST_STAGE),
+                                 TEST_STAGE,
                                  build_test, pipeline_worker.Helper,
                                  pipeline_worker.Worker, test_steering)
 
@@ -11,9 +11,119 @@ The actual stages include the builder and the executor.
 __author__ = 'yuhenglong@google.com (Yuheng Long)'
 
 import multiprocessing
+import Queue
+import sys
+import threading
+import time
 
 # Pick an integer at random.
 POISONPILL = 975
+# Pick an integer at random. Stops a forwarding thread of a QueueSelector.
+_STOP_FORWARDING = 4417
+
+# How often, in seconds, a stage reports its StageStats while it is running.
+STATS_INTERVAL = 60
+
+
+class StageStats(object):
+  """Queue depth and idle time of a pipeline stage.
+
+  The stage pulls its input through Get, which records how many items were
+  waiting in the queue and how long the stage blocked for the next one. A
+  stage with a deep queue is a bottleneck; a stage that is mostly idle is
+  starved by the one before it.
+  """
+
+  def __init__(self, name, out=sys.stderr):
+    self._name = name
+    self._out = out
+    self._start_time = time.time()
+    self._last_log_time = self._start_time
+    self.num_items = 0
+    self.idle_time = 0.0
+    self.total_depth = 0
+    self.max_depth = 0
+
+  def Get(self, queue):
+    """Blocking get from queue, which also records the stats."""
+    depth = queue.qsize()
+    self.total_depth += depth
+    self.max_depth = max(self.max_depth, depth)
+
+    start = time.time()
+    item = queue.get()
+    now = time.time()
+    self.idle_time += now - start
+    self.num_items += 1
+
+    if now - self._last_log_time >= STATS_INTERVAL:
+      self.Log()
+    return item
+
+  def __str__(self):
+    elapsed = max(time.time() - self._start_time, 1e-6)
+    return ('%s: %d items, queue depth avg %.1f max %d, idle %.1fs of %.1fs '
+            '(%d%%)' % (self._name, self.num_items, float(self.total_depth) /
+                        max(self.num_items, 1), self.max_depth, self.idle_time,
+                        elapsed, 100 * self.idle_time / elapsed))
+
+  def Log(self):
+    self._last_log_time = time.time()
+    self._out.write('%s\n' % self)
+    self._out.flush()
+
+
+class QueueSelector(object):
+  """Blocking get over several queues.
+
+  A thread per queue moves its items to one local queue, so that the owner can
+  block until any of the queues has an item, instead of polling each of them.
+  A forwarding thread stops after it forwarded a POISONPILL, so that no item
+  sent after the pill is taken from its queue. The owner calls Close once it is
+  done, which stops the other forwarding threads.
+  """
+
+  def __init__(self, queues):
+    self._items = Queue.Queue()
+    self._queues = queues
+    # The indices of the queues whose POISONPILL was got.
+    self._stopped = set()
+    self._threads = []
+    for index, queue in enumerate(queues):
+      thread = threading.Thread(target=self._Forward, args=(index, queue))
+      thread.daemon = True
+      thread.start()
+      self._threads.append(thread)
+
+  def _Forward(self, index, queue):
+    while True:
+      item = queue.get()
+      if item == _STOP_FORWARDING:
+        return
+      self._items.put((index, item))
+      if item == POISONPILL:
+        return
+
+  def qsize(self):
+    return self._items.qsize()
+
+  def get(self):
+    """Return the next (index of the queue, item) pair."""
+    (index, item) = self._items.get()
+    if item == POISONPILL:
+      self._stopped.add(index)
+    return (index, item)
+
+  def Close(self):
+    """Stop the forwarding threads and wait for them.
+
+    Items left in the queues that were not got are dropped.
+    """
+    for index, queue in enumerate(self._queues):
+      if index not in self._stopped:
+        queue.put(_STOP_FORWARDING)
+    for thread in self._threads:
+      thread.join()
 
 
 class PipelineProcess(multiprocessing.Process):
@@ -94,13 +204,13 @@ class PipelineProcess(multiprocessing.Process):
         args=(self._stage, self._cache, self._helper_queue, self._work_queue,
               self._result_queue))
     helper_process.start()
-    mycache = self._cache.keys()
+    mycache = set(self._cache.keys())
+    stats = StageStats(self._name)
 
     while True:
-      task = self._task_queue.get()
+      task = stats.Get(self._task_queue)
       if task == POISONPILL:
         # Poison pill means shutdown
-        self._result_queue.put(POISONPILL)
         break
 
       task_key = task.GetIdentifier(self._stage)
@@ -113,7 +223,7 @@ class PipelineProcess(multiprocessing.Process):
         work_pool.apply_async(
             self._worker,
             args=(self._stage, task, self._work_queue, self._result_queue))
-        mycache.append(task_key)
+        mycache.add(task_key)
 
     # Shutdown the workers pool and the helper process.
     work_pool.close()
@@ -121,3 +231,8 @@ class PipelineProcess(multiprocessing.Process):
 
     self._helper_queue.put(POISONPILL)
     helper_process.join()
+
+    # Only pass the poison pill on once all the tasks of this stage have been
+    # sent to the next stage.
+    self._result_queue.put(POISONPILL)
+    stats.Log()
@@ -9,6 +9,8 @@ Part of the Chrome build flags optimization.
 __author__ = 'yuhenglong@google.com (Yuheng Long)'
 
 import multiprocessing
+import StringIO
+import threading
 import unittest
 
 from mock_task import MockTask
@@ -25,17 +27,16 @@ def MockHelper(stage, done_dict, helper_queue, _, result_queue):
 
   assert stage == TEST_STAGE
   while True:
-    if not helper_queue.empty():
-      task = helper_queue.get()
-      if task == pipeline_process.POISONPILL:
-        # Poison pill means shutdown
-        break
+    task = helper_queue.get()
+    if task == pipeline_process.POISONPILL:
+      # Poison pill means shutdown
+      break
 
-      if task in done_dict:
-        # verify that it does not get duplicate "1"s in the test.
-        result_queue.put(ERROR)
-      else:
-        result_queue.put(('helper', task.GetIdentifier(TEST_STAGE)))
+    if task in done_dict:
+      # verify that it does not get duplicate "1"s in the test.
+      result_queue.put(ERROR)
+    else:
+      result_queue.put(('helper', task.GetIdentifier(TEST_STAGE)))
 
 
 def MockWorker(stage, task, _, result_queue):
@@ -51,6 +52,15 @@ class PipelineProcessTest(unittest.TestCase):
   also be passed to the next pipeline stage via the output queue.
   """
 
+  def setUp(self):
+    self._threads = set(threading.enumerate())
+
+  def tearDown(self):
+    # A thread left blocked on a manager queue raises once the manager is shut
+    # down.
+    leaked = [t for t in threading.enumerate() if t not in self._threads]
+    self.assertEqual(leaked, [])
+
   def testRun(self):
     """Test the run method.
 
@@ -84,6 +94,54 @@ class PipelineProcessTest(unittest.TestCase):
       self.assertTrue(task in result)
       result.remove(task)
 
+    # The poison pill is only passed on after all the tasks.
+    self.assertEqual(task, pipeline_process.POISONPILL)
+
+  def testQueueSelector(self):
+    """Test that the selector gets the items of all the queues."""
+
+    manager = multiprocessing.Manager()
+    queues = [manager.Queue(), manager.Queue()]
+    selector = pipeline_process.QueueSelector(queues)
+
+    queues[1].put('a')
+    self.assertEqual(selector.get(), (1, 'a'))
+    queues[0].put('b')
+    queues[0].put(pipeline_process.POISONPILL)
+    self.assertEqual(selector.get(), (0, 'b'))
+    self.assertEqual(selector.get(), (0, pipeline_process.POISONPILL))
+
+    # Items after the poison pill are left in the queue.
+    queues[0].put('c')
+    queues[1].put('d')
+    self.assertEqual(selector.get(), (1, 'd'))
+    self.assertEqual(queues[0].get(), 'c')
+
+    # Close stops the thread still forwarding the other queue.
+    selector.Close()
+    queues[1].put('e')
+    self.assertEqual(queues[1].get(), 'e')
+
+  def testStageStats(self):
+    """Test that the stats record the items and the queue depth."""
+
+    manager = multiprocessing.Manager()
+    queue = manager.Queue()
+    out = StringIO.StringIO()
+    stats = pipeline_process.StageStats('testing', out)
+
+    for item in range(3):
+      queue.put(item)
+    for item in range(3):
+      self.assertEqual(stats.Get(queue), item)
+
+    self.assertEqual(stats.num_items, 3)
+    self.assertEqual(stats.max_depth, 3)
+    self.assertEqual(stats.total_depth, 3 + 2 + 1)
+    stats.Log()
+    self.assertTrue(
+        out.getvalue().startswith('testing: 3 items, queue depth avg 2.0 max 3'))
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -21,10 +21,12 @@ import pipeline_process
 def Helper(stage, done_dict, helper_queue, completed_queue, result_queue):
   """Helper that filters duplicate tasks.
 
-  This method Continuously pulls duplicate tasks from the helper_queue. The
-  duplicate tasks need not be compiled/tested. This method also pulls completed
-  tasks from the worker queue and let the results of the duplicate tasks be the
-  same as their corresponding finished task.
+  This method blocks on the helper_queue and the completed_queue at once. The
+  duplicate tasks from the helper_queue need not be compiled/tested. The
+  completed tasks from the worker queue let the results of the duplicate tasks
+  be the same as their corresponding finished task. The helper returns once it
+  received the POISONPILL from the helper_queue and resolved all the duplicate
+  tasks.
 
   Args:
     stage: The current stage of the pipeline, for example, build stage or test
@@ -46,14 +48,28 @@ def Helper(stage, done_dict, helper_queue, completed_queue, result_queue):
   # The list of duplicate tasks, the results of which need to be resolved.
   waiting_list = []
 
-  while True:
-    # Pull duplicate task from the helper queue.
-    if not helper_queue.empty():
-      task = helper_queue.get()
+  # Block until either queue has an item, instead of polling them in turn.
+  selector = pipeline_process.QueueSelector([helper_queue, completed_queue])
+  stats = pipeline_process.StageStats('helper %s' % stage)
 
+  # Whether more duplicate tasks may come from the helper queue.
+  more_duplicates = True
+
+  try:
+    while more_duplicates or waiting_list:
+      (index, item) = stats.Get(selector)
+
+      if index == 1:
+        # A completed task from the workers.
+        ResolveDuplicates(stage, item, done_dict, waiting_list, result_queue)
+        continue
+
+      task = item
       if task == pipeline_process.POISONPILL:
-        # Poison pill means no more duplicate task from the helper queue.
-        break
+        # Poison pill means no more duplicate task from the helper queue. Keep
+        # waiting for the results of the duplicate tasks in the waiting list.
+        more_duplicates = False
+        continue
 
       # The task has not been performed before.
       assert not task.Done(stage)
@@ -61,38 +77,31 @@ def Helper(stage, done_dict, helper_queue, completed_queue, result_queue):
       # The identifier of this task.
       identifier = task.GetIdentifier(stage)
 
-      # If a duplicate task comes before the corresponding resolved results from
-      # the completed_queue, it will be put in the waiting list. If the result
-      # arrives before the duplicate task, the duplicate task will be resolved
-      # right away.
+      # If a duplicate task comes before the corresponding resolved results
+      # from the completed_queue, it will be put in the waiting list. If the
+      # result arrives before the duplicate task, the duplicate task will be
+      # resolved right away.
       if identifier in done_dict:
-        # This task has been encountered before and the result is available. The
-        # result can be resolved right away.
+        # This task has been encountered before and the result is available.
+        # The result can be resolved right away.
         task.SetResult(stage, done_dict[identifier])
         result_queue.put(task)
       else:
         waiting_list.append(task)
+  finally:
+    selector.Close()
 
-    # Check and get completed tasks from completed_queue.
-    GetResultFromCompletedQueue(stage, completed_queue, done_dict, waiting_list,
-                                result_queue)
-
-  # Wait to resolve the results of the remaining duplicate tasks.
-  while waiting_list:
-    GetResultFromCompletedQueue(stage, completed_queue, done_dict, waiting_list,
-                                result_queue)
+  stats.Log()
 
 
-def GetResultFromCompletedQueue(stage, completed_queue, done_dict, waiting_list,
-                                result_queue):
-  """Pull results from the completed queue and resolves duplicate tasks.
+def ResolveDuplicates(stage, completed, done_dict, waiting_list, result_queue):
+  """Resolves the duplicate tasks of a completed task.
 
   Args:
     stage: The current stage of the pipeline, for example, build stage or test
       stage.
-    completed_queue: A queue of tasks that have been performed. The results of
-      these tasks are needed to resolve the results of the duplicate tasks. This
-      is the communication channel between the workers and this method.
+    completed: The (identifier, result) pair of a task that has been performed,
+      as received from the workers.
     done_dict: A dictionary of tasks that are done. The key of the dictionary is
       the optimization flags of the task. The value of the dictionary is the
       compilation results of the corresponding task.
@@ -101,21 +110,18 @@ def GetResultFromCompletedQueue(stage, completed_queue, done_dict, waiting_list,
     result_queue: After the results of the duplicate tasks have been resolved,
       the duplicate tasks will be sent to the next stage via this queue.
 
-  This helper method tries to pull a completed task from the completed queue.
-  If it gets a task from the queue, it resolves the results of all the relevant
-  duplicate tasks in the waiting list. Relevant tasks are the tasks that have
-  the same flags as the currently received results from the completed_queue.
+  This method resolves the results of all the relevant duplicate tasks in the
+  waiting list. Relevant tasks are the tasks that have the same flags as the
+  completed task.
   """
-  # Pull completed task from the worker queue.
-  if not completed_queue.empty():
-    (identifier, result) = completed_queue.get()
-    done_dict[identifier] = result
-
-    tasks = [t for t in waiting_list if t.GetIdentifier(stage) == identifier]
-    for duplicate_task in tasks:
-      duplicate_task.SetResult(stage, result)
-      result_queue.put(duplicate_task)
-      waiting_list.remove(duplicate_task)
+  (identifier, result) = completed
+  done_dict[identifier] = result
+
+  tasks = [t for t in waiting_list if t.GetIdentifier(stage) == identifier]
+  for duplicate_task in tasks:
+    duplicate_task.SetResult(stage, result)
+    result_queue.put(duplicate_task)
+    waiting_list.remove(duplicate_task)
 
 
 def Worker(stage, task, helper_queue, result_queue):
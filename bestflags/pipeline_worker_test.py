@@ -13,6 +13,7 @@ __author__ = 'yuhenglong@google.com (Yuheng Long)'
 import multiprocessing
 import random
 import sys
+import threading
 import unittest
 
 from mock_task import MockTask
@@ -86,6 +87,24 @@ class PipelineWorkerTest(unittest.TestCase):
         self.assertTrue(task.GetResult(TEST_STAGE), mock_result[identifier])
       results.remove(identifier)
 
+  def testHelperStopsItsThreads(self):
+    """The helper leaves no thread behind when it returns."""
+
+    manager = multiprocessing.Manager()
+    helper_queue = manager.Queue()
+    result_queue = manager.Queue()
+    completed_queue = manager.Queue()
+
+    helper_queue.put(MockTask(TEST_STAGE, 1, MockTaskCostGenerator()))
+    helper_queue.put(pipeline_process.POISONPILL)
+    completed_queue.put((1, 1995))
+
+    threads = threading.active_count()
+    pipeline_worker.Helper(TEST_STAGE, {}, helper_queue, completed_queue,
+                           result_queue)
+    self.assertEqual(threading.active_count(), threads)
+    self.assertEqual(result_queue.get().GetResult(TEST_STAGE), 1995)
+
   def testWorker(self):
     """"Test the worker method.
 
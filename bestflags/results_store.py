@@ -0,0 +1,139 @@
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""The on-disk store of the build and test results.
+
+Part of the Chrome build flags optimization.
+
+The results of a stage are keyed on the identifier of the task in that stage,
+see Task.GetIdentifier: the formatted flags in the build stage, which map to the
+checksum, the cost, the image and the lengths of the build, and the checksum of
+the image in the test stage, which maps to the test cost. Because the test
+results are keyed on the checksum, identical images are only tested once. The
+results are also keyed on a hash of the command of the stage, and of the
+measurement settings in the test stage, so that an experiment with other
+commands does not reuse them.
+
+A StageResults is used as the cache of a PipelineProcess. The helper of the
+stage records every result in it, and the results are written through to a
+sqlite database, so later runs, whatever algorithm they use, start with the
+results of the earlier ones and an interrupted run loses no finished work.
+"""
+
+import cPickle as pickle
+import hashlib
+import os
+import sqlite3
+import sys
+
+from task import BUILD_STAGE
+from task import ERROR_STRING
+from task import Task
+
+# Seconds to wait for the other stage to release the database lock.
+LOCK_TIMEOUT = 60
+
+_CREATE_TABLE = ('CREATE TABLE IF NOT EXISTS stage_results (stage INTEGER, '
+                 'command TEXT, identifier TEXT, result BLOB, '
+                 'PRIMARY KEY (stage, command, identifier))')
+
+
+def _CommandHash(stage):
+  """Hash what the results of the stage depend on besides the task."""
+  if stage == BUILD_STAGE:
+    command = repr(Task.BUILD_COMMAND)
+  else:
+    command = repr((Task.TEST_COMMAND, Task.MIN_MEASUREMENTS,
+                    Task.MAX_MEASUREMENTS, Task.PRECISION))
+  return hashlib.sha1(command).hexdigest()
+
+
+def _IsFailed(result):
+  """Whether a build result or a test result is that of a failure."""
+  # A build result is a tuple that has the build cost as its second item.
+  cost = result[1] if isinstance(result, tuple) else result
+  return cost in (sys.maxint, ERROR_STRING)
+
+
+class StageResults(object):
+  """The results of one stage of the pipeline, backed by a sqlite database.
+
+  This supports the subset of the dictionary interface the pipeline uses.
+  Failed builds and tests are only kept for the current run, so that they are
+  retried by the next one.
+  """
+
+  def __init__(self, db_path, stage):
+    """Set up the results of the stage.
+
+    Args:
+      db_path: The path of the database. It is created if it does not exist.
+        Any number of stages and runs can share a database.
+      stage: The stage (build/test) of the results.
+
+    The command of the stage, see Task.InitLogCommand, and the measurement
+    settings, see Task.InitTestMode, must be set up before.
+    """
+
+    self._db_path = db_path
+    self._stage = stage
+    self._command = _CommandHash(stage)
+    self._failed = {}
+
+    # The connection of the current process. The store is inherited by the
+    # processes of the pipeline, which can not share a sqlite connection.
+    self._db = None
+    self._pid = None
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['_db'] = None
+    state['_pid'] = None
+    return state
+
+  def _Connect(self):
+    if self._pid != os.getpid():
+      self._db = sqlite3.connect(self._db_path, timeout=LOCK_TIMEOUT)
+      self._db.text_factory = str
+      with self._db:
+        self._db.execute(_CREATE_TABLE)
+      self._pid = os.getpid()
+    return self._db
+
+  def _Lookup(self, identifier):
+    row = self._Connect().execute(
+        'SELECT result FROM stage_results WHERE stage = ? AND command = ? AND '
+        'identifier = ?', (self._stage, self._command, identifier)).fetchone()
+    return row and pickle.loads(str(row[0]))
+
+  def keys(self):
+    rows = self._Connect().execute(
+        'SELECT identifier FROM stage_results WHERE stage = ? AND command = ?',
+        (self._stage, self._command))
+    return [identifier for (identifier,) in rows] + self._failed.keys()
+
+  def __len__(self):
+    return len(self.keys())
+
+  def __contains__(self, identifier):
+    return identifier in self._failed or self._Lookup(identifier) is not None
+
+  def __getitem__(self, identifier):
+    if identifier in self._failed:
+      return self._failed[identifier]
+    result = self._Lookup(identifier)
+    if result is None:
+      raise KeyError(identifier)
+    return result
+
+  def __setitem__(self, identifier, result):
+    if _IsFailed(result):
+      self._failed[identifier] = result
+      return
+
+    db = self._Connect()
+    with db:
+      db.execute('INSERT OR REPLACE INTO stage_results VALUES (?, ?, ?, ?)',
+                 (self._stage, self._command, identifier,
+                  sqlite3.Binary(pickle.dumps(result,
+                                              pickle.HIGHEST_PROTOCOL))))
@@ -0,0 +1,113 @@
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Unittest for the on-disk store of the build and test results.
+
+Part of the Chrome build flags optimization.
+"""
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from results_store import StageResults
+from task import BUILD_STAGE
+from task import ERROR_STRING
+from task import TEST_STAGE
+from task import Task
+
+
+def _StoreTestResult(results, identifier, cost):
+  results[identifier] = cost
+
+
+class StageResultsTest(unittest.TestCase):
+  """This class tests the StageResults class."""
+
+  def setUp(self):
+    self._temp_dir = tempfile.mkdtemp()
+    self._db_path = os.path.join(self._temp_dir, 'results.db')
+    self._task_settings = (Task.BUILD_COMMAND, Task.TEST_COMMAND,
+                           Task.MAX_MEASUREMENTS)
+    Task.BUILD_COMMAND = 'build.sh'
+    Task.TEST_COMMAND = 'test.sh'
+
+  def tearDown(self):
+    (Task.BUILD_COMMAND, Task.TEST_COMMAND,
+     Task.MAX_MEASUREMENTS) = self._task_settings
+    shutil.rmtree(self._temp_dir)
+
+  def testReuseAcrossRuns(self):
+    """The results of a run are found by a later run."""
+
+    build_result = ('checksum', 1.5, 'image', '100', '50')
+    results = StageResults(self._db_path, BUILD_STAGE)
+    self.assertNotIn('-O2', results)
+    results['-O2'] = build_result
+    self.assertIn('-O2', results)
+
+    results = StageResults(self._db_path, BUILD_STAGE)
+    self.assertEqual(results.keys(), ['-O2'])
+    self.assertEqual(results['-O2'], build_result)
+    self.assertRaises(KeyError, results.__getitem__, '-O3')
+
+  def testStagesAreSeparate(self):
+    """The stages sharing a database do not see each other's results."""
+
+    StageResults(self._db_path, BUILD_STAGE)['key'] = ('key', 1, 'i', '1', '1')
+    test_results = StageResults(self._db_path, TEST_STAGE)
+    self.assertNotIn('key', test_results)
+    test_results['key'] = 2.0
+    self.assertEqual(test_results['key'], 2.0)
+    self.assertEqual(len(StageResults(self._db_path, BUILD_STAGE)), 1)
+
+  def testCommandChangeMisses(self):
+    """Results are not reused by experiments with other commands."""
+
+    StageResults(self._db_path, BUILD_STAGE)['-O2'] = ('c', 1, 'i', '1', '1')
+    StageResults(self._db_path, TEST_STAGE)['c'] = 2.0
+
+    Task.BUILD_COMMAND = 'other_build.sh'
+    self.assertNotIn('-O2', StageResults(self._db_path, BUILD_STAGE))
+    self.assertIn('c', StageResults(self._db_path, TEST_STAGE))
+
+    Task.TEST_COMMAND = 'other_test.sh'
+    self.assertNotIn('c', StageResults(self._db_path, TEST_STAGE))
+
+    Task.TEST_COMMAND = 'test.sh'
+    Task.MAX_MEASUREMENTS += 1
+    self.assertNotIn('c', StageResults(self._db_path, TEST_STAGE))
+
+    Task.BUILD_COMMAND = 'build.sh'
+    self.assertEqual(StageResults(self._db_path, BUILD_STAGE).keys(), ['-O2'])
+
+  def testFailuresAreNotKept(self):
+    """Failures are only remembered for the current run."""
+
+    results = StageResults(self._db_path, TEST_STAGE)
+    results['crashed'] = sys.maxint
+    results['not_built'] = ERROR_STRING
+    self.assertEqual(results['crashed'], sys.maxint)
+    self.assertEqual(sorted(results.keys()), ['crashed', 'not_built'])
+
+    self.assertEqual(StageResults(self._db_path, TEST_STAGE).keys(), [])
+
+  def testOtherProcesses(self):
+    """The results stored by a child process, like the helper, are kept."""
+
+    results = StageResults(self._db_path, TEST_STAGE)
+    self.assertEqual(results.keys(), [])
+
+    process = multiprocessing.Process(
+        target=_StoreTestResult, args=(results, 'checksum', 3.0))
+    process.start()
+    process.join()
+
+    self.assertEqual(results['checksum'], 3.0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -65,15 +65,11 @@ def Steering(cache, generations, input_queue, result_queue):
 
   # The algorithm is done if there is no pending generation. A generation is
   # pending if it has pending task.
+  stats = pipeline_process.StageStats('steering')
   while waiting:
-    # Busy-waiting for the next task.
-    if input_queue.empty():
-      continue
-
-    # If there is a task whose result is ready from the last stage of the
+    # Wait for the next task whose result is ready from the last stage of the
     # feedback loop, there will be one less pending task.
-
-    task = input_queue.get()
+    task = stats.Get(input_queue)
 
     # Store the result of this ready task. Intermediate results can be used to
     # generate report for final result or be used to reboot from a crash from
@@ -114,3 +110,4 @@ def Steering(cache, generations, input_queue, result_queue):
   # Steering algorithm is finished and it informs the next stage that there will
   # be no more task.
   result_queue.put(pipeline_process.POISONPILL)
+  stats.Log()
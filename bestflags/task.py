@@ -14,9 +14,12 @@ execution output to the execution field.
 
 __author__ = 'yuhenglong@google.com (Yuheng Long)'
 
+import math
+import multiprocessing
 import os
 import subprocess
 import sys
+import time
 from uuid import uuid4
 
 BUILD_STAGE = 1
@@ -35,6 +38,14 @@ BUILD_TRIES = 3
 # test should attempt before giving up.
 TEST_TRIES = 3
 
+# The two-sided 95% critical values of the Student's t distribution, indexed by
+# the degrees of freedom. The normal value is used beyond the table.
+T_VALUES = [None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306,
+            2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110,
+            2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056,
+            2.052, 2.048, 2.045, 2.042]
+NORMAL_VALUE = 1.960
+
 
 # Create the file/directory if it does not already exist.
 def _CreateDirectory(file_name):
@@ -43,6 +54,17 @@ def _CreateDirectory(file_name):
     os.makedirs(directory)
 
 
+def _ConfidenceInterval(costs):
+  """Return the mean of the costs and the half width of its 95% interval."""
+  n = len(costs)
+  mean = sum(costs) / n
+  if n == 1:
+    return (mean, float('inf'))
+  variance = sum((cost - mean)**2 for cost in costs) / (n - 1)
+  t_value = T_VALUES[n - 1] if n - 1 < len(T_VALUES) else NORMAL_VALUE
+  return (mean, t_value * math.sqrt(variance / n))
+
+
 class Task(object):
   """A single reproducing entity.
 
@@ -56,6 +78,13 @@ class Task(object):
   TEST_COMMAND = None
   # The directory to log the compilation and test results.
   LOG_DIRECTORY = None
+  # The bounds on the number of times the test command measures an image.
+  MIN_MEASUREMENTS = 1
+  MAX_MEASUREMENTS = 1
+  # The relative half width of the confidence interval of a precise cost.
+  PRECISION = 0
+  # The lowest cost measured so far, shared by the testers.
+  BEST_COST = None
 
   @staticmethod
   def InitLogCommand(build_command, test_command, log_directory):
@@ -77,6 +106,31 @@ class Task(object):
     Task.TEST_COMMAND = test_command
     Task.LOG_DIRECTORY = log_directory
 
+  @staticmethod
+  def InitTestMode(min_measurements, max_measurements, precision):
+    """Set up the repeated measurement of the costs of the images.
+
+    The test command is run at least min_measurements and at most
+    max_measurements times per image, and the cost of the image is the mean.
+    Measuring stops early once the 95% confidence interval of the mean lies
+    above or below the best cost so far, so that the clear losers are dropped
+    after min_measurements runs, or once its half width is within precision
+    times the mean.
+
+    This must be called before the tester processes are started, which share
+    the best cost.
+
+    Args:
+      min_measurements: The number of measurements before stopping early.
+      max_measurements: The maximum number of measurements of an image.
+      precision: The relative half width of the interval of a precise cost.
+    """
+
+    Task.MIN_MEASUREMENTS = min_measurements
+    Task.MAX_MEASUREMENTS = max_measurements
+    Task.PRECISION = precision
+    Task.BEST_COST = multiprocessing.Value('d', float('inf'))
+
   def __init__(self, flag_set):
     """Set up the optimization flag selection for this task.
 
@@ -103,6 +157,11 @@ class Task(object):
     self._file_length = None
     self._text_length = None
 
+    # The number of measurements of the test cost, and the seconds spent on
+    # the measurements after the first one.
+    self._num_measurements = 0
+    self._remeasure_time = 0
+
   def __eq__(self, other):
     """Test whether two tasks are equal.
 
@@ -308,6 +367,40 @@ class Task(object):
     command = '%s %s %s' % (Task.TEST_COMMAND, self._image,
                             self._task_identifier)
 
+    # The costs of the successful measurements of the image.
+    costs = []
+    while len(costs) < Task.MAX_MEASUREMENTS:
+      start = time.time()
+      (cost, err) = self.__Measure(command)
+      if costs:
+        self._remeasure_time += time.time() - start
+
+      if cost == ERROR_STRING:
+        break
+      costs.append(float(cost))
+      if self.__Separated(costs):
+        break
+
+    self._num_measurements = len(costs)
+    if cost == ERROR_STRING:
+      self._exe_cost = sys.maxint
+    else:
+      self._exe_cost = sum(costs) / len(costs)
+      if Task.BEST_COST is not None:
+        with Task.BEST_COST.get_lock():
+          Task.BEST_COST.value = min(Task.BEST_COST.value, self._exe_cost)
+
+    self.__LogTestCost(err)
+
+  def __Measure(self, command):
+    """Run the test command once.
+
+    Args:
+      command: The test command of the image.
+    Returns:
+      The cost, or ERROR_STRING if the test failed, and the test log.
+    """
+
     # Try TEST_TRIES number of times before confirming that the build fails.
     for _ in range(TEST_TRIES):
       try:
@@ -332,9 +425,30 @@ class Task(object):
         # success or TEST_TRIES number of tries have been conducted.
         cost = ERROR_STRING
 
-    self._exe_cost = sys.maxint if (cost == ERROR_STRING) else float(cost)
+    return (cost, err)
 
-    self.__LogTestCost(err)
+  def __Separated(self, costs):
+    """Whether the costs measured so far are enough to rank the image.
+
+    Args:
+      costs: The costs measured so far.
+    Returns:
+      True if the confidence interval of the mean cost lies above or below the
+      best cost so far, or if it is precise enough.
+    """
+
+    if len(costs) < Task.MIN_MEASUREMENTS:
+      return False
+
+    (mean, half_width) = _ConfidenceInterval(costs)
+    if half_width <= Task.PRECISION * mean:
+      return True
+
+    # Without a best cost the image is measured until its cost is precise.
+    if Task.BEST_COST is None or Task.BEST_COST.value == float('inf'):
+      return False
+    best = Task.BEST_COST.value
+    return mean - half_width > best or mean + half_width < best
 
   def __SetBuildResult(self, (checksum, build_cost, image, file_length,
                               text_length)):
@@ -358,7 +472,9 @@ class Task(object):
     """Log the performance results for the task.
 
     This method is called by the steering stage and this method writes the
-    results out to a file. The results include the build and the test results.
+    results out to a file. The results include the build and the test results,
+    the number of measurements of the test cost and the seconds spent on
+    measuring it again.
     """
 
     steering_log = '%s/%s/steering.txt' % self._log_path
@@ -369,10 +485,11 @@ class Task(object):
       # Include the build and the test results.
       steering_result = (self._flag_set, self._checksum, self._build_cost,
                          self._image, self._file_length, self._text_length,
-                         self._exe_cost)
+                         self._exe_cost, self._num_measurements,
+                         self._remeasure_time)
 
       # Write out the result in the comma-separated format (CSV).
-      out_file.write('%s,%s,%s,%s,%s,%s,%s\n' % steering_result)
+      out_file.write('%s,%s,%s,%s,%s,%s,%s,%s,%s\n' % steering_result)
 
   def __LogBuildCost(self, log):
     """Log the build results for the task.
@@ -8,8 +8,12 @@ Part of the Chrome build flags optimization.
 
 __author__ = 'yuhenglong@google.com (Yuheng Long)'
 
+import os
 import random
+import shutil
+import stat
 import sys
+import tempfile
 import unittest
 
 import task
@@ -24,6 +28,12 @@ RANDOM_BUILD_RESULT = 100
 # The random test result values used to test get set result method.
 RANDOM_TESTRESULT = 100
 
+# A test command that prints the costs in the image file, one per run.
+MEASURE_SCRIPT = """#!/bin/sh
+head -n 1 $1
+sed -i 1d $1
+"""
+
 
 class MockFlagSet(object):
   """This class emulates a set of flags.
@@ -169,6 +179,50 @@ class TaskTest(unittest.TestCase):
       assert work_task.Done(task.TEST_STAGE)
       assert work_task.Done(task.BUILD_STAGE)
 
+  def testRepeatedMeasurement(self):
+    """Test the repeated measurement of the test cost.
+
+    The losers are dropped after the minimum number of measurements, the other
+    tasks are measured until they are separated from the best cost or their
+    cost is precise.
+    """
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+      test_command = os.path.join(temp_dir, 'measure')
+      with open(test_command, 'w') as f:
+        f.write(MEASURE_SCRIPT)
+      os.chmod(test_command, stat.S_IRWXU)
+      Task.InitLogCommand(None, test_command, os.path.join(temp_dir, 'log'))
+      Task.InitTestMode(2, 6, 0.01)
+
+      def Measure(costs):
+        image = os.path.join(temp_dir, 'image')
+        with open(image, 'w') as f:
+          f.write('\n'.join(str(cost) for cost in costs) + '\n')
+        work_task = Task(MockFlagSet(random.randint(0, NUM_FLAGS)))
+        work_task.SetResult(task.BUILD_STAGE, ('checksum', 1, image, 1, 1))
+        work_task.Work(task.TEST_STAGE)
+        # pylint: disable=protected-access
+        return (work_task.GetTestResult(), work_task._num_measurements)
+
+      # Without a best cost, a noisy task is measured until it is precise.
+      self.assertEqual(Measure([10, 11, 10, 11, 10, 11]), (10.5, 6))
+      self.assertEqual(Task.BEST_COST.value, 10.5)
+      # A clear loser is dropped after two measurements.
+      self.assertEqual(Measure([20, 21]), (20.5, 2))
+      # A clear winner is separated after two measurements too.
+      self.assertEqual(Measure([8, 8.1]), (8.05, 2))
+      self.assertEqual(Task.BEST_COST.value, 8.05)
+      # A task close to the best cost needs more measurements.
+      self.assertEqual(Measure([8, 9, 8, 9, 8, 9]), (8.5, 6))
+      # A stable cost is precise after two measurements.
+      self.assertEqual(Measure([9, 9]), (9, 2))
+    finally:
+      shutil.rmtree(temp_dir)
+      Task.InitTestMode(1, 1, 0)
+      Task.BEST_COST = None
+
 
 if __name__ == '__main__':
   unittest.main()
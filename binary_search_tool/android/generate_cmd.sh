@@ -28,8 +28,9 @@ output+='source android/common.sh\n'
 
 result=$(egrep -m 1 -- "${item}" ${populate_log})
 
-# Re-generate bad item to tmp directory location
-tmp_ir='/tmp/bisection_bad_item.o'
+# Re-generate bad item to tmp directory location, or to $BISECT_OUTPUT_DIR
+# if the bisection tool sets it (it then installs the object itself).
+tmp_ir='${BISECT_OUTPUT_DIR:-/tmp}/bisection_bad_item.o'
 result=$(sed "s|$item|-o $tmp_ir |g" <<< ${result})
 
 # Remove `:` after cd command
@@ -41,8 +42,10 @@ result=$(sed 's| -o | $LIMIT_FLAGS -o |g' <<< ${result})
 output+=${result}
 
 # Symbolic link generated bad item to original object
-output+="\nln -f $tmp_ir $abs_path"
-output+="\ntouch $abs_path"
+output+="\nif [[ -z \"\${BISECT_OUTPUT_DIR:-}\" ]]; then"
+output+="\n  ln -f $tmp_ir $abs_path"
+output+="\n  touch $abs_path"
+output+="\nfi"
 
 echo -e "${output}" > android/cmd_script.sh
 
@@ -91,6 +91,27 @@ class BinarySearcherForPass(object):
     self.logger.LogOutput(message, print_to_console=verbose)
     return self.current
 
+  def GetNextLimits(self, count):
+    """Return up to count limits that the next GetNext calls may return.
+
+    The limits are those of the next levels of the search tree below the
+    current [lo, hi) range, closest levels first, so that they can be built
+    ahead of time.
+    """
+    hi = self.hi or self.total
+    limits = []
+    ranges = [(self.lo, hi)]
+    while ranges and len(limits) < count:
+      lo, hi = ranges.pop(0)
+      if lo >= hi:
+        continue
+      current = (lo + hi) / 2
+      limits.append(current)
+      if current != 0:
+        ranges.append((current + 1, hi))
+        ranges.append((lo, current))
+    return limits
+
   def SetStatus(self, status):
     """Set lo/hi status based on test script result
 
@@ -128,13 +149,18 @@ class BinarySearcherForPass(object):
 
 
 class BinarySearcher(object):
-  """Class of binary searcher."""
+  """Class of binary searcher.
+
+  The search state is kept as indices into sorted_list: the [lo, hi) range,
+  the set of skipped indices, and a BinarySearchPoint for each tested index
+  only, so that it does not grow with the length of the list.
+  """
 
   def __init__(self, logger_to_set=None):
     self.sorted_list = []
     self.index_log = []
     self.status_log = []
-    self.skipped_indices = []
+    self.skipped_indices = set()
     self.current = 0
     self.points = {}
     self.lo = 0
@@ -151,9 +177,6 @@ class BinarySearcher(object):
     self.hi = len(sorted_list) - 1
     self.lo = 0
     self.points = {}
-    for i in range(len(self.sorted_list)):
-      bsp = BinarySearchPoint(self.sorted_list[i], -1, 'Not yet done.')
-      self.points[i] = bsp
 
   def SetStatus(self, status, tag=None):
     message = ('Revision: %s index: %d returned: %d' %
@@ -166,7 +189,7 @@ class BinarySearcher(object):
     self.points[self.current] = bsp
 
     if status == 125:
-      self.skipped_indices.append(self.current)
+      self.skipped_indices.add(self.current)
 
     if status == 0 or status == 1:
       if status == 0:
@@ -182,14 +205,28 @@ class BinarySearcher(object):
       self.logger.LogOutput(message)
       return True
 
-    for index in range(self.lo, self.hi):
-      if index not in self.skipped_indices:
-        return False
+    if not self._AllSkipped():
+      return False
     self.logger.LogOutput(
         'All skipped indices between: %d and %d\n' % (self.lo, self.hi),
         print_to_console=verbose)
     return True
 
+  def _NumSkipped(self):
+    """Return the number of skipped indices in [lo, hi)."""
+    return sum(1 for i in self.skipped_indices if self.lo <= i < self.hi)
+
+  def _AllSkipped(self):
+    return self._NumSkipped() == self.hi - self.lo
+
+  def _NearestUnskipped(self, index):
+    """Return the unskipped index in [lo, hi) closest to index, or None."""
+    for offset in range(self.hi - self.lo):
+      for i in (index + offset, index - offset):
+        if self.lo <= i < self.hi and i not in self.skipped_indices:
+          return i
+    return None
+
   # Does a better job with chromeos flakiness.
   def GetNextFlakyBinary(self):
     t = (self.lo, self.current, self.hi)
@@ -240,6 +277,53 @@ class BinarySearcher(object):
     self.logger.LogOutput(str(self), print_to_console=verbose)
     return self.sorted_list[self.current]
 
+  def GetNextIndices(self, count):
+    """Return up to count indices that split [lo, hi) into equal parts.
+
+    Testing all of them at once narrows the search down to one of count + 1
+    parts, instead of one of 2 parts for GetNext. Skipped indices are not
+    returned.
+    """
+    if self.hi - self.lo - self._NumSkipped() <= count:
+      indices = [
+          i for i in range(self.lo, self.hi) if i not in self.skipped_indices
+      ]
+    else:
+      indices = sorted(
+          set(
+              self._NearestUnskipped(self.lo + (self.hi - self.lo) * (j + 1) /
+                                     (count + 1)) for j in range(count)))
+    message = ('lo: %d hi: %d testing indices: %s\n' % (self.lo, self.hi,
+                                                        indices))
+    self.logger.LogOutput(message, print_to_console=verbose)
+    return indices
+
+  def SetStatuses(self, results):
+    """Record the results of testing several indices at once.
+
+    Args:
+      results: List of (index, status) pairs, with status as for SetStatus.
+
+    Returns:
+      True if the search is complete, as for SetStatus.
+    """
+    # Take the bad results first, lowest index first. A good result above the
+    # first bad one can only come from a flaky test, so it is ignored.
+    for index, status in sorted(results, key=lambda r: (r[1] != 1, r[0])):
+      if status != 125 and not self.lo <= index < self.hi:
+        self.logger.LogOutput(
+            'Ignoring status %d at index %d, outside of lo: %d hi: %d' %
+            (status, index, self.lo, self.hi),
+            print_to_console=verbose)
+        continue
+      self.current = index
+      self.SetStatus(status)
+
+    if self.lo == self.hi:
+      self.current = self.lo
+      return True
+    return self._AllSkipped()
+
   def SetLoRevision(self, lo_revision):
     self.lo = self.sorted_list.index(lo_revision)
 
@@ -247,8 +331,9 @@ class BinarySearcher(object):
     self.hi = self.sorted_list.index(hi_revision)
 
   def GetAllPoints(self):
+    """Return a 'status index revision' line for each tested index."""
     to_return = ''
-    for i in range(len(self.sorted_list)):
+    for i in sorted(self.points):
       to_return += (
           '%d %d %s\n' % (self.points[i].status, i, self.points[i].revision))
 
@@ -264,7 +349,7 @@ class BinarySearcher(object):
     to_return += str(revision_log) + '\n'
     to_return += str(self.status_log) + '\n'
     to_return += 'Skipped indices:\n'
-    to_return += str(self.skipped_indices) + '\n'
+    to_return += str(sorted(self.skipped_indices)) + '\n'
     to_return += self.GetAllPoints()
     return to_return
 
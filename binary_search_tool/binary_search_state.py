@@ -13,9 +13,12 @@ import errno
 import math
 import os
 import pickle
+import pipes
 import re
+import shutil
 import sys
 import tempfile
+import threading
 import time
 
 # Adds cros_utils to PYTHONPATH
@@ -26,6 +29,8 @@ from cros_utils import command_executer
 from cros_utils import logger
 
 import binary_search_perforce
+import bisect_driver
+import build_cache
 import pass_mapping
 
 GOOD_SET_VAR = 'BISECT_GOOD_SET'
@@ -34,6 +39,22 @@ BAD_SET_VAR = 'BISECT_BAD_SET'
 STATE_FILE = '%s.state' % sys.argv[0]
 HIDDEN_STATE_FILE = os.path.join(
     os.path.dirname(STATE_FILE), '.%s' % os.path.basename(STATE_FILE))
+SLOT_DIR = '%s.slot%%d' % sys.argv[0]
+BUILD_CACHE_DIR = '%s.build_cache' % sys.argv[0]
+OUTPUT_DIR_VAR = 'BISECT_OUTPUT_DIR'
+# Compiler output that a rebuild for pass/transformation bisection must have.
+PASS_MARKER = 'BISECT: '
+TRANSFORM_MARKER = 'Counters and values:'
+# Attributes that are only saved in full snapshots of the state journal,
+# because they are large and only change when all_items does, or are not
+# needed to resume. The binary searcher is saved separately.
+SNAPSHOT_ONLY_ATTRS = frozenset([
+    'all_items', 'known_good', 'binary_search', 'slots',
+    'currently_good_items', 'currently_bad_items', 'ce', 'l', 'journal_key',
+    'items_generation'
+])
+SLOT_VAR = 'BISECT_SLOT'
+SLOT_DIR_VAR = 'BISECT_SLOT_DIR'
 
 
 class Error(Exception):
@@ -41,6 +62,23 @@ class Error(Exception):
   pass
 
 
+@contextlib.contextmanager
+def _ItemsFile(items):
+  """Write items to a temp file, and index it for bisect_driver.
+
+  Yields:
+    The name of the temp file.
+  """
+  with tempfile.NamedTemporaryFile() as f:
+    f.write('\n'.join(items))
+    f.flush()
+    bisect_driver.write_object_index(f.name)
+    try:
+      yield f.name
+    finally:
+      os.remove(f.name + bisect_driver.INDEX_SUFFIX)
+
+
 @contextlib.contextmanager
 def SetFile(env_var, items):
   """Generate set files that can be used by switch/test scripts.
@@ -58,19 +96,87 @@ def SetFile(env_var, items):
     env_var: What environment variable to store the file name in.
     items: What items are in this set.
   """
-  with tempfile.NamedTemporaryFile() as f:
-    os.environ[env_var] = f.name
-    f.write('\n'.join(items))
-    f.flush()
+  with _ItemsFile(items) as name:
+    os.environ[env_var] = name
     yield
 
 
+def _RunConcurrently(function, args_list):
+  """Call function with each of args_list in its own thread.
+
+  Returns:
+    The list of return values, in args_list order.
+
+  Raises:
+    The first exception raised by any of the calls.
+  """
+  results = [None] * len(args_list)
+  errors = []
+
+  def _Run(i):
+    try:
+      results[i] = function(*args_list[i])
+    except:  # pylint: disable=bare-except
+      errors.append(sys.exc_info())
+
+  threads = [threading.Thread(target=_Run, args=(i,))
+             for i in range(len(args_list))]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  if errors:
+    raise errors[0][0], errors[0][1], errors[0][2]
+  return results
+
+
+class WorkSlot(object):
+  """One of the work dirs that items are tested in with --parallel.
+
+  The switch, test setup and test scripts that run for a slot get its index
+  and work dir in the BISECT_SLOT and BISECT_SLOT_DIR environment variables,
+  and have to keep the state of each slot (e.g. a build tree) apart. Each slot
+  also has its own BISECT_GOOD_SET and BISECT_BAD_SET files.
+  """
+
+  def __init__(self, index):
+    self.index = index
+    self.work_dir = os.path.abspath(SLOT_DIR % index)
+    self.currently_good_items = set([])
+    self.currently_bad_items = set([])
+    self.env = None
+
+  @contextlib.contextmanager
+  def SetFiles(self, good_items, bad_items):
+    """Like SetFile, but for the scripts of this slot only."""
+    if not os.path.isdir(self.work_dir):
+      os.makedirs(self.work_dir)
+    with _ItemsFile(good_items) as good, _ItemsFile(bad_items) as bad:
+      self.env = {
+          SLOT_VAR: str(self.index),
+          SLOT_DIR_VAR: self.work_dir,
+          GOOD_SET_VAR: good,
+          BAD_SET_VAR: bad
+      }
+      try:
+        yield
+      finally:
+        self.env = None
+
+  def GetCommand(self, command):
+    """Return command, run with the environment of this slot."""
+    exports = ''.join('export %s=%s; ' % (k, pipes.quote(v))
+                      for k, v in sorted(self.env.iteritems()))
+    return exports + command
+
+
 class BinarySearchState(object):
   """The binary search state class."""
 
   def __init__(self, get_initial_items, switch_to_good, switch_to_bad,
                test_setup_script, test_script, incremental, prune, pass_bisect,
-               iterations, prune_iterations, verify, file_args, verbose):
+               iterations, prune_iterations, verify, file_args, verbose,
+               parallel=1):
     """BinarySearchState constructor, see Run for full args documentation."""
     self.get_initial_items = get_initial_items
     self.switch_to_good = switch_to_good
@@ -85,6 +191,10 @@ class BinarySearchState(object):
     self.verify = verify
     self.file_args = file_args
     self.verbose = verbose
+    self.parallel = parallel
+    self.slots = []
+    if parallel > 1:
+      self.slots = [WorkSlot(i) for i in range(parallel)]
 
     self.l = logger.GetLogger()
     self.ce = command_executer.GetCommandExecuter()
@@ -96,6 +206,12 @@ class BinarySearchState(object):
     self.all_items = None
     self.cmd_script = None
     self.mode = None
+    self.journal_key = None
+    # Bumped whenever all_items is replaced, to tell the journals apart.
+    self.items_generation = 0
+    # Whether cmd_script supports $BISECT_OUTPUT_DIR, so that limits can be
+    # rebuilt in parallel. None until a rebuild has told.
+    self.prefetch_builds = None
     self.PopulateItemsUsingCommand(self.get_initial_items)
     self.currently_good_items = set([])
     self.currently_bad_items = set([])
@@ -104,14 +220,15 @@ class BinarySearchState(object):
 
     self.start_time = time.time()
 
-  def SwitchToGood(self, item_list):
-    """Switch given items to "good" set."""
+  def SwitchToGood(self, item_list, slot=None):
+    """Switch given items to "good" set, in the given WorkSlot if any."""
+    state = slot or self
     if self.incremental:
       self.l.LogOutput(
           'Incremental set. Wanted to switch %s to good' % str(item_list),
           print_to_console=self.verbose)
       incremental_items = [
-          item for item in item_list if item not in self.currently_good_items
+          item for item in item_list if item not in state.currently_good_items
       ]
       item_list = incremental_items
       self.l.LogOutput(
@@ -123,18 +240,20 @@ class BinarySearchState(object):
 
     self.l.LogOutput(
         'Switching %s to good' % str(item_list), print_to_console=self.verbose)
-    self.RunSwitchScript(self.switch_to_good, item_list)
-    self.currently_good_items = self.currently_good_items.union(set(item_list))
-    self.currently_bad_items.difference_update(set(item_list))
-
-  def SwitchToBad(self, item_list):
-    """Switch given items to "bad" set."""
+    self.RunSwitchScript(self.switch_to_good, item_list, slot)
+    state.currently_good_items = state.currently_good_items.union(
+        set(item_list))
+    state.currently_bad_items.difference_update(set(item_list))
+
+  def SwitchToBad(self, item_list, slot=None):
+    """Switch given items to "bad" set, in the given WorkSlot if any."""
+    state = slot or self
     if self.incremental:
       self.l.LogOutput(
           'Incremental set. Wanted to switch %s to bad' % str(item_list),
           print_to_console=self.verbose)
       incremental_items = [
-          item for item in item_list if item not in self.currently_bad_items
+          item for item in item_list if item not in state.currently_bad_items
       ]
       item_list = incremental_items
       self.l.LogOutput(
@@ -146,16 +265,17 @@ class BinarySearchState(object):
 
     self.l.LogOutput(
         'Switching %s to bad' % str(item_list), print_to_console=self.verbose)
-    self.RunSwitchScript(self.switch_to_bad, item_list)
-    self.currently_bad_items = self.currently_bad_items.union(set(item_list))
-    self.currently_good_items.difference_update(set(item_list))
+    self.RunSwitchScript(self.switch_to_bad, item_list, slot)
+    state.currently_bad_items = state.currently_bad_items.union(set(item_list))
+    state.currently_good_items.difference_update(set(item_list))
 
-  def RunSwitchScript(self, switch_script, item_list):
+  def RunSwitchScript(self, switch_script, item_list, slot=None):
     """Pass given items to switch script.
 
     Args:
       switch_script: path to switch script
       item_list: list of all items to be switched
+      slot: WorkSlot to run the script for, if any
     """
     if self.file_args:
       with tempfile.NamedTemporaryFile() as f:
@@ -163,12 +283,12 @@ class BinarySearchState(object):
         f.flush()
         command = '%s %s' % (switch_script, f.name)
         ret, _, _ = self.ce.RunCommandWExceptionCleanup(
-            command, print_to_console=self.verbose)
+            self._GetCommand(command, slot), print_to_console=self.verbose)
     else:
       command = '%s %s' % (switch_script, ' '.join(item_list))
       try:
         ret, _, _ = self.ce.RunCommandWExceptionCleanup(
-            command, print_to_console=self.verbose)
+            self._GetCommand(command, slot), print_to_console=self.verbose)
       except OSError as e:
         if e.errno == errno.E2BIG:
           raise Error('Too many arguments for switch script! Use --file_args')
@@ -176,18 +296,23 @@ class BinarySearchState(object):
           raise
     assert ret == 0, 'Switch script %s returned %d' % (switch_script, ret)
 
-  def TestScript(self):
+  def _GetCommand(self, command, slot):
+    if slot is None:
+      return command
+    return slot.GetCommand(command)
+
+  def TestScript(self, slot=None):
     """Run test script and return exit code from script."""
-    command = self.test_script
+    command = self._GetCommand(self.test_script, slot)
     ret, _, _ = self.ce.RunCommandWExceptionCleanup(command)
     return ret
 
-  def TestSetupScript(self):
+  def TestSetupScript(self, slot=None):
     """Run test setup script and return exit code from script."""
     if not self.test_setup_script:
       return 0
 
-    command = self.test_setup_script
+    command = self._GetCommand(self.test_setup_script, slot)
     ret, _, _ = self.ce.RunCommandWExceptionCleanup(command)
     return ret
 
@@ -215,27 +340,40 @@ class BinarySearchState(object):
     self.l.LogOutput('VERIFICATION')
     self.l.LogOutput('Beginning tests to verify good/bad sets\n')
 
+    # With --parallel, verify in the first work slot only.
+    slot = self.slots[0] if self.slots else None
+
     self._OutputProgress('Verifying items from GOOD set\n')
-    with SetFile(GOOD_SET_VAR, self.all_items), SetFile(BAD_SET_VAR, []):
+    with self._SetFiles(self.all_items, [], slot):
       self.l.LogOutput('Resetting all items to good to verify.')
-      self.SwitchToGood(self.all_items)
-      status = self.TestSetupScript()
+      self.SwitchToGood(self.all_items, slot)
+      status = self.TestSetupScript(slot)
       assert status == 0, 'When reset_to_good, test setup should succeed.'
-      status = self.TestScript()
+      status = self.TestScript(slot)
       assert status == 0, 'When reset_to_good, status should be 0.'
 
     self._OutputProgress('Verifying items from BAD set\n')
-    with SetFile(GOOD_SET_VAR, []), SetFile(BAD_SET_VAR, self.all_items):
+    with self._SetFiles([], self.all_items, slot):
       self.l.LogOutput('Resetting all items to bad to verify.')
-      self.SwitchToBad(self.all_items)
-      status = self.TestSetupScript()
+      self.SwitchToBad(self.all_items, slot)
+      status = self.TestSetupScript(slot)
       # The following assumption is not true; a bad image might not
       # successfully push onto a device.
       # assert status == 0, 'When reset_to_bad, test setup should succeed.'
       if status == 0:
-        status = self.TestScript()
+        status = self.TestScript(slot)
       assert status == 1, 'When reset_to_bad, status should be 1.'
 
+  @contextlib.contextmanager
+  def _SetFiles(self, good_items, bad_items, slot=None):
+    """Set the good/bad set files for the scripts run for slot."""
+    if slot is None:
+      with SetFile(GOOD_SET_VAR, good_items), SetFile(BAD_SET_VAR, bad_items):
+        yield
+    else:
+      with slot.SetFiles(good_items, bad_items):
+        yield
+
   def DoSearchBadItems(self):
     """Perform full search for bad items.
 
@@ -316,6 +454,9 @@ class BinarySearchState(object):
       self.OutputIterationProgressBadItem()
 
       self.search_cycles += 1
+      if self.slots:
+        terminated = self._RunParallelRound()
+        continue
       [bad_items, good_items] = self.GetNextItems()
 
       with SetFile(GOOD_SET_VAR, good_items), SetFile(BAD_SET_VAR, bad_items):
@@ -334,6 +475,30 @@ class BinarySearchState(object):
     self.l.LogOutput(str(self), print_to_console=self.verbose)
     return terminated
 
+  def _TestIndex(self, index, slot):
+    """Test the split at the given index in slot. Returns the test status."""
+    bad_items, good_items = self._GetItemsForIndex(index)
+    with slot.SetFiles(good_items, bad_items):
+      self.SwitchToGood(good_items, slot)
+      self.SwitchToBad(bad_items, slot)
+      status = self.TestSetupScript(slot)
+      if status == 0:
+        status = self.TestScript(slot)
+    return status
+
+  def _RunParallelRound(self):
+    """Test up to one split per work slot at once.
+
+    The splits are spread evenly over the remaining range, so that each round
+    narrows it down by a factor of len(self.slots) + 1 instead of 2.
+
+    Returns:
+      True if the search terminated.
+    """
+    indices = self.binary_search.GetNextIndices(len(self.slots))
+    statuses = _RunConcurrently(self._TestIndex, zip(indices, self.slots))
+    return self.binary_search.SetStatuses(zip(indices, statuses))
+
   def CollectPassName(self, pass_info):
     """Mapping opt-bisect output of pass info to debugcounter name."""
     self.l.LogOutput('Pass info: %s' % pass_info, print_to_console=self.verbose)
@@ -356,12 +521,12 @@ class BinarySearchState(object):
                 limit set to -1.
       pass_name: The debugcounter name of current limit pass.
     """
-    os.environ['LIMIT_FLAGS'] = '-mllvm -opt-bisect-limit=' + str(limit)
+    os.environ['LIMIT_FLAGS'] = self._GetPassLimitFlags(limit)
     self.l.LogOutput(
         'Limit flags: %s' % os.environ['LIMIT_FLAGS'],
         print_to_console=self.verbose)
-    command = self.cmd_script
-    _, _, msg = self.ce.RunCommandWOutput(command, print_to_console=False)
+    msg = self._RunCmdScript(os.environ['LIMIT_FLAGS'], PASS_MARKER,
+                             limit != -1)
 
     # Massages we get will be like this:
     #   BISECT: running pass (9) <Pass Description> on <function> (<file>)
@@ -370,7 +535,7 @@ class BinarySearchState(object):
     #   BISECT: NOT running pass (12) <Pass Description> on <SCG> (<file>)
     # We want to get the pass description of last running pass, to have
     # transformation level bisect on it.
-    if 'BISECT: ' not in msg:
+    if PASS_MARKER not in msg:
       raise RuntimeError('No bisect info printed, OptBisect may not be '
                          'supported by the compiler.')
 
@@ -400,20 +565,15 @@ class BinarySearchState(object):
       pass_limit: pass level limit from pass level bisect result
     Return: Total number of transformations if limit set to -1, else return 0.
     """
-    counter_name = pass_name
-
-    os.environ['LIMIT_FLAGS'] = '-mllvm -opt-bisect-limit=' + \
-                                str(pass_limit) + \
-                                ' -mllvm -debug-counter=' + counter_name + \
-                                '-count=' + str(limit) + \
-                                ' -mllvm -print-debug-counter'
+    os.environ['LIMIT_FLAGS'] = self._GetTransformLimitFlags(
+        limit, pass_name, pass_limit)
     self.l.LogOutput(
         'Limit flags: %s' % os.environ['LIMIT_FLAGS'],
         print_to_console=self.verbose)
-    command = self.cmd_script
-    _, _, msg = self.ce.RunCommandWOutput(command, print_to_console=False)
+    msg = self._RunCmdScript(os.environ['LIMIT_FLAGS'], TRANSFORM_MARKER,
+                             limit != -1)
 
-    if 'Counters and values:' not in msg:
+    if TRANSFORM_MARKER not in msg:
       raise RuntimeError('No bisect info printed, DebugCounter may not be '
                          'supported by the compiler.')
 
@@ -439,6 +599,115 @@ class BinarySearchState(object):
     # transformation count.
     return 0
 
+  def _GetPassLimitFlags(self, limit):
+    return '-mllvm -opt-bisect-limit=' + str(limit)
+
+  def _GetTransformLimitFlags(self, limit, pass_name, pass_limit):
+    return ('-mllvm -opt-bisect-limit=' + str(pass_limit) +
+            ' -mllvm -debug-counter=' + pass_name + '-count=' + str(limit) +
+            ' -mllvm -print-debug-counter')
+
+  def _BuildIntoCache(self, cache, key, limit_flags, marker):
+    """Run cmd_script with limit_flags in a new output dir, and cache it.
+
+    Only rebuilds whose output has marker are cached, the others are
+    returned as is.
+
+    Returns:
+      The build_cache.BuildResult of the rebuild.
+    """
+    output_dir = tempfile.mkdtemp(prefix='bisect_output.')
+    try:
+      command = 'export LIMIT_FLAGS=%s; export %s=%s; %s' % (
+          pipes.quote(limit_flags), OUTPUT_DIR_VAR, pipes.quote(output_dir),
+          self.cmd_script)
+      _, _, msg = self.ce.RunCommandWOutput(command, print_to_console=False)
+      object_file = os.path.join(output_dir, build_cache.OBJECT_FILE)
+      if not os.path.exists(object_file):
+        object_file = None
+      if marker not in msg:
+        return build_cache.BuildResult(msg, None)
+      return cache.Store(key, msg, object_file)
+    finally:
+      shutil.rmtree(output_dir, ignore_errors=True)
+
+  def _RunCmdScript(self, limit_flags, marker, need_object=True):
+    """Rebuild the bad item with limit_flags, unless it is cached.
+
+    cmd_script is run with the flags in $LIMIT_FLAGS and a scratch dir in
+    $BISECT_OUTPUT_DIR. A script that writes the object file to
+    $BISECT_OUTPUT_DIR/bisection_bad_item.o, instead of to the bad item, has
+    the object cached too; the bad item is then updated from the cache. With
+    other scripts only the compiler output is cached, so probes that need the
+    object always rebuild.
+
+    Args:
+      limit_flags: The value of $LIMIT_FLAGS.
+      marker: What the compiler output must have for it to be cached.
+      need_object: Whether the bad item must be rebuilt with limit_flags, as
+        opposed to only needing the compiler output.
+
+    Returns:
+      The compiler output of the rebuild.
+    """
+    cache = build_cache.BuildCache(BUILD_CACHE_DIR)
+    key = cache.GetKey(self.cmd_script, limit_flags)
+    result = cache.Lookup(key)
+    if result and (result.object_file or not need_object):
+      self.l.LogOutput(
+          'Using cached rebuild for: %s' % limit_flags,
+          print_to_console=self.verbose)
+    else:
+      result = self._BuildIntoCache(cache, key, limit_flags, marker)
+      if self.prefetch_builds is None:
+        self._SetPrefetchBuilds([result])
+    if need_object and result.object_file:
+      assert len(self.found_items) == 1, 'Expected a single bad item.'
+      item = list(self.found_items)[0]
+      shutil.copy(result.object_file, item + '.bisect_tmp')
+      os.rename(item + '.bisect_tmp', item)
+    return result.msg
+
+  def _PrefetchBuilds(self, get_limit_flags, marker):
+    """Rebuild the limits the search may probe next, one per --parallel job.
+
+    Each rebuild is run in its own output dir and only fills the build cache,
+    so this needs a cmd_script that supports $BISECT_OUTPUT_DIR (see
+    _RunCmdScript). Until a rebuild has shown that it does, a single limit
+    is rebuilt first, as scripts that do not would all write the bad item at
+    once. Prefetching is turned off after a rebuild that does not.
+
+    Args:
+      get_limit_flags: Function that returns the $LIMIT_FLAGS for a limit.
+      marker: See _RunCmdScript.
+    """
+    if self.parallel <= 1 or self.prefetch_builds is False:
+      return
+    cache = build_cache.BuildCache(BUILD_CACHE_DIR)
+    builds = []
+    for limit in self.binary_search.GetNextLimits(self.parallel):
+      limit_flags = get_limit_flags(limit)
+      key = cache.GetKey(self.cmd_script, limit_flags)
+      result = cache.Lookup(key)
+      if not result or not result.object_file:
+        builds.append((cache, key, limit_flags, marker))
+    if builds and self.prefetch_builds is None:
+      self._SetPrefetchBuilds([self._BuildIntoCache(*builds.pop(0))])
+    if not builds or not self.prefetch_builds:
+      return
+    self.l.LogOutput(
+        'Building %d limits in parallel.' % len(builds),
+        print_to_console=self.verbose)
+    self._SetPrefetchBuilds(_RunConcurrently(self._BuildIntoCache, builds))
+
+  def _SetPrefetchBuilds(self, results):
+    """Turn prefetching off unless all rebuilds in results cached objects."""
+    self.prefetch_builds = all(r.object_file for r in results)
+    if not self.prefetch_builds:
+      self.l.LogOutput('%s does not write %s to $%s, not building limits in '
+                       'parallel.' % (self.cmd_script, build_cache.OBJECT_FILE,
+                                      OUTPUT_DIR_VAR))
+
   def DoSearchBadPass(self):
     """Perform full search for bad pass of bad item."""
     logger.GetLogger().LogOutput('Starting to bisect bad pass for bad item.')
@@ -506,8 +775,12 @@ class BinarySearchState(object):
       current = self.binary_search.GetNext()
 
       if self.mode == 'pass':
+        self._PrefetchBuilds(self._GetPassLimitFlags, PASS_MARKER)
         index, pass_name = self.BuildWithPassLimit(current)
       else:
+        self._PrefetchBuilds(
+            lambda limit: self._GetTransformLimitFlags(
+                limit, pass_name, pass_index), TRANSFORM_MARKER)
         self.BuildWithTransformLimit(current, pass_name, pass_index)
         index = current
 
@@ -549,27 +822,59 @@ class BinarySearchState(object):
       all_items: new list of all_items
     """
     self.all_items = all_items
+    self.items_generation += 1
     self.binary_search = binary_search_perforce.BinarySearcher(
         logger_to_set=self.l)
     self.binary_search.SetSortedList(self.all_items)
 
+  def _GetJournalKey(self):
+    return (self.items_generation, len(self.known_good))
+
+  def _GetJournalRecord(self):
+    """Return the state that changes during a search.
+
+    See SNAPSHOT_ONLY_ATTRS for the attributes left out.
+    """
+    state = dict((k, v) for k, v in self.__dict__.iteritems()
+                 if k not in SNAPSHOT_ONLY_ATTRS)
+    searcher = dict((k, v) for k, v in self.binary_search.__dict__.iteritems()
+                    if k not in ('sorted_list', 'logger'))
+    return state, type(self.binary_search), searcher
+
+  def _ApplyJournalRecord(self, record):
+    state, searcher_class, searcher = record
+    self.__dict__.update(state)
+    if type(self.binary_search) is not searcher_class:
+      # Switched from item to pass bisection.
+      self.binary_search = searcher_class.__new__(searcher_class)
+    self.binary_search.__dict__.update(searcher)
+
   def SaveState(self):
     """Save state to STATE_FILE.
 
-    SaveState will create a new unique, hidden state file to hold data from
-    object. Then atomically overwrite the STATE_FILE symlink to point to the
-    new data.
+    The state is kept in a journal: a full snapshot of the object, followed by
+    a record of the search state (see _GetJournalRecord) for each later call.
+    These records are appended to the journal, so saving does not get slower
+    with the number of items. Once all_items or known_good change, SaveState
+    will create a new unique, hidden state file with a new snapshot. Then
+    atomically overwrite the STATE_FILE symlink to point to the new data.
 
     Raises:
       Error if STATE_FILE already exists but is not a symlink.
     """
+    if (self.journal_key == self._GetJournalKey() and
+        os.path.islink(STATE_FILE)):
+      with open(os.readlink(STATE_FILE), 'ab') as f:
+        pickle.dump(self._GetJournalRecord(), f, pickle.HIGHEST_PROTOCOL)
+      return
+
     ce, l = self.ce, self.l
     self.ce, self.l, self.binary_search.logger = None, None, None
     old_state = None
 
     _, path = tempfile.mkstemp(prefix=HIDDEN_STATE_FILE, dir='.')
     with open(path, 'wb') as f:
-      pickle.dump(self, f)
+      pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
 
     if os.path.exists(STATE_FILE):
       if os.path.islink(STATE_FILE):
@@ -587,6 +892,7 @@ class BinarySearchState(object):
       os.remove(old_state)
 
     self.ce, self.l, self.binary_search.logger = ce, l, l
+    self.journal_key = self._GetJournalKey()
 
   @classmethod
   def LoadState(cls):
@@ -594,7 +900,16 @@ class BinarySearchState(object):
     if not os.path.isfile(STATE_FILE):
       return None
     try:
-      bss = pickle.load(file(STATE_FILE))
+      with open(STATE_FILE, 'rb') as f:
+        bss = pickle.load(f)
+        while True:
+          try:
+            record = pickle.load(f)
+          except (EOFError, pickle.UnpicklingError):
+            # End of the journal, or a record cut short by a crash.
+            break
+          bss._ApplyJournalRecord(record)
+      bss.journal_key = bss._GetJournalKey()
       bss.l = logger.GetLogger()
       bss.ce = command_executer.GetCommandExecuter()
       bss.binary_search.logger = bss.l
@@ -610,6 +925,9 @@ class BinarySearchState(object):
       # a previous switch_script corrupted the environment.
       bss.currently_good_items = set([])
       bss.currently_bad_items = set([])
+      for slot in bss.slots:
+        slot.currently_good_items = set([])
+        slot.currently_bad_items = set([])
 
       binary_search_perforce.verbose = bss.verbose
       return bss
@@ -623,12 +941,17 @@ class BinarySearchState(object):
         real_file = os.readlink(STATE_FILE)
         os.remove(real_file)
         os.remove(STATE_FILE)
+    for slot in self.slots:
+      shutil.rmtree(slot.work_dir, ignore_errors=True)
+    build_cache.BuildCache(BUILD_CACHE_DIR).Remove()
 
   def GetNextItems(self):
     """Get next items for binary search based on result of the last test run."""
-    border_item = self.binary_search.GetNext()
-    index = self.all_items.index(border_item)
+    self.binary_search.GetNext()
+    return self._GetItemsForIndex(self.binary_search.current)
 
+  def _GetItemsForIndex(self, index):
+    """Get the bad and good items when splitting all_items after index."""
     next_bad_items = self.all_items[:index + 1]
     next_good_items = self.all_items[index + 1:] + list(self.known_good)
 
@@ -665,8 +988,9 @@ class BinarySearchState(object):
            'Current bad items found:\n'
            '%s\n')
     out = out % (self.search_cycles + 1,
-                 math.ceil(math.log(len(self.all_items), 2)), self.prune_cycles
-                 + 1, self.prune_iterations, ', '.join(self.found_items))
+                 math.ceil(math.log(len(self.all_items), self.parallel + 1)),
+                 self.prune_cycles + 1, self.prune_iterations,
+                 ', '.join(self.found_items))
     self._OutputProgress(out)
 
   def OutputIterationProgressBadPass(self):
@@ -703,7 +1027,8 @@ class MockBinarySearchState(BinarySearchState):
         'prune_iterations': 100,
         'verify': True,
         'file_args': False,
-        'verbose': False
+        'verbose': False,
+        'parallel': 1
     }
     default_kwargs.update(kwargs)
     super(MockBinarySearchState, self).__init__(**default_kwargs)
@@ -736,7 +1061,8 @@ def Run(get_initial_items,
         verify=True,
         prune_iterations=100,
         verbose=False,
-        resume=False):
+        resume=False,
+        parallel=1):
   """Run binary search tool.
 
   Equivalent to running through terminal.
@@ -768,6 +1094,9 @@ def Run(get_initial_items,
     prune_iterations: Max number of bad items to search for.
     verbose: If True will print extra debug information to user.
     resume: If True will resume using STATE_FILE.
+    parallel: Number of splits to test at once, each in its own work slot
+      (see WorkSlot). In pass/transformation bisection, the number of limits
+      to rebuild at once (see _PrefetchBuilds).
 
   Returns:
     0 for success, error otherwise
@@ -811,7 +1140,7 @@ def Run(get_initial_items,
     bss = BinarySearchState(get_initial_items, switch_to_good, switch_to_bad,
                             test_setup_script, test_script, incremental, prune,
                             pass_bisect, iterations, prune_iterations, verify,
-                            file_args, verbose)
+                            file_args, verbose, parallel)
     bss.DoVerify()
 
   try:
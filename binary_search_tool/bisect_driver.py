@@ -19,16 +19,27 @@ from __future__ import print_function
 
 import contextlib
 import fcntl
+import hashlib
+import mmap
 import os
 import shutil
+import struct
 import subprocess
 import sys
+import tempfile
 
 VALID_MODES = ('POPULATE_GOOD', 'POPULATE_BAD', 'TRIAGE')
 GOOD_CACHE = 'good'
 BAD_CACHE = 'bad'
 LIST_FILE = os.path.join(GOOD_CACHE, '_LIST')
 
+# Object lists can have an index next to them, see write_object_index.
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = 'BISECTIDX2'
+# The magic, then the size, mtime and inode of the list file.
+INDEX_HEADER = struct.Struct('=%dsQdQ' % len(INDEX_MAGIC))
+INDEX_DIGEST_SIZE = 16
+
 CONTINUE_ON_MISSING = os.environ.get('BISECT_CONTINUE_ON_MISSING', None) == '1'
 WRAPPER_SAFE_MODE = os.environ.get('BISECT_WRAPPER_SAFE_MODE', None) == '1'
 
@@ -195,11 +206,96 @@ def get_dwo_path(execargs):
   return full_obj_path[:-2] + '.dwo'
 
 
+def _object_digest(obj_name):
+  return hashlib.md5(obj_name).digest()
+
+
+def _list_stamp(stat):
+  """Return what tells a version of an object list file from the others."""
+  return (stat.st_size, stat.st_mtime, stat.st_ino)
+
+
+def write_object_index(list_filename):
+  """Write the index for an object list file.
+
+  The index is the sorted md5 digests of the object names in the list, behind
+  a header with the size, mtime and inode of the list file it was built from,
+  so that a list rewritten to the same size is not looked up in it. It is
+  written to a temp file and renamed into place, so readers never need a lock.
+  """
+  with lock_file(list_filename, 'r') as list_file:
+    stamp = _list_stamp(os.fstat(list_file.fileno()))
+    digests = sorted(
+        set(_object_digest(line.strip()) for line in list_file if line.strip()))
+  index_filename = list_filename + INDEX_SUFFIX
+  fd, temp_filename = tempfile.mkstemp(
+      prefix=os.path.basename(index_filename),
+      dir=os.path.dirname(os.path.abspath(index_filename)))
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      f.write(INDEX_HEADER.pack(INDEX_MAGIC, *stamp))
+      f.write(''.join(digests))
+    os.rename(temp_filename, index_filename)
+  except Exception:
+    os.remove(temp_filename)
+    raise
+
+
+def _in_object_index(obj_name, list_filename):
+  """Look obj_name up in the index of list_filename.
+
+  Returns:
+    True or False, or None if there is no index or it is out of date.
+  """
+  try:
+    list_stamp = _list_stamp(os.stat(list_filename))
+    index_file = open(list_filename + INDEX_SUFFIX, 'rb')
+  except (IOError, OSError):
+    return None
+  with index_file:
+    index_size = os.fstat(index_file.fileno()).st_size
+    if index_size < INDEX_HEADER.size:
+      return None
+    if index_size == INDEX_HEADER.size:
+      # Empty list, mmap does not take empty ranges.
+      header = INDEX_HEADER.unpack(index_file.read(INDEX_HEADER.size))
+      return False if header == (INDEX_MAGIC,) + list_stamp else None
+    index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+  try:
+    if (INDEX_HEADER.unpack(index[:INDEX_HEADER.size]) !=
+        (INDEX_MAGIC,) + list_stamp):
+      return None
+    digest = _object_digest(obj_name)
+    lo = 0
+    hi = (index_size - INDEX_HEADER.size) / INDEX_DIGEST_SIZE
+    while lo < hi:
+      mid = (lo + hi) / 2
+      start = INDEX_HEADER.size + mid * INDEX_DIGEST_SIZE
+      entry = index[start:start + INDEX_DIGEST_SIZE]
+      if entry == digest:
+        return True
+      if entry < digest:
+        lo = mid + 1
+      else:
+        hi = mid
+    return False
+  finally:
+    index.close()
+
+
 def in_object_list(obj_name, list_filename):
-  """Check if object file name exist in file with object list."""
+  """Check if object file name exist in file with object list.
+
+  Uses the index of the list if it has an up to date one, see
+  write_object_index. Otherwise the list is scanned.
+  """
   if not obj_name:
     return False
 
+  found = _in_object_index(obj_name, list_filename)
+  if found is not None:
+    return found
+
   with lock_file(list_filename, 'r') as list_file:
     for line in list_file:
       if line.strip() == obj_name:
@@ -350,6 +446,15 @@ def bisect_triage(execargs, bisect_dir):
   if not full_obj_path:
     return exec_and_return(execargs)
 
+  # The list is complete once triage starts, index it for the compiler calls
+  # that follow. Racing writers all write the same index, the last one wins.
+  # The index is only an optimization, without it the list is scanned.
+  if _in_object_index(full_obj_path, obj_list) is None:
+    try:
+      write_object_index(obj_list)
+    except (IOError, OSError):
+      pass
+
   # If this isn't a bisected object just call compiler
   # This shouldn't happen!
   if not in_object_list(full_obj_path, obj_list):
@@ -0,0 +1,91 @@
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Cache of the rebuilds of the bad item during pass level bisection.
+
+Pass and transformation level bisection rerun the cmd_script generated by
+--pass_bisect with a different LIMIT_FLAGS value for each probe. The result of
+a rebuild only depends on the script and the flags, so it is cached under the
+hash of both: the compiler output, which has the BISECT: and DebugCounter
+information, and the object file, if the script left it in BISECT_OUTPUT_DIR.
+Repeated limits, and the probes of a resumed search, then skip the compiler.
+"""
+
+from __future__ import print_function
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+MESSAGE_FILE = 'msg'
+OBJECT_FILE = 'bisection_bad_item.o'
+
+
+class BuildResult(object):
+  """A cached rebuild: compiler output and the object file, if any."""
+
+  def __init__(self, msg, object_file):
+    self.msg = msg
+    self.object_file = object_file
+
+
+class BuildCache(object):
+  """Content addressed cache of bad item rebuilds."""
+
+  def __init__(self, cache_dir):
+    self.cache_dir = os.path.abspath(cache_dir)
+
+  def GetKey(self, cmd_script, limit_flags):
+    """Return the cache key for running cmd_script with limit_flags."""
+    h = hashlib.sha1()
+    with open(cmd_script, 'rb') as f:
+      h.update(f.read())
+    h.update('\0')
+    h.update(limit_flags)
+    return h.hexdigest()
+
+  def Lookup(self, key):
+    """Return the BuildResult stored under key, or None."""
+    entry = os.path.join(self.cache_dir, key)
+    try:
+      with open(os.path.join(entry, MESSAGE_FILE), 'rb') as f:
+        msg = f.read()
+    except IOError:
+      return None
+    object_file = os.path.join(entry, OBJECT_FILE)
+    if not os.path.exists(object_file):
+      object_file = None
+    return BuildResult(msg, object_file)
+
+  def Store(self, key, msg, object_file=None):
+    """Store a rebuild under key. The object file is copied into the cache.
+
+    Returns:
+      The BuildResult as stored in the cache.
+    """
+    if not os.path.isdir(self.cache_dir):
+      try:
+        os.makedirs(self.cache_dir)
+      except OSError:
+        if not os.path.isdir(self.cache_dir):
+          raise
+    # Fill a temp dir and rename it into place, so that concurrent builds and
+    # interrupted runs never leave a partial entry behind.
+    temp_dir = tempfile.mkdtemp(prefix='.%s' % key, dir=self.cache_dir)
+    try:
+      with open(os.path.join(temp_dir, MESSAGE_FILE), 'wb') as f:
+        f.write(msg)
+      if object_file:
+        shutil.copy(object_file, os.path.join(temp_dir, OBJECT_FILE))
+      os.rename(temp_dir, os.path.join(self.cache_dir, key))
+    except OSError:
+      # Another build stored the same key first.
+      if not os.path.isdir(os.path.join(self.cache_dir, key)):
+        raise
+    finally:
+      shutil.rmtree(temp_dir, ignore_errors=True)
+    return self.Lookup(key)
+
+  def Remove(self):
+    shutil.rmtree(self.cache_dir, ignore_errors=True)
@@ -275,3 +275,12 @@ def _BuildArgsDict(args):
       help='Resume bisection tool execution from state file.'
            'Useful if the last bisection was terminated '
            'before it could properly finish.')
+  # No short option, -j is --num_jobs in bisect.py android mode.
+  args.AddArgument(
+      '--parallel',
+      dest='parallel',
+      type=int,
+      default=1,
+      help='Number of item splits to test at once. Each is tested in its own '
+           'work slot; the scripts get the slot number and a scratch dir for '
+           'it in $BISECT_SLOT and $BISECT_SLOT_DIR. Defaults to 1.')
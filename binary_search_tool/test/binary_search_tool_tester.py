@@ -9,14 +9,19 @@ from __future__ import print_function
 
 __author__ = 'shenhan@google.com (Han Shen)'
 
+import errno
 import os
 import random
+import shutil
 import sys
+import tempfile
 import unittest
 
 from cros_utils import command_executer
+from binary_search_tool import binary_search_perforce
 from binary_search_tool import binary_search_state
 from binary_search_tool import bisect
+from binary_search_tool import bisect_driver
 
 import common
 import gen_obj
@@ -220,16 +225,31 @@ class BisectingUtilsTest(unittest.TestCase):
     bss.SaveState()
     self.assertTrue(os.path.exists(state_file))
     first_state = os.readlink(state_file)
+    first_size = os.path.getsize(first_state)
 
+    # Later saves are appended to the journal.
+    bss.SaveState()
+    self.assertEqual(os.readlink(state_file), first_state)
+    self.assertTrue(os.path.getsize(first_state) > first_size)
+
+    # A new item list starts a new journal.
+    bss.PopulateItemsUsingList(['1', '2'])
     bss.SaveState()
     second_state = os.readlink(state_file)
     self.assertTrue(os.path.exists(state_file))
     self.assertTrue(second_state != first_state)
     self.assertFalse(os.path.exists(first_state))
 
+    # So does a list at the address of the last one, as a new list may be.
+    bss.PopulateItemsUsingList(bss.all_items)
+    bss.SaveState()
+    third_state = os.readlink(state_file)
+    self.assertTrue(third_state != second_state)
+    self.assertFalse(os.path.exists(second_state))
+
     bss.RemoveState()
     self.assertFalse(os.path.islink(state_file))
-    self.assertFalse(os.path.exists(second_state))
+    self.assertFalse(os.path.exists(third_state))
 
   def test_load_state(self):
     test_items = [1, 2, 3, 4, 5]
@@ -247,6 +267,31 @@ class BisectingUtilsTest(unittest.TestCase):
     self.assertEquals(bss2.currently_good_items, set([]))
     self.assertEquals(bss2.currently_bad_items, set([]))
 
+  def test_load_state_journal(self):
+    bss = binary_search_state.MockBinarySearchState(
+        get_initial_items='echo "0\n1\n2\n3\n4\n5"')
+    bss.SaveState()
+    bss.search_cycles = 2
+    bss.found_items.add('5')
+    bss.binary_search.current = 3
+    bss.binary_search.SetStatus(1)
+    bss.binary_search.current = 1
+    bss.binary_search.SetStatus(125)
+    bss.SaveState()
+    bss.search_cycles = 3
+    bss.SaveState()
+    with open(os.readlink(binary_search_state.STATE_FILE), 'ab') as f:
+      f.write('\x80\x02(')  # A record cut short.
+
+    bss2 = binary_search_state.MockBinarySearchState.LoadState()
+    self.assertEquals(bss2.all_items, ['0', '1', '2', '3', '4', '5'])
+    self.assertEquals(bss2.search_cycles, 3)
+    self.assertEquals(bss2.found_items, set(['5']))
+    self.assertEquals(bss2.binary_search.hi, 3)
+    self.assertEquals(bss2.binary_search.skipped_indices, set([1]))
+    self.assertEquals(sorted(bss2.binary_search.points), [1, 3])
+    self.assertIs(bss2.binary_search.sorted_list, bss2.all_items)
+
   def test_tmp_cleanup(self):
     bss = binary_search_state.MockBinarySearchState(
         get_initial_items='echo "0\n1\n2\n3"',
@@ -322,6 +367,105 @@ class BisectingUtilsTest(unittest.TestCase):
     found_obj = int(bss.found_items.pop())
     self.assertEquals(bad_objs[found_obj], 1)
 
+  def test_pass_build_cache(self):
+    tempdir = tempfile.mkdtemp()
+    try:
+      item = os.path.join(tempdir, 'bad.o')
+      count_file = os.path.join(tempdir, 'count')
+      cmd_script = os.path.join(tempdir, 'cmd_script.sh')
+      # Fake compiler with 10 passes. Writes the limit to the object file.
+      with open(cmd_script, 'w') as f:
+        f.write('#!/bin/bash -u\n'
+                'echo >> %s\n'
+                'limit=${LIMIT_FLAGS##*=}\n'
+                'for i in $(seq 1 10); do\n'
+                '  if [[ $limit -ne -1 && $i -gt $limit ]]; then not="NOT "; '
+                'else not=""; fi\n'
+                '  echo "BISECT: ${not}running pass ($i) Early CSE" >&2\n'
+                'done\n'
+                'echo $limit > $BISECT_OUTPUT_DIR/bisection_bad_item.o\n' %
+                count_file)
+      os.chmod(cmd_script, 0o755)
+
+      def NumBuilds():
+        with open(count_file) as f:
+          return len(f.readlines())
+
+      def ItemLimit():
+        with open(item) as f:
+          return f.read().strip()
+
+      bss = binary_search_state.MockBinarySearchState()
+      bss.cmd_script = cmd_script
+      bss.found_items = set([item])
+
+      self.assertEqual(bss.BuildWithPassLimit(-1), (10, 'early-cse'))
+      self.assertEqual(bss.BuildWithPassLimit(-1), (10, 'early-cse'))
+      self.assertEqual(NumBuilds(), 1)
+      self.assertEqual(bss.BuildWithPassLimit(2), (2, 'early-cse'))
+      self.assertEqual(ItemLimit(), '2')
+      bss.BuildWithPassLimit(3)
+      self.assertEqual(ItemLimit(), '3')
+      bss.BuildWithPassLimit(2)
+      self.assertEqual(ItemLimit(), '2')
+      self.assertEqual(NumBuilds(), 3)
+
+      # Prefetch the next limits of the search: 5, then 8 and 2.
+      bss.parallel = 3
+      bss.binary_search = binary_search_perforce.BinarySearcherForPass()
+      bss.binary_search.total = 10
+      self.assertEqual(bss.binary_search.GetNext(), 5)
+      bss._PrefetchBuilds(bss._GetPassLimitFlags,
+                          binary_search_state.PASS_MARKER)
+      self.assertEqual(NumBuilds(), 5)
+      bss.BuildWithPassLimit(5)
+      bss.BuildWithPassLimit(8)
+      self.assertEqual(ItemLimit(), '8')
+      self.assertEqual(NumBuilds(), 5)
+
+      bss.RemoveState()
+      self.assertFalse(os.path.exists(binary_search_state.BUILD_CACHE_DIR))
+    finally:
+      shutil.rmtree(tempdir)
+
+  def test_prefetch_probe(self):
+    tempdir = tempfile.mkdtemp()
+    try:
+      item = os.path.join(tempdir, 'bad.o')
+      count_file = os.path.join(tempdir, 'count')
+      cmd_script = os.path.join(tempdir, 'cmd_script.sh')
+      # Fake compiler that writes the bad item itself, not $BISECT_OUTPUT_DIR.
+      with open(cmd_script, 'w') as f:
+        f.write('#!/bin/bash -u\n'
+                'echo >> %s\n'
+                'echo "BISECT: running pass (1) Early CSE" >&2\n'
+                'echo ${LIMIT_FLAGS##*=} > %s\n' % (count_file, item))
+      os.chmod(cmd_script, 0o755)
+
+      bss = binary_search_state.MockBinarySearchState()
+      bss.cmd_script = cmd_script
+      bss.found_items = set([item])
+      bss.parallel = 3
+      bss.binary_search = binary_search_perforce.BinarySearcherForPass()
+      bss.binary_search.total = 10
+      bss.binary_search.GetNext()
+
+      # A single limit is built to find out that the others can not be built
+      # in parallel.
+      bss._PrefetchBuilds(bss._GetPassLimitFlags,
+                          binary_search_state.PASS_MARKER)
+      with open(count_file) as f:
+        self.assertEqual(len(f.readlines()), 1)
+      self.assertFalse(bss.prefetch_builds)
+      bss._PrefetchBuilds(bss._GetPassLimitFlags,
+                          binary_search_state.PASS_MARKER)
+      with open(count_file) as f:
+        self.assertEqual(len(f.readlines()), 1)
+
+      bss.RemoveState()
+    finally:
+      shutil.rmtree(tempdir)
+
   def test_set_file(self):
     binary_search_state.Run(
         get_initial_items='./gen_init_list.py',
@@ -333,6 +477,20 @@ class BisectingUtilsTest(unittest.TestCase):
         verify=True)
     self.check_output()
 
+  def test_parallel(self):
+    ret = binary_search_state.Run(
+        get_initial_items='./gen_init_list.py',
+        switch_to_good='./switch_to_good.py',
+        switch_to_bad='./switch_to_bad.py',
+        test_script='./is_good.py',
+        prune=True,
+        file_args=True,
+        parallel=3)
+    self.assertEquals(ret, 0)
+    self.check_output()
+    for i in range(3):
+      self.assertFalse(os.path.exists(binary_search_state.SLOT_DIR % i))
+
   def test_noincremental_prune(self):
     ret = binary_search_state.Run(
         get_initial_items='./gen_init_list.py',
@@ -367,6 +525,93 @@ class BisectingUtilsTest(unittest.TestCase):
     self.assertEqual(actual_result, expected_result)
 
 
+class BisectDriverTest(unittest.TestCase):
+  """Tests for the object list index of bisect_driver."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.list_file = os.path.join(self.tempdir, '_LIST')
+    self.objs = ['/build/obj%d.o' % i for i in range(100)]
+    with open(self.list_file, 'w') as f:
+      f.write('\n'.join(self.objs[:50]))
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def check_membership(self):
+    for obj in self.objs[:50]:
+      self.assertTrue(bisect_driver.in_object_list(obj, self.list_file))
+    for obj in self.objs[50:]:
+      self.assertFalse(bisect_driver.in_object_list(obj, self.list_file))
+
+  def test_object_index(self):
+    self.check_membership()
+    self.assertIsNone(
+        bisect_driver._in_object_index(self.objs[0], self.list_file))
+
+    bisect_driver.write_object_index(self.list_file)
+    self.assertTrue(
+        bisect_driver._in_object_index(self.objs[0], self.list_file))
+    self.assertFalse(
+        bisect_driver._in_object_index(self.objs[50], self.list_file))
+    self.check_membership()
+
+    # Appending to the list makes the index stale, so the list is scanned.
+    with open(self.list_file, 'a') as f:
+      f.write('\n/build/new.o')
+    self.assertIsNone(
+        bisect_driver._in_object_index(self.objs[0], self.list_file))
+    self.assertTrue(bisect_driver.in_object_list('/build/new.o',
+                                                 self.list_file))
+
+    # So does rewriting it to the same size.
+    bisect_driver.write_object_index(self.list_file)
+    with open(self.list_file) as f:
+      content = f.read()
+    stat = os.stat(self.list_file)
+    with open(self.list_file, 'w') as f:
+      f.write(content.replace(self.objs[0], self.objs[0][::-1]))
+    os.utime(self.list_file, (stat.st_atime, stat.st_mtime + 1))
+    self.assertEqual(os.path.getsize(self.list_file), stat.st_size)
+    self.assertIsNone(
+        bisect_driver._in_object_index(self.objs[0], self.list_file))
+    self.assertFalse(bisect_driver.in_object_list(self.objs[0],
+                                                  self.list_file))
+
+  def test_triage_without_index(self):
+    os.mkdir(os.path.join(self.tempdir, bisect_driver.GOOD_CACHE))
+    os.rename(self.list_file,
+              os.path.join(self.tempdir, bisect_driver.LIST_FILE))
+
+    def FailToWrite(_):
+      raise OSError(errno.EROFS, 'Read-only file system')
+
+    # Triage goes on with a scan of the list if the index can not be written.
+    write_object_index = bisect_driver.write_object_index
+    bisect_driver.write_object_index = FailToWrite
+    try:
+      with self.assertRaises(bisect_driver.Error):
+        bisect_driver.bisect_triage(
+            ['cc', '-c', 'new.c', '-o', self.objs[50]], self.tempdir)
+    finally:
+      bisect_driver.write_object_index = write_object_index
+
+  def test_empty_object_index(self):
+    open(self.list_file, 'w').close()
+    bisect_driver.write_object_index(self.list_file)
+    self.assertFalse(
+        bisect_driver._in_object_index(self.objs[0], self.list_file))
+
+  def test_set_file_index(self):
+    with binary_search_state.SetFile('BISECT_BAD_SET', self.objs[:50]):
+      bad_set = os.environ['BISECT_BAD_SET']
+      self.assertTrue(bisect_driver._in_object_index(self.objs[0], bad_set))
+      self.assertEqual(bisect_driver.which_cache(self.objs[0]), 'bad')
+      self.assertEqual(bisect_driver.which_cache(self.objs[50]), 'good')
+    self.assertFalse(
+        os.path.exists(bad_set + bisect_driver.INDEX_SUFFIX))
+
+
 class BisectStressTest(unittest.TestCase):
   """Stress tests for bisecting tool."""
 
@@ -436,13 +681,21 @@ def Main(argv):
   suite.addTest(BisectingUtilsTest('test_bad_save_state'))
   suite.addTest(BisectingUtilsTest('test_save_state'))
   suite.addTest(BisectingUtilsTest('test_load_state'))
+  suite.addTest(BisectingUtilsTest('test_load_state_journal'))
   suite.addTest(BisectingUtilsTest('test_tmp_cleanup'))
   suite.addTest(BisectingUtilsTest('test_verify_fail'))
   suite.addTest(BisectingUtilsTest('test_early_terminate'))
   suite.addTest(BisectingUtilsTest('test_no_prune'))
+  suite.addTest(BisectingUtilsTest('test_pass_build_cache'))
+  suite.addTest(BisectingUtilsTest('test_prefetch_probe'))
   suite.addTest(BisectingUtilsTest('test_set_file'))
+  suite.addTest(BisectingUtilsTest('test_parallel'))
   suite.addTest(BisectingUtilsTest('test_noincremental_prune'))
   suite.addTest(BisectTest('test_full_bisector'))
+  suite.addTest(BisectDriverTest('test_object_index'))
+  suite.addTest(BisectDriverTest('test_empty_object_index'))
+  suite.addTest(BisectDriverTest('test_triage_without_index'))
+  suite.addTest(BisectDriverTest('test_set_file_index'))
   suite.addTest(BisectStressTest('test_every_obj_bad'))
   suite.addTest(BisectStressTest('test_every_index_is_bad'))
   runner = unittest.TextTestRunner()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python2
+
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Benchmark object list lookups of the bisection compiler wrapper.
+
+In TRIAGE mode every compiler call looks its object up in the good list and in
+the bad set. This times those two lookups with a scan of the lists and with
+their indices (see bisect_driver.write_object_index).
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from binary_search_tool import bisect_driver
+
+
+def TimeLookups(objs, good_list, bad_set, lookups):
+  start = time.time()
+  for obj in random.sample(objs, lookups):
+    bisect_driver.in_object_list(obj, good_list)
+    bisect_driver.in_object_list(obj, bad_set)
+  return (time.time() - start) / lookups
+
+
+def Main(argv):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument(
+      '--obj_num',
+      type=int,
+      default=100000,
+      help='Number of objects in the lists. Defaults to %(default)s.')
+  parser.add_argument(
+      '--lookups',
+      type=int,
+      default=200,
+      help='Number of compiler calls to time. Defaults to %(default)s.')
+  options = parser.parse_args(argv)
+
+  objs = [
+      '/build/out/Release/obj/chrome/browser/file%d.o' % i
+      for i in range(options.obj_num)
+  ]
+  tempdir = tempfile.mkdtemp()
+  try:
+    good_list = os.path.join(tempdir, '_LIST')
+    bad_set = os.path.join(tempdir, 'bad_set')
+    with open(good_list, 'w') as f:
+      f.write('\n'.join(objs))
+    with open(bad_set, 'w') as f:
+      f.write('\n'.join(objs[:len(objs) / 2]))
+
+    scan = TimeLookups(objs, good_list, bad_set, options.lookups)
+    start = time.time()
+    bisect_driver.write_object_index(good_list)
+    bisect_driver.write_object_index(bad_set)
+    build = time.time() - start
+    indexed = TimeLookups(objs, good_list, bad_set, options.lookups)
+  finally:
+    shutil.rmtree(tempdir)
+
+  print('Objects: %d' % options.obj_num)
+  print('Scan:    %.3f ms per compiler call' % (scan * 1000))
+  print('Index:   %.3f ms per compiler call (%.0f ms to build the indices)' %
+        (indexed * 1000, build * 1000))
+  print('Speedup: %.0fx' % (scan / indexed))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(Main(sys.argv[1:]))
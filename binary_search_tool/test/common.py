@@ -1,15 +1,29 @@
 #!/usr/bin/env python2
 """Common utility functions."""
 
+import os
+import shutil
+
 DEFAULT_OBJECT_NUMBER = 1238
 DEFAULT_BAD_OBJECT_NUMBER = 23
 OBJECTS_FILE = 'objects.txt'
 WORKING_SET_FILE = 'working_set.txt'
 
 
+def _GetWorkingSetFile():
+  """Return the working set file, which is per work slot with --parallel."""
+  slot_dir = os.environ.get('BISECT_SLOT_DIR')
+  if not slot_dir:
+    return WORKING_SET_FILE
+  slot_file = os.path.join(slot_dir, WORKING_SET_FILE)
+  if not os.path.exists(slot_file):
+    shutil.copy(WORKING_SET_FILE, slot_file)
+  return slot_file
+
+
 def ReadWorkingSet():
   working_set = []
-  f = open(WORKING_SET_FILE, 'r')
+  f = open(_GetWorkingSetFile(), 'r')
   for l in f:
     working_set.append(int(l))
   f.close()
@@ -17,7 +31,7 @@ def ReadWorkingSet():
 
 
 def WriteWorkingSet(working_set):
-  f = open(WORKING_SET_FILE, 'w')
+  f = open(_GetWorkingSetFile(), 'w')
   for o in working_set:
     f.write('{0}\n'.format(o))
   f.close()
@@ -4,6 +4,10 @@
    The script diffs every *ELF* files by dissembling every *executable*
    section, which means it is not a FULL elf differ.
 
+   Files that are byte identical, or whose executable sections are identical,
+   are matched without being disassembled. The remaining ones are disassembled
+   in parallel, see "--jobs".
+
    A simple usage example -
      chromiumos_image_diff.py --image1 image-path-1 --image2 image-path-2
 
@@ -19,16 +23,160 @@ from __future__ import print_function
 __author__ = 'shenhan@google.com (Han Shen)'
 
 import argparse
+import difflib
+import filecmp
+import hashlib
+import itertools
+import multiprocessing
 import os
 import re
+import struct
+import subprocess
 import sys
 import tempfile
+import time
 
 import image_chromeos
 from cros_utils import command_executer
 from cros_utils import logger
 from cros_utils import misc
 
+ELF_MAGIC = '\x7fELF'
+
+# The section header fields and flags read by _CodeDigest.
+SHF_EXECINSTR = 0x4
+SHT_NOBITS = 8
+# The (e_shoff, e_shentsize, e_shnum, e_shstrndx) of the ELF header, and the
+# (sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size) of a section header,
+# for 32 and 64 bit ELF files.
+ELF_HEADERS = {
+    1: ('16x16xI10xHHH', '6I'),
+    2: ('16x24xQ10xHHH', 'IIQQQQ'),
+}
+
+# Outcomes of the hash phase of the comparison.
+IDENTICAL = 'identical'
+SAME_CODE = 'same code'
+CANDIDATE = 'candidate'
+
+
+def IsElfFile(path):
+  """Whether path is a regular file that starts with the ELF magic bytes."""
+  if os.path.islink(path) or not os.path.isfile(path):
+    return False
+  try:
+    with open(path, 'rb') as f:
+      return f.read(len(ELF_MAGIC)) == ELF_MAGIC
+  except IOError:
+    return False
+
+
+def _CodeDigest(path):
+  """Hash the executable sections of an ELF file, i.e. what "objdump -d" shows.
+
+  The name and the address of each section is part of the hash, the symbols
+  are not.
+
+  Returns:
+    The digest, or None if the section headers could not be read.
+  """
+  with open(path, 'rb') as f:
+    ident = f.read(16)
+    if len(ident) < 16 or ident[:4] != ELF_MAGIC or ident[4] not in '\1\2':
+      return None
+    endian = '<' if ident[5] == '\1' else '>'
+    (header_fmt, section_fmt) = ELF_HEADERS[ord(ident[4])]
+    header_fmt = endian + header_fmt
+    section_fmt = endian + section_fmt
+    f.seek(0)
+    try:
+      (shoff, shentsize, shnum, shstrndx) = struct.unpack(
+          header_fmt, f.read(struct.calcsize(header_fmt)))
+      if not shnum or shstrndx >= shnum:
+        return None
+      sections = []
+      for i in range(shnum):
+        f.seek(shoff + i * shentsize)
+        sections.append(
+            struct.unpack(section_fmt, f.read(struct.calcsize(section_fmt))))
+    except struct.error:
+      return None
+
+    f.seek(sections[shstrndx][4])
+    names = f.read(sections[shstrndx][5])
+    digest = hashlib.sha1()
+    for (name, sh_type, flags, addr, offset, size) in sections:
+      if not flags & SHF_EXECINSTR or sh_type == SHT_NOBITS:
+        continue
+      digest.update(names[name:names.find('\0', name)])
+      digest.update(struct.pack('>QQ', addr, size))
+      f.seek(offset)
+      data = f.read(size)
+      if len(data) != size:
+        return None
+      digest.update(data)
+    return digest.digest()
+
+
+def _HashCompare(paths):
+  """Compare 2 ELF files without disassembling them.
+
+  Returns:
+    IDENTICAL, SAME_CODE or CANDIDATE, if they need disassembling.
+  """
+  (path1, path2) = paths
+  try:
+    if filecmp.cmp(path1, path2, shallow=False):
+      return IDENTICAL
+    digest1 = _CodeDigest(path1)
+    if digest1 is not None and digest1 == _CodeDigest(path2):
+      return SAME_CODE
+  except EnvironmentError:
+    pass
+  return CANDIDATE
+
+
+def _Disassemble(path, rootfs):
+  """Start "objdump -d". Returns the process and its lines, without rootfs."""
+  with open(os.devnull, 'w') as devnull:
+    p = subprocess.Popen(['objdump', '-d', path],
+                         stdout=subprocess.PIPE,
+                         stderr=devnull)
+  return (p, (line.replace(rootfs, '') for line in p.stdout))
+
+
+def _DisassemblyDiff(args):
+  """Compare the disassembly of 2 ELF files as objdump streams it out.
+
+  Returns:
+    None if the disassembly matches. Otherwise the diff if want_diff, or ''.
+  """
+  (path1, rootfs1, path2, rootfs2, want_diff) = args
+  (p1, lines1) = _Disassemble(path1, rootfs1)
+  (p2, lines2) = _Disassemble(path2, rootfs2)
+  seen1 = []
+  seen2 = []
+  result = None
+  try:
+    for (line1, line2) in itertools.izip_longest(lines1, lines2):
+      if want_diff:
+        seen1.append(line1 or '')
+        seen2.append(line2 or '')
+      if line1 != line2:
+        result = ''
+        break
+    if result is not None and want_diff:
+      seen1.extend(lines1)
+      seen2.extend(lines2)
+      result = ''.join(
+          difflib.unified_diff(seen1, seen2, path1, path2, n=3))
+  finally:
+    for p in (p1, p2):
+      if p.poll() is None:
+        p.kill()
+      p.wait()
+  return result
+
 
 class CrosImage(object):
   """A cros image object."""
@@ -117,35 +265,26 @@ class CrosImage(object):
 
     self.logger.LogOutput(
         'Finding all elf files in "{0}" ...'.format(self.rootfs))
-    # Note '\;' must be prefixed by 'r'.
-    command = ('find "{0}" -type f -exec '
-               'bash -c \'file -b "{{}}" | grep -q "ELF"\''
-               r' \; '
-               r'-exec echo "{{}}" \;').format(self.rootfs)
-    self.logger.LogCmd(command)
-    _, out, _ = self._ce.RunCommandWOutput(command, print_to_console=False)
-    self.elf_files = out.splitlines()
-    self.logger.LogOutput(
-        'Total {0} elf files found.'.format(len(self.elf_files)))
+    start = time.time()
+    self.elf_files = []
+    for dirpath, _, filenames in os.walk(self.rootfs):
+      for filename in filenames:
+        path = os.path.join(dirpath, filename)
+        if IsElfFile(path):
+          self.elf_files.append(path)
+    self.logger.LogOutput('Total {0} elf files found in {1:.1f}s.'.format(
+        len(self.elf_files), time.time() - start))
     return True
 
 
 class ImageComparator(object):
   """A class that wraps comparsion actions."""
 
-  def __init__(self, images, diff_file):
+  def __init__(self, images, diff_file, jobs=None):
     self.images = images
     self.logger = logger.GetLogger()
     self.diff_file = diff_file
-    self.tempf1 = None
-    self.tempf2 = None
-
-  def Cleanup(self):
-    if self.tempf1 and self.tempf2:
-      command_executer.GetCommandExecuter().RunCommand(
-          'rm {0} {1}'.format(self.tempf1, self.tempf2))
-      logger.GetLogger(
-          'Removed "{0}" and "{1}".'.format(self.tempf1, self.tempf2))
+    self.jobs = jobs or multiprocessing.cpu_count()
 
   def CheckElfFileSetEquality(self):
     """Checking whether images have exactly number of elf files."""
@@ -189,54 +328,53 @@ class ImageComparator(object):
         'Start comparing {0} elf file by file ...'.format(len(i1.elf_files)))
     ## Note - i1.elf_files and i2.elf_files have exactly the same entries here.
 
-    ## Create 2 temp files to be used for all disassembed files.
-    handle, self.tempf1 = tempfile.mkstemp()
-    os.close(handle)  # We do not need the handle
-    handle, self.tempf2 = tempfile.mkstemp()
-    os.close(handle)
-
-    cmde = command_executer.GetCommandExecuter()
+    pairs = []
     for elf1 in i1.elf_files:
-      tmp_rootfs = i1.rootfs + '/'
-      f1 = elf1.replace(tmp_rootfs, '')
-      full_path1 = elf1
       full_path2 = elf1.replace(i1.rootfs, i2.rootfs)
-
-      if full_path1 == full_path2:
+      if elf1 == full_path2:
         self.logger.LogError(
-            'Error:  We\'re comparing the SAME file - {0}'.format(f1))
+            'Error:  We\'re comparing the SAME file - {0}'.format(
+                elf1.replace(i1.rootfs + '/', '')))
         continue
-
-      command = (
-          'objdump -d "{f1}" > {tempf1} ; '
-          'objdump -d "{f2}" > {tempf2} ; '
-          # Remove path string inside the dissemble
-          'sed -i \'s!{rootfs1}!!g\' {tempf1} ; '
-          'sed -i \'s!{rootfs2}!!g\' {tempf2} ; '
-          'diff {tempf1} {tempf2} 1>/dev/null 2>&1').format(
-              f1=full_path1,
-              f2=full_path2,
-              rootfs1=i1.rootfs,
-              rootfs2=i2.rootfs,
-              tempf1=self.tempf1,
-              tempf2=self.tempf2)
-      ret = cmde.RunCommand(command, print_to_console=False)
-      if ret != 0:
+      pairs.append((elf1, full_path2))
+
+    pool = multiprocessing.Pool(self.jobs)
+    try:
+      ## Phase 1 - match the byte identical files and the files with identical
+      ## executable sections.
+      start = time.time()
+      outcomes = pool.map(_HashCompare, pairs, chunksize=16)
+      candidates = [p for p, o in zip(pairs, outcomes) if o == CANDIDATE]
+      match_count += len(pairs) - len(candidates)
+      self.logger.LogOutput(
+          'Hash phase: {0} identical, {1} with identical code, {2} to '
+          'disassemble, in {3:.1f}s.'.format(
+              outcomes.count(IDENTICAL), outcomes.count(SAME_CODE),
+              len(candidates), time.time() - start))
+
+      ## Phase 2 - disassemble the rest.
+      start = time.time()
+      args = [(full_path1, i1.rootfs, full_path2, i2.rootfs,
+               bool(self.diff_file)) for full_path1, full_path2 in candidates]
+      diffs = pool.imap(_DisassemblyDiff, args)
+      for (full_path1, full_path2), diff in zip(candidates, diffs):
+        if diff is None:
+          match_count += 1
+          continue
         self.logger.LogOutput(
             '*** Not match - "{0}" "{1}"'.format(full_path1, full_path2))
-        mismatch_list.append(f1)
+        mismatch_list.append(full_path1.replace(i1.rootfs + '/', ''))
         if self.diff_file:
-          command = ('echo "Diffs of disassemble of \"{f1}\" and \"{f2}\"" '
-                     '>> {diff_file} ; diff {tempf1} {tempf2} '
-                     '>> {diff_file}').format(
-                         f1=full_path1,
-                         f2=full_path2,
-                         diff_file=self.diff_file,
-                         tempf1=self.tempf1,
-                         tempf2=self.tempf2)
-          cmde.RunCommand(command, print_to_console=False)
-      else:
-        match_count += 1
+          with open(self.diff_file, 'a') as f:
+            f.write('Diffs of disassemble of "{0}" and "{1}"\n'.format(
+                full_path1, full_path2))
+            f.write(diff)
+      self.logger.LogOutput(
+          'Disassembly phase: {0} files in {1:.1f}s.'.format(
+              len(candidates), time.time() - start))
+    finally:
+      pool.close()
+      pool.join()
     ## End of comparing every elf files.
 
     if not mismatch_list:
@@ -286,6 +424,13 @@ def Main(argv):
       dest='diff_file',
       default=None,
       help='Dumping all the diffs (if any) to the diff file')
+  parser.add_argument(
+      '--jobs',
+      dest='jobs',
+      type=int,
+      default=None,
+      help=('Number of elf files to compare in parallel. Defaults to the '
+            'number of cpus.'))
   parser.add_argument(
       '--image1',
       dest='image1',
@@ -307,7 +452,6 @@ def Main(argv):
     return 1
 
   result = False
-  image_comparator = None
   try:
     for i, image_path in enumerate([options.image1, options.image2], start=1):
       image_path = os.path.realpath(image_path)
@@ -346,13 +490,12 @@ def Main(argv):
         image.FindElfFiles()
 
     if len(images) == 2:
-      image_comparator = ImageComparator(images, options.diff_file)
+      image_comparator = ImageComparator(images, options.diff_file,
+                                         options.jobs)
       result = image_comparator.CompareImages()
   finally:
     for image in images:
       image.UnmountImage()
-    if image_comparator:
-      image_comparator.Cleanup()
 
   return 0 if result else 1
 
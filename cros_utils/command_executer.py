@@ -5,14 +5,20 @@
 
 from __future__ import print_function
 
+import atexit
+import fcntl
 import getpass
+import hashlib
 import os
+import pipes
 import re
 import select
+import shutil
 import signal
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 
 import logger
@@ -22,6 +28,10 @@ mock_default = False
 
 LOG_LEVEL = ('none', 'quiet', 'average', 'verbose')
 
+# Seconds between the checks of a command terminator that can not wake up
+# RunCommandGeneric, see CommandTerminator.AddWakeup.
+TERMINATOR_POLL_INTERVAL = 0.1
+
 
 def InitCommandExecuter(mock=False):
   # pylint: disable=global-statement
@@ -38,6 +48,233 @@ def GetCommandExecuter(logger_to_set=None, mock=False, log_level='verbose'):
     return CommandExecuter(log_level, logger_to_set)
 
 
+class SshConnectionPool(object):
+  """Keeps one multiplexed ssh connection open per ChromeOS box.
+
+  Running a command through remote_access.sh copies the command file to the
+  box and makes two more ssh connections, one to check that the box is up and
+  one to run the file. Instead, the pool starts an ssh ControlMaster for each
+  box on first use, and runs each command over it with the command streamed
+  on stdin, so that the following commands do not pay for a handshake at all.
+  """
+
+  # Connections made by a command run through remote_access.sh.
+  ROUND_TRIPS_PER_COMMAND = 3
+  # Seconds an idle master connection stays open.
+  CONTROL_PERSIST = 300
+  # Commands up to this size are inlined in the local shell command, larger
+  # ones are read from a file, as a single argument is limited to 128 KB.
+  MAX_INLINE_COMMAND = 64 * 1024
+  # Runs the command it reads from stdin. It is saved to a file first, rather
+  # than passed to bash -c, to take commands of any size; this also lets the
+  # command see the end of stdin like it used to.
+  REMOTE_RUNNER = ('f=$(mktemp) && cat > "$f" && bash "$f"; status=$?; '
+                   'rm -f "$f"; exit $status')
+  SSH_OPTIONS = ('-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null '
+                 '-o LogLevel=ERROR -o BatchMode=yes -o ConnectTimeout=30 '
+                 '-o ServerAliveInterval=10 -o ServerAliveCountMax=3')
+
+  def __init__(self):
+    self.enabled = True
+    self._lock = threading.Lock()
+    self._control_dir = None
+    self._key_files = {}
+    self._machine_locks = {}
+    self._masters = set()
+    self.num_commands = 0
+    self.round_trips_saved = 0
+
+  def _GetControlDir(self):
+    if self._control_dir is None:
+      self._control_dir = tempfile.mkdtemp(prefix='cros_ssh_')
+    return self._control_dir
+
+  def _GetKeyFile(self, chromeos_root):
+    """Return a private copy of the testing key, or None if there is none."""
+    with self._lock:
+      if chromeos_root not in self._key_files:
+        key_file = None
+        src = misc.GetChromeOSKeyFile(chromeos_root)
+        if os.path.isfile(src):
+          # ssh refuses keys that others can read.
+          key_file = os.path.join(self._GetControlDir(),
+                                  'testing_rsa_%d' % len(self._key_files))
+          shutil.copyfile(src, key_file)
+          os.chmod(key_file, 0600)
+        self._key_files[chromeos_root] = key_file
+      return self._key_files[chromeos_root]
+
+  def CanMultiplex(self, chromeos_root):
+    return self.enabled and self._GetKeyFile(chromeos_root) is not None
+
+  def _GetSshPrefix(self, chromeos_root, machine):
+    host, _, port = machine.partition(':')
+    control_path = os.path.join(self._GetControlDir(),
+                                hashlib.md5(machine).hexdigest()[:16])
+    prefix = 'ssh -p %s -i %s -o ControlPath=%s %s' % (
+        port or '22', self._GetKeyFile(chromeos_root), control_path,
+        self.SSH_OPTIONS)
+    return prefix, 'root@%s' % host, control_path
+
+  @staticmethod
+  def _Call(command):
+    """Run a local ssh command quietly and return its exit status."""
+    with open(os.devnull, 'r+') as devnull:
+      # Without close_fds, the master ssh daemonizes holding the pipes of the
+      # commands other threads are starting, which then never see EOF.
+      return subprocess.call(
+          command,
+          shell=True,
+          stdin=devnull,
+          stdout=devnull,
+          stderr=devnull,
+          close_fds=True)
+
+  def _EnsureMaster(self, chromeos_root, machine):
+    """Start the master connection to machine if it is not up.
+
+    Returns:
+      The number of connections made.
+    """
+    prefix, target, control_path = self._GetSshPrefix(chromeos_root, machine)
+    with self._lock:
+      machine_lock = self._machine_locks.setdefault(machine, threading.Lock())
+    with machine_lock:
+      if os.path.exists(control_path):
+        if self._Call('%s -O check %s' % (prefix, target)) == 0:
+          return 0
+        # The master is gone, e.g. the box rebooted, but left its socket.
+        try:
+          os.remove(control_path)
+        except OSError:
+          pass
+      self._Call('%s -o ControlMaster=yes -o ControlPersist=%d -f -N %s' %
+                 (prefix, self.CONTROL_PERSIST, target))
+      with self._lock:
+        self._masters.add((chromeos_root, machine))
+      return 1
+
+  def GetCommand(self, chromeos_root, machine, cmd):
+    """Return a local shell command that runs cmd on machine.
+
+    If the master connection could not be started, ssh makes a connection of
+    its own, so the command still runs.
+    """
+    connections = self._EnsureMaster(chromeos_root, machine)
+    prefix, target, _ = self._GetSshPrefix(chromeos_root, machine)
+    with self._lock:
+      self.num_commands += 1
+      self.round_trips_saved += self.ROUND_TRIPS_PER_COMMAND - connections
+    ssh = '%s -o ControlMaster=no %s %s' % (prefix, target,
+                                            pipes.quote(self.REMOTE_RUNNER))
+    if len(cmd) > self.MAX_INLINE_COMMAND:
+      fd, command_file = tempfile.mkstemp(prefix='cros_cmd.')
+      with os.fdopen(fd, 'w') as f:
+        f.write(cmd)
+      return ('%s < %s; status=$?; rm -f %s; exit $status' %
+              (ssh, command_file, command_file))
+    # Quote the delimiter so that cmd reaches the box unexpanded.
+    delimiter = 'CROS_CMD_%s' % hashlib.md5(cmd).hexdigest()
+    return "%s <<'%s'\n%s\n%s" % (ssh, delimiter, cmd, delimiter)
+
+  def Close(self):
+    """Stop all master connections."""
+    with self._lock:
+      masters = list(self._masters)
+      self._masters = set()
+    for chromeos_root, machine in masters:
+      prefix, target, _ = self._GetSshPrefix(chromeos_root, machine)
+      self._Call('%s -O exit %s' % (prefix, target))
+    if self._control_dir:
+      shutil.rmtree(self._control_dir, ignore_errors=True)
+      self._control_dir = None
+      self._key_files = {}
+
+
+_ssh_pool = None
+_ssh_pool_lock = threading.Lock()
+
+
+def GetSshConnectionPool():
+  # pylint: disable=global-statement
+  global _ssh_pool
+  with _ssh_pool_lock:
+    if _ssh_pool is None:
+      _ssh_pool = SshConnectionPool()
+      atexit.register(_ssh_pool.Close)
+    return _ssh_pool
+
+
+class _Wakeup(object):
+  """A pipe that other threads write to, to wake up a poll() on it."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._read_fd, self._write_fd = os.pipe()
+    # Do not leak the pipe into the commands.
+    for fd in (self._read_fd, self._write_fd):
+      fcntl.fcntl(fd, fcntl.F_SETFD,
+                  fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+    self._closed = False
+
+  def fileno(self):
+    return self._read_fd
+
+  def Notify(self):
+    with self._lock:
+      if not self._closed:
+        os.write(self._write_fd, 'x')
+
+  def Clear(self):
+    os.read(self._read_fd, 4096)
+
+  def Close(self):
+    with self._lock:
+      if not self._closed:
+        self._closed = True
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+
+def _WaitAndNotify(p, wakeup):
+  p.wait()
+  wakeup.Notify()
+
+
+class _OutputStream(object):
+  """Hands the output of a command read from one pipe to its consumers."""
+
+  def __init__(self, name, pobject, collect, line_consumer, log):
+    self._name = name
+    self._pobject = pobject
+    self._chunks = [] if collect else None
+    self._line_consumer = line_consumer
+    self._log = log
+    self._partial_line = ''
+
+  def Write(self, data):
+    if self._log:
+      self._log(data)
+    if self._chunks is not None:
+      self._chunks.append(data)
+    if self._line_consumer:
+      lines = (self._partial_line + data).split('\n')
+      self._partial_line = lines.pop()
+      for line in lines:
+        self._line_consumer(
+            line=line + '\n', output=self._name, pobject=self._pobject)
+
+  def Close(self):
+    # The last line may not end with a '\n'.
+    if self._line_consumer and self._partial_line:
+      self._line_consumer(
+          line=self._partial_line, output=self._name, pobject=self._pobject)
+      self._partial_line = ''
+
+  def GetValue(self):
+    return ''.join(self._chunks)
+
+
 class CommandExecuter(object):
   """Provides several methods to execute commands on several environments."""
 
@@ -66,9 +303,15 @@ class CommandExecuter(object):
                         command_timeout=None,
                         terminated_timeout=10,
                         print_to_console=True,
-                        except_handler=lambda p, e: None):
+                        except_handler=lambda p, e: None,
+                        line_consumer=None):
     """Run a command.
 
+    If line_consumer is given, it is called for each line of output as it
+    arrives, with the same keyword arguments as in RunCommand2 ('line',
+    'output' and 'pobject'), and the output is never held in memory as a
+    whole. The output is then not returned either.
+
     Returns triplet (returncode, stdout, stderr).
     """
 
@@ -92,11 +335,17 @@ class CommandExecuter(object):
         user = username + '@'
       cmd = "ssh -t -t %s%s -- '%s'" % (user, machine, cmd)
 
+    # Output that only goes back to the caller is not logged as well, unless
+    # it is shown on the console anyway.
+    log_output = self.logger and (print_to_console or not return_output)
+    collect_output = return_output and line_consumer is None
+
     # We use setsid so that the child will have a different session id
     # and we can easily kill the process group. This is also important
     # because the child will be disassociated from the parent terminal.
     # In this way the child cannot mess the parent's terminal.
     p = None
+    wakeup = _Wakeup()
     try:
       p = subprocess.Popen(
           cmd,
@@ -106,21 +355,36 @@ class CommandExecuter(object):
           preexec_fn=os.setsid,
           executable='/bin/bash')
 
-      full_stdout = ''
-      full_stderr = ''
-
-      # Pull output from pipes, send it to file/stdout/string
-      out = err = None
-      pipes = [p.stdout, p.stderr]
-
+      # Wake up the loop below as soon as the child exits or the command is
+      # terminated, rather than polling for it.
+      waiter = threading.Thread(target=_WaitAndNotify, args=(p, wakeup))
+      waiter.daemon = True
+      waiter.start()
+      add_wakeup = getattr(command_terminator, 'AddWakeup', None)
+      if add_wakeup:
+        add_wakeup(wakeup)
+
+      log_stdout = log_stderr = None
+      if log_output:
+        log_stdout = lambda s: self.logger.LogCommandOutput(s, print_to_console)
+        log_stderr = lambda s: self.logger.LogCommandError(s, print_to_console)
+      stdout_stream = _OutputStream('stdout', p, collect_output, line_consumer,
+                                    log_stdout)
+      stderr_stream = _OutputStream('stderr', p, collect_output, line_consumer,
+                                    log_stderr)
+      streams = {
+          p.stdout.fileno(): stdout_stream,
+          p.stderr.fileno(): stderr_stream
+      }
       my_poll = select.poll()
-      my_poll.register(p.stdout, select.POLLIN)
-      my_poll.register(p.stderr, select.POLLIN)
+      for fd in streams:
+        my_poll.register(fd, select.POLLIN)
+      my_poll.register(wakeup.fileno(), select.POLLIN)
 
       terminated_time = None
       started_time = time.time()
 
-      while len(pipes):
+      while streams:
         if command_terminator and command_terminator.IsTerminated():
           os.killpg(os.getpgid(p.pid), signal.SIGTERM)
           if self.logger:
@@ -129,37 +393,40 @@ class CommandExecuter(object):
                                  print_to_console)
           break
 
-        l = my_poll.poll(100)
-        for (fd, _) in l:
-          if fd == p.stdout.fileno():
-            out = os.read(p.stdout.fileno(), 16384)
-            if return_output:
-              full_stdout += out
-            if self.logger:
-              self.logger.LogCommandOutput(out, print_to_console)
-            if out == '':
-              pipes.remove(p.stdout)
-              my_poll.unregister(p.stdout)
-          if fd == p.stderr.fileno():
-            err = os.read(p.stderr.fileno(), 16384)
-            if return_output:
-              full_stderr += err
-            if self.logger:
-              self.logger.LogCommandError(err, print_to_console)
-            if err == '':
-              pipes.remove(p.stderr)
-              my_poll.unregister(p.stderr)
-
-        if p.poll() is not None:
-          if terminated_time is None:
-            terminated_time = time.time()
-          elif (terminated_timeout is not None and
-                time.time() - terminated_time > terminated_timeout):
-            if self.logger:
-              self.logger.LogWarning('Timeout of %s seconds reached since '
-                                     'process termination.' %
-                                     terminated_timeout, print_to_console)
-            break
+        deadlines = []
+        if command_timeout is not None:
+          deadlines.append(started_time + command_timeout)
+        if terminated_time is not None and terminated_timeout is not None:
+          deadlines.append(terminated_time + terminated_timeout)
+        if command_terminator and not add_wakeup:
+          deadlines.append(time.time() + TERMINATOR_POLL_INTERVAL)
+        poll_timeout = None
+        if deadlines:
+          poll_timeout = max(0, min(deadlines) - time.time()) * 1000
+
+        for (fd, _) in my_poll.poll(poll_timeout):
+          if fd == wakeup.fileno():
+            wakeup.Clear()
+            continue
+          data = os.read(fd, 65536)
+          if data:
+            streams[fd].Write(data)
+          else:
+            streams.pop(fd).Close()
+            my_poll.unregister(fd)
+
+        if p.returncode is not None and terminated_time is None:
+          terminated_time = time.time()
+        if not streams:
+          break
+
+        if (terminated_time is not None and terminated_timeout is not None and
+            time.time() - terminated_time > terminated_timeout):
+          if self.logger:
+            self.logger.LogWarning('Timeout of %s seconds reached since '
+                                   'process termination.' % terminated_timeout,
+                                   print_to_console)
+          break
 
         if (command_timeout is not None and
             time.time() - started_time > command_timeout):
@@ -170,16 +437,21 @@ class CommandExecuter(object):
                                    command_timeout, print_to_console)
           break
 
-        if out == err == '':
-          break
-
-      p.wait()
-      if return_output:
-        return (p.returncode, full_stdout, full_stderr)
+      waiter.join()
+      for stream in streams.values():
+        stream.Close()
+      if collect_output:
+        return (p.returncode, stdout_stream.GetValue(),
+                stderr_stream.GetValue())
       return (p.returncode, '', '')
     except BaseException as e:
       except_handler(p, e)
       raise
+    finally:
+      remove_wakeup = getattr(command_terminator, 'RemoveWakeup', None)
+      if remove_wakeup:
+        remove_wakeup(wakeup)
+      wakeup.Close()
 
   def RunCommand(self, *args, **kwargs):
     """Run a command.
@@ -276,6 +548,16 @@ class CommandExecuter(object):
         sys.exit(1)
     chromeos_root = os.path.expanduser(chromeos_root)
 
+    ssh_pool = GetSshConnectionPool()
+    if ssh_pool.CanMultiplex(chromeos_root):
+      return self.RunCommandGeneric(
+          ssh_pool.GetCommand(chromeos_root, machine, cmd),
+          return_output,
+          command_terminator=command_terminator,
+          command_timeout=command_timeout,
+          terminated_timeout=terminated_timeout,
+          print_to_console=print_to_console)
+
     # Write all commands to a file.
     command_file = self.WriteToTempShFile(cmd)
     retval = self.CopyFiles(
@@ -681,9 +963,24 @@ class CommandTerminator(object):
 
   def __init__(self):
     self.terminated = False
+    self._lock = threading.Lock()
+    self._wakeups = []
+
+  def AddWakeup(self, wakeup):
+    with self._lock:
+      self._wakeups.append(wakeup)
+
+  def RemoveWakeup(self, wakeup):
+    with self._lock:
+      self._wakeups.remove(wakeup)
 
   def Terminate(self):
     self.terminated = True
+    # Let the commands that are running notice right away.
+    with self._lock:
+      wakeups = list(self._wakeups)
+    for wakeup in wakeups:
+      wakeup.Notify()
 
   def IsTerminated(self):
     return self.terminated
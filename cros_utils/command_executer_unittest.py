@@ -3,11 +3,35 @@
 
 from __future__ import print_function
 
+import fcntl
+import glob
+import os
+import shutil
+import tempfile
+import threading
 import time
 import unittest
 
 import command_executer
 
+FAKE_SSH = """#!/bin/bash
+# Pretend to start, check and stop master connections, and run commands
+# locally. The master is up while its control file says so.
+for arg in "$@"; do
+  case "$arg" in
+    ControlPath=*) control_path="${arg#ControlPath=}";;
+  esac
+done
+for arg in "$@"; do
+  case "$arg" in
+    -N) echo up > "$control_path"; exit 0;;
+    check) [[ "$(cat "$control_path")" == up ]]; exit;;
+    exit) rm -f "$control_path"; exit 0;;
+  esac
+done
+eval "${@: -1}"
+"""
+
 
 class CommandExecuterTest(unittest.TestCase):
   """Test for CommandExecuter class."""
@@ -22,6 +46,168 @@ class CommandExecuterTest(unittest.TestCase):
     end = time.time()
     self.assertTrue(round(end - start) == timeout)
 
+  def testRunCommandWOutput(self):
+    ce = command_executer.CommandExecuter('quiet')
+    ret, out, err = ce.RunCommandWOutput(
+        "head -c 4000000 /dev/zero | tr '\\0' a; echo -n oops >&2; exit 2")
+    self.assertEqual(ret, 2)
+    self.assertEqual(out, 'a' * 4000000)
+    self.assertEqual(err, 'oops')
+
+  def testLineConsumer(self):
+    ce = command_executer.CommandExecuter('quiet')
+    lines = []
+
+    def Consume(line, output, pobject):
+      self.assertIsNotNone(pobject)
+      lines.append((output, line))
+
+    ret, out, _ = ce.RunCommandGeneric(
+        'echo one; echo two >&2; echo three; echo -n four',
+        return_output=True,
+        line_consumer=Consume)
+    self.assertEqual(ret, 0)
+    self.assertEqual(out, '')
+    self.assertEqual([l for l in lines if l[0] == 'stdout'],
+                     [('stdout', 'one\n'), ('stdout', 'three\n'),
+                      ('stdout', 'four')])
+    self.assertEqual([l for l in lines if l[0] == 'stderr'],
+                     [('stderr', 'two\n')])
+
+  def testTerminate(self):
+    ce = command_executer.CommandExecuter('quiet')
+    terminator = command_executer.CommandTerminator()
+    timer = threading.Timer(0.5, terminator.Terminate)
+    timer.start()
+    start = time.time()
+    ce.RunCommand('sleep 20', command_terminator=terminator)
+    self.assertLess(time.time() - start, 5)
+
+  def testTerminatedTimeout(self):
+    # The background process keeps the output pipes open after the shell
+    # exits.
+    ce = command_executer.CommandExecuter('quiet')
+    start = time.time()
+    ret, out, _ = ce.RunCommandWOutput(
+        'sleep 10 & echo started; exit 3', terminated_timeout=1)
+    self.assertEqual(ret, 3)
+    self.assertEqual(out, 'started\n')
+    self.assertLess(time.time() - start, 5)
+
+  def testTerminatorWithoutWakeup(self):
+    ce = command_executer.CommandExecuter('quiet')
+    terminator = PollingTerminator()
+    timer = threading.Timer(0.5, setattr, (terminator, 'terminated', True))
+    timer.start()
+    start = time.time()
+    ce.RunCommand('sleep 20', command_terminator=terminator)
+    timer.join()
+    self.assertLess(time.time() - start, 5)
+
+  def testWakeupIsNotInherited(self):
+    wakeup = command_executer._Wakeup()
+    try:
+      for fd in (wakeup.fileno(), wakeup._write_fd):
+        self.assertTrue(fcntl.fcntl(fd, fcntl.F_GETFD) & fcntl.FD_CLOEXEC)
+    finally:
+      wakeup.Close()
+
+
+class PollingTerminator(object):
+  """A command terminator that can not wake up RunCommandGeneric."""
+
+  def __init__(self):
+    self.terminated = False
+
+  def IsTerminated(self):
+    return self.terminated
+
+
+class SshConnectionPoolTest(unittest.TestCase):
+  """Test for SshConnectionPool class."""
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.chromeos_root = os.path.join(self.tmpdir, 'chromeos')
+    key_dir = os.path.join(self.chromeos_root, 'src', 'scripts',
+                           'mod_for_test_scripts', 'ssh_keys')
+    os.makedirs(key_dir)
+    with open(os.path.join(key_dir, 'testing_rsa'), 'w') as f:
+      f.write('fake key')
+    bin_dir = os.path.join(self.tmpdir, 'bin')
+    os.mkdir(bin_dir)
+    with open(os.path.join(bin_dir, 'ssh'), 'w') as f:
+      f.write(FAKE_SSH)
+    os.chmod(os.path.join(bin_dir, 'ssh'), 0755)
+    self.saved_path = os.environ['PATH']
+    os.environ['PATH'] = bin_dir + ':' + self.saved_path
+    self.saved_pool = command_executer.GetSshConnectionPool()
+    self.pool = command_executer.SshConnectionPool()
+    command_executer._ssh_pool = self.pool
+
+  def tearDown(self):
+    self.pool.Close()
+    command_executer._ssh_pool = self.saved_pool
+    os.environ['PATH'] = self.saved_path
+    shutil.rmtree(self.tmpdir)
+
+  def testCanMultiplex(self):
+    self.assertTrue(self.pool.CanMultiplex(self.chromeos_root))
+    self.assertFalse(self.pool.CanMultiplex(self.tmpdir))
+    self.pool.enabled = False
+    self.assertFalse(self.pool.CanMultiplex(self.chromeos_root))
+
+  def testCrosRunCommand(self):
+    ce = command_executer.CommandExecuter('quiet')
+    # The command must reach the remote shell unexpanded, and must not be
+    # able to read itself from stdin.
+    cmd = "cat; x='$HOME'; echo \"$x $((1 + 2))\"; exit 3"
+    ret, out, _ = ce.CrosRunCommandWOutput(
+        cmd, machine='lumpy1', chromeos_root=self.chromeos_root)
+    self.assertEqual(ret, 3)
+    self.assertEqual(out, '$HOME 3\n')
+    self.assertEqual(self.pool.num_commands, 1)
+    # The first command pays for the master connection.
+    self.assertEqual(self.pool.round_trips_saved,
+                     self.pool.ROUND_TRIPS_PER_COMMAND - 1)
+
+    self.assertEqual(
+        ce.CrosRunCommand(
+            'true', machine='lumpy1', chromeos_root=self.chromeos_root), 0)
+    self.assertEqual(self.pool.num_commands, 2)
+    self.assertEqual(self.pool.round_trips_saved,
+                     2 * self.pool.ROUND_TRIPS_PER_COMMAND - 1)
+
+  def testLargeCrosRunCommand(self):
+    ce = command_executer.CommandExecuter('quiet')
+    # Larger than a single argument may be.
+    cmd = 'cat; x=%s; echo ${#x}' % ('a' * 200 * 1024)
+    ret, out, _ = ce.CrosRunCommandWOutput(
+        cmd, machine='lumpy1', chromeos_root=self.chromeos_root)
+    self.assertEqual(ret, 0)
+    self.assertEqual(out, '%d\n' % (200 * 1024))
+    # The file holding the command is removed.
+    self.assertEqual(
+        glob.glob(os.path.join(tempfile.gettempdir(), 'cros_cmd.*')), [])
+
+  def testDeadMasterIsRestarted(self):
+    ce = command_executer.CommandExecuter('quiet')
+    self.assertEqual(
+        ce.CrosRunCommand(
+            'true', machine='lumpy1', chromeos_root=self.chromeos_root), 0)
+    # The box rebooted: the master is gone but its socket is left behind.
+    _, _, control_path = self.pool._GetSshPrefix(self.chromeos_root, 'lumpy1')
+    with open(control_path, 'w') as f:
+      f.write('down\n')
+
+    self.assertEqual(
+        ce.CrosRunCommand(
+            'true', machine='lumpy1', chromeos_root=self.chromeos_root), 0)
+    with open(control_path) as f:
+      self.assertEqual(f.read(), 'up\n')
+    # Both commands paid for a master connection.
+    self.assertEqual(self.pool.round_trips_saved,
+                     2 * (self.pool.ROUND_TRIPS_PER_COMMAND - 1))
 
 if __name__ == '__main__':
   unittest.main()
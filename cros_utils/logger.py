@@ -4,8 +4,13 @@
 from __future__ import print_function
 
 # System modules
+import atexit
+import json
 import os.path
+import Queue
 import sys
+import threading
+import time
 import traceback
 
 
@@ -199,6 +204,207 @@ class Logger(object):
     self.stderr.flush()
 
 
+class LogContainer(object):
+  """A single file holding the logs of many loggers, see ContainerLogger.
+
+  The messages are queued and written by a thread of the container, a batch at
+  a time, once enough are queued or they have waited long enough. Each batch
+  appends a segment per log and stream to the data file, and a line locating
+  it to the index file, <path>.index.
+  """
+
+  STREAMS = ('cmd', 'out', 'err')
+  # Number of messages queued before the loggers wait for the writer.
+  MAX_QUEUED = 10000
+  # A batch is written once it has this many bytes, or its first message is
+  # this many seconds old.
+  FLUSH_BYTES = 1024 * 1024
+  FLUSH_INTERVAL = 1.0
+
+  def __init__(self, rootdir, basefilename, subdir='logs'):
+    """Create the container <rootdir>/<subdir>/<basefilename>N.log.
+
+    Like the files of a Logger, the containers of the last MAX_LOG_FILES runs
+    are kept, and <basefilename>.log links to the current one.
+    """
+    logdir = os.path.join(rootdir, subdir)
+    try:
+      os.makedirs(logdir)
+    except OSError:
+      pass
+    basename = os.path.join(logdir, basefilename)
+    self.path = self._FindPath(basename)
+    self._data = open(self.path, 'wb')
+    self._index = open('%s.index' % self.path, 'w')
+    for src, dest in ((self.path, '%s.log' % basename),
+                      ('%s.index' % self.path, '%s.log.index' % basename)):
+      try:
+        if os.path.lexists(dest):
+          os.remove(dest)
+        os.symlink(os.path.basename(src), dest)
+      except OSError as ex:
+        print('Exception while creating symlinks: %s' % str(ex))
+
+    self._queue = Queue.Queue(self.MAX_QUEUED)
+    self._closed = False
+    self._writer = threading.Thread(target=self._Run, name='LogContainer')
+    self._writer.daemon = True
+    self._writer.start()
+    atexit.register(self.Close)
+
+  def _FindPath(self, basename):
+    paths = ['%s%d.log' % (basename, i) for i in range(Logger.MAX_LOG_FILES)]
+    for path in paths:
+      if not os.path.exists(path):
+        return path
+    # Reuse the oldest one.
+    return min(paths, key=os.path.getmtime)
+
+  def Write(self, name, stream, msg):
+    """Queue msg for the stream (cmd/out/err) of the log name.
+
+    Messages written once the container is closed are dropped.
+    """
+    if not self._closed:
+      self._queue.put((name, stream, msg))
+
+  def Flush(self):
+    """Wait until everything written so far is in the file."""
+    if not self._closed:
+      done = threading.Event()
+      self._queue.put(done)
+      done.wait()
+
+  def Close(self):
+    if not self._closed:
+      self._closed = True
+      self._queue.put(None)
+      self._writer.join()
+      self._data.close()
+      self._index.close()
+
+  def _Run(self):
+    batch = []
+    size = 0
+    deadline = None
+    while True:
+      try:
+        if batch:
+          item = self._queue.get(timeout=max(0, deadline - time.time()))
+        else:
+          item = self._queue.get()
+      except Queue.Empty:
+        item = False
+      if isinstance(item, tuple):
+        if not batch:
+          deadline = time.time() + self.FLUSH_INTERVAL
+        batch.append(item)
+        size += len(item[2])
+        if size < self.FLUSH_BYTES:
+          continue
+      self._WriteBatch(batch)
+      batch = []
+      size = 0
+      if item is None:
+        return
+      if hasattr(item, 'set'):
+        # A Flush is waiting for the batch.
+        item.set()
+
+  def _WriteBatch(self, batch):
+    # Group the messages of each log and stream, in order, into one segment.
+    segments = {}
+    order = []
+    for name, stream, msg in batch:
+      if (name, stream) not in segments:
+        segments[(name, stream)] = []
+        order.append((name, stream))
+      segments[(name, stream)].append(msg)
+    for name, stream in order:
+      data = ''.join(segments[(name, stream)])
+      if isinstance(data, unicode):
+        data = data.encode('utf-8')
+      offset = self._data.tell()
+      self._data.write(data)
+      self._index.write(
+          json.dumps([name, stream, offset, len(data)]) + '\n')
+    self._data.flush()
+    self._index.flush()
+
+  @staticmethod
+  def Read(path, name, stream):
+    """Return what the logger name wrote to stream in the container at path."""
+    chunks = []
+    with open('%s.index' % path) as index, open(path, 'rb') as data:
+      for line in index:
+        try:
+          segment_name, segment_stream, offset, length = json.loads(line)
+        except ValueError:
+          # The last line of a container that is being written.
+          continue
+        if segment_name == name and segment_stream == stream:
+          data.seek(offset)
+          chunks.append(data.read(length))
+    return ''.join(chunks)
+
+  @staticmethod
+  def Names(path):
+    """Return the names of the loggers in the container at path."""
+    names = set()
+    with open('%s.index' % path) as index:
+      for line in index:
+        try:
+          names.add(json.loads(line)[0])
+        except ValueError:
+          continue
+    return sorted(names)
+
+  @staticmethod
+  def Extract(path, name, dest_dir):
+    """Write the logs of name in the container at path to dest_dir/name.*."""
+    for stream in LogContainer.STREAMS:
+      with open(os.path.join(dest_dir, '%s.%s' % (name, stream)), 'wb') as f:
+        f.write(LogContainer.Read(path, name, stream))
+
+
+class _ContainerStream(object):
+  """A file-like stream of a log in a LogContainer."""
+
+  def __init__(self, container, name, stream):
+    self._container = container
+    self._name = name
+    self._stream = stream
+
+  def write(self, msg):
+    self._container.Write(self._name, self._stream, msg)
+
+  def flush(self):
+    # The container writes in batches.
+    pass
+
+
+class ContainerLogger(Logger):
+  """A Logger writing its .cmd, .out and .err logs to a LogContainer.
+
+  This opens no files, and the messages are written by the container, so many
+  of these can log at once cheaply.
+  """
+
+  # pylint: disable=super-init-not-called
+  def __init__(self, container, name, print_console):
+    """Log as name in container."""
+    self.print_console = print_console
+    self.container = container
+    self.cmdfd = _ContainerStream(container, name, 'cmd')
+    self.stdout = _ContainerStream(container, name, 'out')
+    self.stderr = _ContainerStream(container, name, 'err')
+
+    self._WriteTo(self.cmdfd, ' '.join(sys.argv), True)
+
+  def Flush(self):
+    self.container.Flush()
+
+
 class MockLogger(object):
   """Logging helper class."""
 
@@ -0,0 +1,106 @@
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Tests for the log container of logger.py."""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import logger
+
+
+class LogContainerTest(unittest.TestCase):
+  """Tests for LogContainer and ContainerLogger."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testLogAndRead(self):
+    container = logger.LogContainer(self.tempdir, 'run')
+    path = os.path.join(self.tempdir, 'logs', 'run0.log')
+    self.assertEqual(container.path, path)
+
+    run1 = logger.ContainerLogger(container, 'run.1', False)
+    run2 = logger.ContainerLogger(container, 'run.2', False)
+    run1.LogCmd('ls', 'machine')
+    run2.LogOutput('two')
+    run1.LogOutput('one')
+    run1.LogCommandOutput('output of ls\n')
+    run2.LogError('failed')
+    run1.Flush()
+
+    self.assertEqual(
+        logger.LogContainer.Read(path, 'run.1', 'cmd'),
+        ' '.join(sys.argv) + 'CMD (machine): ls\n')
+    self.assertEqual(
+        logger.LogContainer.Read(path, 'run.1', 'out'),
+        'OUTPUT: one\noutput of ls\n')
+    self.assertEqual(logger.LogContainer.Read(path, 'run.1', 'err'), '')
+    self.assertEqual(
+        logger.LogContainer.Read(path, 'run.2', 'err'), 'ERROR: failed\n')
+    self.assertEqual(logger.LogContainer.Names(path), ['run.1', 'run.2'])
+
+    # The current container can be found without its suffix.
+    self.assertEqual(
+        logger.LogContainer.Read(
+            os.path.join(self.tempdir, 'logs', 'run.log'), 'run.2', 'out'),
+        'OUTPUT: two\n')
+
+    logger.LogContainer.Extract(path, 'run.1', self.tempdir)
+    with open(os.path.join(self.tempdir, 'run.1.out')) as f:
+      self.assertEqual(f.read(), 'OUTPUT: one\noutput of ls\n')
+    container.Close()
+
+  def testBatches(self):
+    container = logger.LogContainer(self.tempdir, 'run')
+    container.FLUSH_INTERVAL = 3600
+    run = logger.ContainerLogger(container, 'run', False)
+    # Get the command line the logger starts with out of the way.
+    run.Flush()
+    line = 'OUTPUT: %s\n' % ('x' * 10)
+    container.FLUSH_BYTES = 10 * len(line)
+    threads = [
+        threading.Thread(target=run.LogOutput, args=('x' * 10,))
+        for _ in range(5)
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    for _ in range(5):
+      run.LogOutput('x' * 10)
+    # The tenth message fills the batch.
+    while not logger.LogContainer.Read(container.path, 'run', 'out'):
+      time.sleep(0.01)
+    self.assertEqual(
+        logger.LogContainer.Read(container.path, 'run', 'out'), line * 10)
+    # All ten went to a single segment, after the one of the command line.
+    with open('%s.index' % container.path) as f:
+      self.assertEqual(len(f.readlines()), 2)
+    container.Close()
+
+  def testSuffixes(self):
+    for i in range(3):
+      container = logger.LogContainer(self.tempdir, 'run')
+      self.assertEqual(container.path,
+                       os.path.join(self.tempdir, 'logs', 'run%d.log' % i))
+      logger.ContainerLogger(container, 'run', False).LogOutput(str(i))
+      container.Close()
+    self.assertEqual(
+        logger.LogContainer.Read(
+            os.path.join(self.tempdir, 'logs', 'run.log'), 'run', 'out'),
+        'OUTPUT: 2\n')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -68,6 +68,7 @@ import numpy
 
 from email_sender import EmailSender
 import misc
+import stats
 
 
 def _AllFloat(values):
@@ -103,35 +104,37 @@ class TableGenerator(object):
     self._labels = l
     self._sort = sort
     self._key_name = key_name
+    self._values_by_key = None
 
   def _AggregateKeys(self):
     keys = set([])
     for run_list in self._runs:
       for run in run_list:
-        keys = keys.union(run.keys())
+        keys.update(run)
     return keys
 
+  def _GetValues(self, key):
+    """Return the values of key in all the runs, as floats if they all are."""
+    if self._values_by_key is None:
+      # Collect the values of all the keys in one pass over the runs.
+      values_by_key = {}
+      for run_list in self._runs:
+        for run in run_list:
+          for k, v in run.iteritems():
+            values_by_key.setdefault(k, []).append(v)
+      for k, values in values_by_key.iteritems():
+        values = _StripNone(values)
+        if _AllFloat(values):
+          values = _GetFloats(values)
+        values_by_key[k] = values
+      self._values_by_key = values_by_key
+    return self._values_by_key.get(key, [])
+
   def _GetHighestValue(self, key):
-    values = []
-    for run_list in self._runs:
-      for run in run_list:
-        if key in run:
-          values.append(run[key])
-    values = _StripNone(values)
-    if _AllFloat(values):
-      values = _GetFloats(values)
-    return max(values)
+    return max(self._GetValues(key))
 
   def _GetLowestValue(self, key):
-    values = []
-    for run_list in self._runs:
-      for run in run_list:
-        if key in run:
-          values.append(run[key])
-    values = _StripNone(values)
-    if _AllFloat(values):
-      values = _GetFloats(values)
-    return min(values)
+    return min(self._GetValues(key))
 
   def _SortKeys(self, keys):
     if self._sort == self.SORT_BY_KEYS:
@@ -207,6 +210,94 @@ class TableGenerator(object):
     return table
 
 
+def _SequentialSum(values):
+  """Sum the rows of values left to right, like sum() does on a list."""
+  total = numpy.zeros(values.shape[0])
+  for i in xrange(values.shape[1]):
+    total = total + values[:, i]
+  return total
+
+
+def _GetGmeans(values):
+  """Vectorized Result._GetGmean, of each row of values."""
+  with numpy.errstate(divide='ignore', invalid='ignore'):
+    log_sum = _SequentialSum(numpy.log(numpy.where(values > 0, values, 1.0)))
+    gmeans = numpy.exp(log_sum / values.shape[1])
+  gmeans[(values == 0).any(axis=1)] = 0.0
+  gmeans[(values < 0).any(axis=1)] = float('nan')
+  return gmeans
+
+
+def _BetaCf(a, b, x):
+  """Vectorized stats.lbetacf, over x, with the same steps."""
+  itmax = 200
+  eps = 3.0e-7
+
+  result = numpy.empty(x.shape)
+  result.fill(float('nan'))
+  pending = numpy.ones(x.shape, dtype=bool)
+  bm = az = am = numpy.ones(x.shape)
+  qab = a + b
+  qap = a + 1.0
+  qam = a - 1.0
+  bz = 1.0 - qab * x / qap
+  for i in xrange(itmax + 1):
+    em = float(i + 1)
+    tem = em + em
+    d = em * (b - em) * x / ((qam + tem) * (a + tem))
+    ap = az + d * am
+    bp = bz + d * bm
+    d = -(a + em) * (qab + em) * x / ((qap + tem) * (a + tem))
+    app = ap + d * az
+    bpp = bp + d * bz
+    aold = az
+    am = ap / bpp
+    bm = bp / bpp
+    az = app / bpp
+    bz = 1.0
+    converged = pending & (abs(az - aold) < (eps * abs(az)))
+    result[converged] = az[converged]
+    pending &= ~converged
+    if not pending.any():
+      break
+  return result
+
+
+def _Betai(a, b, x):
+  """Vectorized stats.lbetai, over x, with the same steps."""
+  gammln = stats.gammln(a + b) - stats.gammln(a) - stats.gammln(b)
+  with numpy.errstate(divide='ignore', invalid='ignore'):
+    bt = numpy.exp(gammln + a * numpy.log(x) + b * numpy.log(1.0 - x))
+  bt[(x == 0.0) | (x == 1.0)] = 0.0
+  result = numpy.empty(x.shape)
+  low = x < (a + 1.0) / (a + b + 2.0)
+  result[low] = bt[low] * _BetaCf(a, b, x[low]) / float(a)
+  high = ~low
+  result[high] = 1.0 - bt[high] * _BetaCf(b, a, 1.0 - x[high]) / float(b)
+  return result
+
+
+def _TTestInd(a, b):
+  """Vectorized stats.lttest_ind, of the rows of a and b.
+
+  Returns:
+    The two-tailed probabilities.
+  """
+  n1 = a.shape[1]
+  n2 = b.shape[1]
+  x1 = _SequentialSum(a) / float(n1)
+  x2 = _SequentialSum(b) / float(n2)
+  dev1 = a - x1[:, numpy.newaxis]
+  dev2 = b - x2[:, numpy.newaxis]
+  v1 = numpy.sqrt(_SequentialSum(dev1 * dev1) / float(n1 - 1))**2
+  v2 = numpy.sqrt(_SequentialSum(dev2 * dev2) / float(n2 - 1))**2
+  df = n1 + n2 - 2
+  svar = ((n1 - 1) * v1 + (n2 - 1) * v2) / float(df)
+  svar[svar == 0] = 1.0e-26
+  t = (x1 - x2) / numpy.sqrt(svar * (1.0 / n1 + 1.0 / n2))
+  return _Betai(0.5 * df, 0.5, df / (df + t * t))
+
+
 class Result(object):
   """A class that respresents a single result.
 
@@ -231,6 +322,23 @@ class Result(object):
   def _ComputeFloat(self, cell, values, baseline_values):
     self._Literal(cell, values, baseline_values)
 
+  def _ComputeFloats(self, values, baseline_values):
+    """Vectorized _ComputeFloat, for the cells of many rows at once.
+
+    Results that have one give the same values as _ComputeFloat, see
+    ColumnarTable.
+
+    Args:
+      values: A 2-D array, the float values of a cell in each row.
+      baseline_values: A 2-D array of the baseline values of the cells, or None
+        if they have no baseline.
+
+    Returns:
+      A list or array of the values of the cells, of the types _ComputeFloat
+      gives them, or None if this is not supported.
+    """
+    return None
+
   def _ComputeString(self, cell, values, baseline_values):
     self._Literal(cell, values, baseline_values)
 
@@ -345,6 +453,9 @@ class AmeanResult(StringMeanResult):
   def _ComputeFloat(self, cell, values, baseline_values):
     cell.value = numpy.mean(values)
 
+  def _ComputeFloats(self, values, baseline_values):
+    return numpy.mean(values, axis=1)
+
 
 class RawResult(Result):
   """Raw result."""
@@ -357,6 +468,9 @@ class MinResult(Result):
   def _ComputeFloat(self, cell, values, baseline_values):
     cell.value = min(values)
 
+  def _ComputeFloats(self, values, baseline_values):
+    return values.min(axis=1).tolist()
+
   def _ComputeString(self, cell, values, baseline_values):
     if values:
       cell.value = min(values)
@@ -370,6 +484,9 @@ class MaxResult(Result):
   def _ComputeFloat(self, cell, values, baseline_values):
     cell.value = max(values)
 
+  def _ComputeFloats(self, values, baseline_values):
+    return values.max(axis=1).tolist()
+
   def _ComputeString(self, cell, values, baseline_values):
     if values:
       cell.value = max(values)
@@ -390,6 +507,9 @@ class StdResult(NumericalResult):
   def _ComputeFloat(self, cell, values, baseline_values):
     cell.value = numpy.std(values)
 
+  def _ComputeFloats(self, values, baseline_values):
+    return numpy.std(values, axis=1)
+
 
 class CoeffVarResult(NumericalResult):
   """Standard deviation / Mean"""
@@ -401,6 +521,14 @@ class CoeffVarResult(NumericalResult):
       noise = 0.0
     cell.value = noise
 
+  def _ComputeFloats(self, values, baseline_values):
+    means = numpy.mean(values, axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+      noise = list(numpy.abs(numpy.std(values, axis=1) / means))
+    for i in numpy.flatnonzero(means == 0.0):
+      noise[i] = 0.0
+    return noise
+
 
 class ComparisonResult(Result):
   """Same or Different."""
@@ -431,9 +559,13 @@ class PValueResult(ComparisonResult):
     if len(values) < 2 or len(baseline_values) < 2:
       cell.value = float('nan')
       return
-    import stats
     _, cell.value = stats.lttest_ind(values, baseline_values)
 
+  def _ComputeFloats(self, values, baseline_values):
+    if values.shape[1] < 2 or baseline_values.shape[1] < 2:
+      return [float('nan')] * values.shape[0]
+    return _TTestInd(values, baseline_values).tolist()
+
   def _ComputeString(self, cell, values, baseline_values):
     return float('nan')
 
@@ -492,6 +624,15 @@ class AmeanRatioResult(KeyAwareComparisonResult):
       cell.value = 1.00
       # no difference if both values and baseline_values are 0
 
+  def _ComputeFloats(self, values, baseline_values):
+    means = numpy.mean(values, axis=1)
+    baseline_means = numpy.mean(baseline_values, axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+      ratios = list(means / baseline_means)
+    for i in numpy.flatnonzero(baseline_means == 0):
+      ratios[i] = 0.00 if means[i] != 0 else 1.00
+    return ratios
+
 
 class GmeanRatioResult(KeyAwareComparisonResult):
   """Ratio of geometric means of values vs. baseline values."""
@@ -504,6 +645,15 @@ class GmeanRatioResult(KeyAwareComparisonResult):
     else:
       cell.value = 1.00
 
+  def _ComputeFloats(self, values, baseline_values):
+    gmeans = _GetGmeans(values)
+    baseline_gmeans = _GetGmeans(baseline_values)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+      ratios = (gmeans / baseline_gmeans).tolist()
+    for i in numpy.flatnonzero(baseline_gmeans == 0):
+      ratios[i] = 0.00 if gmeans[i] != 0 else 1.00
+    return ratios
+
 
 class Color(object):
   """Class that represents color in RGBA format."""
@@ -761,6 +911,94 @@ class Column(object):
     self.name = name
 
 
+def _DefiningClass(cls, name):
+  for klass in cls.__mro__:
+    if name in klass.__dict__:
+      return klass
+
+
+class ColumnarTable(object):
+  """The float values of a table, converted once for all its columns.
+
+  The cells of a result column are computed together, with numpy, by the
+  _ComputeFloats of the result. This gives the values Result.Compute gives the
+  cells one at a time.
+  """
+
+  def __init__(self, table):
+    """Convert the values of the table.
+
+    Args:
+      table: A table generated by TableGenerator.
+    """
+    # The floats of each cell, by label and row, or None if they are not all
+    # floats.
+    self._floats = []
+    for label_index in xrange(1, len(table[0])):
+      floats = []
+      for row in table[1:]:
+        values = _StripNone(row[label_index])
+        if values and _AllFloat(values):
+          floats.append(_GetFloats(values))
+        else:
+          floats.append(None)
+      self._floats.append(floats)
+
+  @staticmethod
+  def Supports(result):
+    """Whether the cells of result can be computed column-wise."""
+    cls = type(result)
+    return (cls.Compute.im_func is Result.Compute.im_func and
+            _DefiningClass(cls, '_ComputeFloats') is _DefiningClass(
+                cls, '_ComputeFloat'))
+
+  def Compute(self, result, label_index, baseline_index=None):
+    """Compute the values of the cells of result for a label.
+
+    Args:
+      result: The Result of the column.
+      label_index: The index of the label, from 0.
+      baseline_index: The index of the baseline label, or None if the cells
+        have no baseline.
+
+    Returns:
+      A list of the values of the cells, by row. A value is None if the cell
+      needs Result.Compute, because its values (or baseline values) are not all
+      floats. The list is None if result does not support this.
+    """
+    if not self.Supports(result):
+      return None
+    floats = self._floats[label_index]
+    if baseline_index is None:
+      if result.NeedsBaseline():
+        return None
+      baseline_floats = [[]] * len(floats)
+    else:
+      baseline_floats = self._floats[baseline_index]
+
+    # Group the rows by the number of values, so each group is an array.
+    groups = {}
+    for row_index, (values, baseline_values) in enumerate(
+        zip(floats, baseline_floats)):
+      if values is not None and baseline_values is not None:
+        groups.setdefault((len(values), len(baseline_values)),
+                          []).append(row_index)
+
+    cell_values = [None] * len(floats)
+    for rows in groups.itervalues():
+      values = numpy.array([floats[i] for i in rows])
+      if baseline_index is None:
+        baseline_values = None
+      else:
+        baseline_values = numpy.array([baseline_floats[i] for i in rows])
+      group_values = result._ComputeFloats(values, baseline_values)
+      if group_values is None:
+        return None
+      for row_index, value in zip(rows, group_values):
+        cell_values[row_index] = value
+    return cell_values
+
+
 # Takes in:
 # ["Key", "Label1", "Label2"]
 # ["k", ["v", "v2"], [v3]]
@@ -777,23 +1015,41 @@ class TableFormatter(object):
   formats to apply to the table and returns a table of cells.
   """
 
-  def __init__(self, table, columns):
+  def __init__(self, table, columns, vectorize=True):
     """The constructor takes in a table and a list of columns.
 
     Args:
       table: A list of lists of values.
       columns: A list of column containing what to produce and how to format it.
+      vectorize: Whether to compute the cells of a column together, see
+        ColumnarTable.
     """
     self._table = table
     self._columns = columns
     self._table_columns = []
     self._out_table = []
+    self._vectorize = vectorize
+
+  def _ComputeColumns(self):
+    """Return the cell values by label and column, see ColumnarTable."""
+    columnar_table = ColumnarTable(self._table)
+    cell_values = []
+    for label_index in xrange(len(self._table[0]) - 1):
+      baseline_index = 0 if label_index else None
+      cell_values.append([
+          columnar_table.Compute(column.result, label_index, baseline_index)
+          for column in self._columns
+      ])
+    return cell_values
 
   def GenerateCellTable(self, table_type):
     row_index = 0
     all_failed = False
+    cell_values = None
+    if self._vectorize and len(self._table) > 1:
+      cell_values = self._ComputeColumns()
 
-    for row in self._table[1:]:
+    for table_row_index, row in enumerate(self._table[1:]):
       # It does not make sense to put retval in the summary table.
       if str(row[0]) == 'retval' and table_type == 'summary':
         # Check to see if any runs passed, and update all_failed.
@@ -806,19 +1062,22 @@ class TableFormatter(object):
       key.string_value = str(row[0])
       out_row = [key]
       baseline = None
-      for values in row[1:]:
-        for column in self._columns:
+      for label_index, values in enumerate(row[1:]):
+        for column_index, column in enumerate(self._columns):
           cell = Cell()
           cell.name = key.string_value
+          value = None
+          if cell_values and cell_values[label_index][column_index]:
+            value = cell_values[label_index][column_index][table_row_index]
           if column.result.NeedsBaseline():
             if baseline is not None:
-              column.result.Compute(cell, values, baseline)
+              self._ComputeCell(column.result, cell, value, values, baseline)
               column.fmt.Compute(cell)
               out_row.append(cell)
               if not row_index:
                 self._table_columns.append(column)
           else:
-            column.result.Compute(cell, values, baseline)
+            self._ComputeCell(column.result, cell, value, values, baseline)
             column.fmt.Compute(cell)
             out_row.append(cell)
             if not row_index:
@@ -849,6 +1108,14 @@ class TableFormatter(object):
             self._table_columns.append(column)
       self._out_table.append(out_row)
 
+  def _ComputeCell(self, result, cell, value, values, baseline):
+    if value is None:
+      result.Compute(cell, values, baseline)
+    else:
+      # Computed by ColumnarTable.
+      cell.value = value
+      result._InvertIfLowerIsBetter(cell)
+
   def AddColumnName(self):
     """Generate Column name at the top of table."""
     key = Cell()
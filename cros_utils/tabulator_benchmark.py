@@ -0,0 +1,84 @@
+#!/usr/bin/env python2
+
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Benchmark the computation of the cells of a results table.
+
+Times TableFormatter on a synthetic table of N keys by M labels, computing the
+cells one at a time and column-wise with ColumnarTable, and checks that both
+give the same table.
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import sys
+import time
+
+import tabulator
+
+COLUMNS = [
+    tabulator.Column(tabulator.AmeanResult(), tabulator.Format()),
+    tabulator.Column(tabulator.StdResult(), tabulator.Format()),
+    tabulator.Column(tabulator.CoeffVarResult(), tabulator.CoeffVarFormat()),
+    tabulator.Column(tabulator.GmeanRatioResult(), tabulator.RatioFormat()),
+    tabulator.Column(tabulator.PValueResult(), tabulator.PValueFormat()),
+]
+
+
+def GetRuns(keys, labels, iterations):
+  rand = random.Random(0)
+  return [[
+      dict(('key%d--ms' % k, rand.lognormvariate(3, 0.1)) for k in range(keys))
+      for _ in range(iterations)
+  ] for _ in range(labels)]
+
+
+def TimeTable(table, vectorize):
+  start = time.time()
+  cell_table = tabulator.TableFormatter(
+      table, COLUMNS, vectorize=vectorize).GetCellTable()
+  return time.time() - start, cell_table
+
+
+def Main(argv):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument(
+      '--keys',
+      type=int,
+      default=10000,
+      help='Number of keys. Defaults to %(default)s.')
+  parser.add_argument(
+      '--labels',
+      type=int,
+      default=10,
+      help='Number of labels. Defaults to %(default)s.')
+  parser.add_argument(
+      '--iterations',
+      type=int,
+      default=5,
+      help='Number of iterations of each label. Defaults to %(default)s.')
+  options = parser.parse_args(argv)
+
+  runs = GetRuns(options.keys, options.labels, options.iterations)
+  labels = ['label%d' % i for i in range(options.labels)]
+  table = tabulator.TableGenerator(runs, labels).GetTable()
+
+  cells, expected = TimeTable(table, False)
+  columns, cell_table = TimeTable(table, True)
+  if [[c.string_value for c in row] for row in cell_table] != [
+      [c.string_value for c in row] for row in expected]:
+    print('The tables differ.')
+    return 1
+
+  print('Keys: %d, labels: %d, iterations: %d' % (options.keys, options.labels,
+                                                  options.iterations))
+  print('Cell-wise:   %.2f s' % cells)
+  print('Column-wise: %.2f s (%.1fx)' % (columns, cells / columns))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(Main(sys.argv[1:]))
@@ -6,6 +6,8 @@ from __future__ import print_function
 __author__ = 'asharif@google.com (Ahmad Sharif)'
 
 # System modules
+import math
+import random
 import unittest
 
 # Local modules
@@ -136,6 +138,60 @@ class TabulatorTest(unittest.TestCase):
       for cell in row:
         self.assertTrue(cell.colspan == 1)
 
+  def testVectorized(self):
+    rand = random.Random(0)
+    runs = []
+    for _ in range(4):
+      run_list = []
+      for _ in range(rand.randint(1, 12)):
+        run = {}
+        for k in range(200):
+          if rand.random() < 0.1:
+            continue
+          key = 'k%d%s' % (k, '--ms' if k % 3 else '')
+          if k % 50 == 0:
+            run[key] = rand.choice(['PASS', 'FAIL'])
+          elif k % 40 == 0:
+            run[key] = 0
+          elif k % 30 == 0:
+            run[key] = rand.random()
+          elif k % 20 == 0:
+            run[key] = '%.3f' % rand.choice([1.0, 2.0])
+          else:
+            run[key] = rand.lognormvariate(3, 1)
+        run_list.append(run)
+      runs.append(run_list)
+    table = tabulator.TableGenerator(runs, ['l0', 'l1', 'l2', 'l3']).GetTable()
+    columns = [
+        tabulator.Column(tabulator.LiteralResult(), tabulator.Format()),
+        tabulator.Column(tabulator.NonEmptyCountResult(), tabulator.Format()),
+        tabulator.Column(tabulator.AmeanResult(), tabulator.Format()),
+        tabulator.Column(tabulator.MinResult(), tabulator.Format()),
+        tabulator.Column(tabulator.MaxResult(), tabulator.Format()),
+        tabulator.Column(tabulator.StdResult(), tabulator.Format()),
+        tabulator.Column(tabulator.CoeffVarResult(),
+                         tabulator.CoeffVarFormat()),
+        tabulator.Column(tabulator.GmeanRatioResult(),
+                         tabulator.RatioFormat()),
+        tabulator.Column(tabulator.AmeanRatioResult(),
+                         tabulator.PercentFormat()),
+        tabulator.Column(tabulator.PValueResult(), tabulator.PValueFormat()),
+    ]
+
+    expected = tabulator.TableFormatter(
+        table, columns, vectorize=False).GetCellTable()
+    cell_table = tabulator.TableFormatter(table, columns).GetCellTable()
+    self.assertEqual(len(cell_table), len(expected))
+    for row, expected_row in zip(cell_table, expected):
+      self.assertEqual(len(row), len(expected_row))
+      for cell, expected_cell in zip(row, expected_row):
+        self.assertEqual(cell.string_value, expected_cell.string_value)
+        self.assertEqual(type(cell.value), type(expected_cell.value))
+        if (isinstance(cell.value, float) and math.isnan(cell.value) and
+            math.isnan(expected_cell.value)):
+          continue
+        self.assertEqual(cell.value, expected_cell.value)
+
 
 if __name__ == '__main__':
   unittest.main()
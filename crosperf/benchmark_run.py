@@ -205,13 +205,19 @@ class BenchmarkRun(threading.Thread):
     else:
       self.machine_manager.ImageMachine(machine, self.label)
     self.timeline.Record(STATUS_RUNNING)
+    start_time = time.time()
     retval, out, err = self.suite_runner.Run(machine.name, self.label,
                                              self.benchmark, self.test_args,
                                              self.profiler_args)
+    run_duration = time.time() - start_time
     self.run_completed = True
-    return Result.CreateFromRun(self._logger, self.log_level, self.label,
-                                self.machine, out, err, retval,
-                                self.benchmark.test_name, self.benchmark.suite)
+    result = Result.CreateFromRun(self._logger, self.log_level, self.label,
+                                  self.machine, out, err, retval,
+                                  self.benchmark.test_name,
+                                  self.benchmark.suite)
+    # Remembered in the cache, to estimate how long future runs will take.
+    result.run_duration = run_duration
+    return result
 
   def SetCacheConditions(self, cache_conditions):
     self.cache_conditions = cache_conditions
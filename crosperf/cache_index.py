@@ -0,0 +1,243 @@
+#!/usr/bin/env python2
+
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Persistent index of the entries in a crosperf results cache directory.
+
+A cache entry is a directory named after the space-joined cache key list (see
+ResultsCache.GetCacheKeyList), e.g.
+  <image_path>_<test>_<iteration>_<test_args>_<checksum>_<machine>_<id>_<ver>
+
+Looking up an entry with wildcards used to glob the whole cache root, which is
+linear in the number of entries. The index keeps one row per entry in an
+sqlite database inside the cache root, with the key components in separate
+columns, so that wildcard lookups are answered through a B-tree index. Every
+crosperf storing to or removing from the cache root updates the rows of its
+entries, so their changes are seen by the others without listing the root.
+Entries stored without the index, e.g. by older crosperf, copied in by hand
+or stored by a crosperf that could not open the index, are found by globbing
+the root when the index has no match, and indexed from then on. Entries
+removed by other tools are dropped when a lookup finds them missing.
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import threading
+
+from cros_utils import misc
+
+INDEX_FILE = '.cache_index'
+WILDCARD = '*'
+KEY_FIELDS = ('image_path', 'test_name', 'iteration', 'test_args',
+              'image_checksum', 'machine_checksum', 'machine_id', 'version')
+
+# Length of the md5 hex digests at the start of a cache directory name.
+_MD5_LEN = 32
+
+
+def GetCacheDirName(key_list):
+  """Return the cache directory basename for a key list."""
+  return misc.GetFilenameFromString(' '.join(key_list))
+
+
+def ParseCacheDirName(dirname):
+  """Split a cache directory basename back into its key components.
+
+  Only the test name may contain underscores, and it is surrounded by fixed
+  width md5 digests and integers, so the split is unambiguous.
+
+  Returns:
+    A tuple with one entry per KEY_FIELDS, or None if dirname does not look
+    like a cache entry.
+  """
+  parts = dirname.rsplit('_', 4)
+  if len(parts) != 5:
+    return None
+  head, image_checksum, machine_checksum, machine_id, version = parts
+  if not version.isdigit():
+    return None
+  if (len(head) < 2 * _MD5_LEN + 4 or head[_MD5_LEN] != '_' or
+      head[-_MD5_LEN - 1] != '_'):
+    return None
+  image_path = head[:_MD5_LEN]
+  test_args = head[-_MD5_LEN:]
+  test_name, _, iteration = head[_MD5_LEN + 1:-_MD5_LEN - 1].rpartition('_')
+  if not test_name or not iteration.isdigit():
+    return None
+  return (image_path, test_name, iteration, test_args, image_checksum,
+          machine_checksum, machine_id, version)
+
+
+class CacheIndex(object):
+  """Index of the cache entries directly under one cache root."""
+
+  def __init__(self, cache_root):
+    self.cache_root = os.path.abspath(cache_root)
+    self.index_file = os.path.join(self.cache_root, INDEX_FILE)
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(
+        self.index_file, timeout=60, check_same_thread=False)
+    with self._db:
+      self._db.execute('CREATE TABLE IF NOT EXISTS meta '
+                       '(name TEXT PRIMARY KEY, value TEXT)')
+      self._db.execute('CREATE TABLE IF NOT EXISTS entries '
+                       '(dirname TEXT PRIMARY KEY, %s)' % ', '.join(
+                           '%s TEXT' % f for f in KEY_FIELDS))
+      # The test name, iteration, test args and cache version are never
+      # wildcards, so they make a selective lookup key.
+      self._db.execute('CREATE INDEX IF NOT EXISTS entries_key ON entries '
+                       '(test_name, iteration, test_args, version)')
+    with self._lock:
+      row = self._db.execute('SELECT value FROM meta WHERE name = ?',
+                             ('built',)).fetchone()
+      if not row:
+        # A new index, of a cache root that may already have entries.
+        self._Rebuild()
+
+  def _Rebuild(self):
+    on_disk = set(os.listdir(self.cache_root))
+    indexed = set(r[0] for r in self._db.execute('SELECT dirname FROM entries'))
+    added = []
+    for dirname in on_disk - indexed:
+      keys = ParseCacheDirName(dirname)
+      if keys and os.path.isdir(os.path.join(self.cache_root, dirname)):
+        added.append((dirname,) + keys)
+    with self._db:
+      self._db.executemany('DELETE FROM entries WHERE dirname = ?',
+                           [(d,) for d in indexed - on_disk])
+      self._db.executemany(
+          'INSERT OR REPLACE INTO entries VALUES (%s)' % ', '.join(
+              '?' * (len(KEY_FIELDS) + 1)), added)
+      self._db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                       ('built', '1'))
+
+  def Rebuild(self):
+    """Drop the index and rebuild it from the entries on disk."""
+    with self._lock:
+      with self._db:
+        self._db.execute('DELETE FROM entries')
+      self._Rebuild()
+
+  def Lookup(self, key_list):
+    """Return the cache directories matching key_list.
+
+    Entries whose directory was removed without going through the index are
+    dropped from it on the way. If the index has no match, the cache root is
+    globbed for entries stored without it, which are then added to it.
+
+    Args:
+      key_list: List of cache key components, in KEY_FIELDS order. A component
+        equal to '*' matches any value.
+
+    Returns:
+      A sorted list of absolute paths of the matching cache directories.
+    """
+    conditions = []
+    values = []
+    for field, key in zip(KEY_FIELDS, key_list):
+      if key != WILDCARD:
+        conditions.append('%s = ?' % field)
+        values.append(misc.GetFilenameFromString(key))
+    query = 'SELECT dirname FROM entries'
+    if conditions:
+      query += ' WHERE ' + ' AND '.join(conditions)
+    with self._lock:
+      rows = self._db.execute(query + ' ORDER BY dirname', values).fetchall()
+      found = []
+      gone = []
+      for (dirname,) in rows:
+        if os.path.isdir(os.path.join(self.cache_root, dirname)):
+          found.append(os.path.join(self.cache_root, dirname))
+        else:
+          gone.append((dirname,))
+      if gone:
+        with self._db:
+          self._db.executemany('DELETE FROM entries WHERE dirname = ?', gone)
+      if not found:
+        found = self._GlobAndAdd(key_list)
+    return found
+
+  def _GlobAndAdd(self, key_list):
+    paths = sorted(
+        p for p in glob.glob(
+            os.path.join(self.cache_root, GetCacheDirName(key_list)))
+        if os.path.isdir(p))
+    added = []
+    for path in paths:
+      keys = ParseCacheDirName(os.path.basename(path))
+      if keys:
+        added.append((os.path.basename(path),) + keys)
+    if added:
+      with self._db:
+        self._db.executemany(
+            'INSERT OR REPLACE INTO entries VALUES (%s)' % ', '.join(
+                '?' * (len(KEY_FIELDS) + 1)), added)
+    return paths
+
+  def Add(self, key_list):
+    """Record a cache entry that was just stored under the cache root."""
+    dirname = GetCacheDirName(key_list)
+    keys = tuple(misc.GetFilenameFromString(k) for k in key_list)
+    with self._lock:
+      with self._db:
+        self._db.execute(
+            'INSERT OR REPLACE INTO entries VALUES (%s)' % ', '.join(
+                '?' * (len(KEY_FIELDS) + 1)), (dirname,) + keys)
+
+  def Remove(self, cache_dir):
+    """Forget the cache entry in cache_dir, just removed from the cache root."""
+    with self._lock:
+      with self._db:
+        self._db.execute('DELETE FROM entries WHERE dirname = ?',
+                         (os.path.basename(cache_dir),))
+
+
+_indices = {}
+_indices_lock = threading.Lock()
+
+
+def GetCacheIndex(cache_root):
+  """Return the shared CacheIndex for cache_root.
+
+  Returns None if the cache root does not exist or the index can not be
+  created there (e.g. a read-only shared cache); callers should then fall back
+  to scanning the cache root.
+  """
+  cache_root = os.path.abspath(cache_root)
+  with _indices_lock:
+    if cache_root not in _indices:
+      index = None
+      if os.path.isdir(cache_root):
+        try:
+          index = CacheIndex(cache_root)
+        except sqlite3.Error:
+          pass
+      if not index:
+        return None
+      _indices[cache_root] = index
+    return _indices[cache_root]
+
+
+def Main(argv):
+  parser = argparse.ArgumentParser(
+      description='Rebuild the index of crosperf results cache directories.')
+  parser.add_argument('cache_roots', nargs='+', help='Cache root directories.')
+  options = parser.parse_args(argv)
+  for cache_root in options.cache_roots:
+    index = GetCacheIndex(cache_root)
+    if not index:
+      print('Unable to index cache root: %s' % cache_root)
+      return 1
+    index.Rebuild()
+    print('Rebuilt %s' % index.index_file)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(Main(sys.argv[1:]))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python2
+
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Unit tests for the results cache index."""
+
+from __future__ import print_function
+
+import glob
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+import cache_index
+
+KEYS1 = ('54524606abaae4fdf7b02f49f7ae7127', 'page_cycler/v2 typical', '1',
+         'fda29412ceccb72977516c4785d08e2c', 'FakeImageChecksumabc123',
+         'FakeMachineChecksumabc987', '', '6')
+KEYS2 = ('54524606abaae4fdf7b02f49f7ae7127', 'sunspider', '2',
+         'fda29412ceccb72977516c4785d08e2c', 'FakeImageChecksumabc123',
+         'FakeMachineChecksumabc987', 'b1d9a2f39ef8f3b7e6bd6a8e5f1b9d52', '6')
+
+
+class CacheIndexTest(unittest.TestCase):
+  """Tests for CacheIndex."""
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.cache_root = os.path.join(self.tmpdir, 'cros_scratch')
+    os.mkdir(self.cache_root)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def _MakeEntry(self, key_list):
+    path = os.path.join(self.cache_root, cache_index.GetCacheDirName(key_list))
+    os.mkdir(path)
+    return path
+
+  def _Indexed(self, index):
+    return [r[0] for r in index._db.execute('SELECT dirname FROM entries')]
+
+  def test_parse_cache_dir_name(self):
+    for keys in (KEYS1, KEYS2):
+      dirname = cache_index.GetCacheDirName(keys)
+      parsed = cache_index.ParseCacheDirName(dirname)
+      self.assertEqual(parsed[1], keys[1].replace('/', '__').replace(' ', '_'))
+      self.assertEqual(parsed[2:], keys[2:])
+    self.assertIsNone(cache_index.ParseCacheDirName('not_a_cache_entry'))
+    self.assertIsNone(cache_index.ParseCacheDirName('a_b_c_d_e_f_g_h'))
+
+  def test_rebuild_from_existing_entries(self):
+    path1 = self._MakeEntry(KEYS1)
+    path2 = self._MakeEntry(KEYS2)
+    with open(os.path.join(self.cache_root, 'stray_file'), 'w'):
+      pass
+    index = cache_index.CacheIndex(self.cache_root)
+    self.assertTrue(os.path.exists(index.index_file))
+    self.assertEqual(index.Lookup(KEYS1), [path1])
+    self.assertEqual(index.Lookup(KEYS2), [path2])
+
+  def test_lookup_with_wildcards(self):
+    path1 = self._MakeEntry(KEYS1)
+    index = cache_index.CacheIndex(self.cache_root)
+    wild = ('*',) + KEYS1[1:5] + ('*', '*', '6')
+    self.assertEqual(index.Lookup(wild), [path1])
+    wild = KEYS1[:4] + ('OtherChecksum', '*', '*', '6')
+    self.assertEqual(index.Lookup(wild), [])
+
+  def test_index_is_inside_the_cache_root(self):
+    index = cache_index.CacheIndex(self.cache_root)
+    self.assertEqual(os.path.dirname(index.index_file), self.cache_root)
+    self.assertEqual(os.listdir(self.tmpdir), ['cros_scratch'])
+    # The index file is not taken for an entry.
+    index.Rebuild()
+    self.assertEqual(index.Lookup(('*',) * 8), [])
+
+  def test_add_and_remove(self):
+    index = cache_index.CacheIndex(self.cache_root)
+    self.assertEqual(index.Lookup(KEYS1), [])
+    path1 = self._MakeEntry(KEYS1)
+    path2 = self._MakeEntry(KEYS2)
+    other = cache_index.CacheIndex(self.cache_root)
+    # Stores and lookups that hit do not list the cache root.
+    with mock.patch.object(os, 'listdir') as mock_listdir:
+      index.Add(KEYS1)
+      other.Add(KEYS2)
+      self.assertEqual(index.Lookup(KEYS1), [path1])
+      # Changes made through another index of the same root are seen.
+      self.assertEqual(index.Lookup(KEYS2), [path2])
+      self.assertFalse(mock_listdir.called)
+    other.Remove(path2)
+    self.assertEqual(self._Indexed(index), [os.path.basename(path1)])
+
+  def test_removed_behind_the_index(self):
+    index = cache_index.CacheIndex(self.cache_root)
+    path1 = self._MakeEntry(KEYS1)
+    index.Add(KEYS1)
+    shutil.rmtree(path1)
+    self.assertEqual(index.Lookup(KEYS1), [])
+    self.assertEqual(self._Indexed(index), [])
+    # Once the directory is back, it is found again.
+    os.mkdir(path1)
+    self.assertEqual(index.Lookup(KEYS1), [path1])
+
+  def test_added_behind_the_index(self):
+    index = cache_index.CacheIndex(self.cache_root)
+    self.assertEqual(index.Lookup(KEYS1), [])
+    # An entry stored without the index, after it was built.
+    path1 = self._MakeEntry(KEYS1)
+    wild = ('*',) + KEYS1[1:5] + ('*', '*', '6')
+    self.assertEqual(index.Lookup(wild), [path1])
+    # It is indexed from then on, and the state survives reopening the index.
+    index = cache_index.CacheIndex(self.cache_root)
+    with mock.patch.object(glob, 'glob') as mock_glob:
+      self.assertEqual(index.Lookup(KEYS1), [path1])
+      self.assertFalse(mock_glob.called)
+
+  def test_rebuild(self):
+    index = cache_index.CacheIndex(self.cache_root)
+    path1 = self._MakeEntry(KEYS1)
+    index.Rebuild()
+    with mock.patch.object(glob, 'glob') as mock_glob:
+      self.assertEqual(index.Lookup(KEYS1), [path1])
+      self.assertFalse(mock_glob.called)
+
+  def test_get_cache_index(self):
+    self.assertIsNone(
+        cache_index.GetCacheIndex(os.path.join(self.tmpdir, 'missing')))
+    index = cache_index.GetCacheIndex(self.cache_root)
+    self.assertIs(cache_index.GetCacheIndex(self.cache_root + '/'), index)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -6,11 +6,13 @@
 from __future__ import print_function
 
 import os
-import mock
+import shutil
+import subprocess
+import tempfile
 import unittest
 
 import download_images
-from cros_utils import command_executer
+from download_manager import LocalBucket
 from cros_utils import logger
 
 import test_flag
@@ -24,135 +26,75 @@ class ImageDownloaderTestcast(unittest.TestCase):
   def __init__(self, *args, **kwargs):
     super(ImageDownloaderTestcast, self).__init__(*args, **kwargs)
     self.called_download_image = False
-    self.called_uncompress_image = False
     self.called_get_build_id = False
     self.called_download_autotest_files = False
 
-  @mock.patch.object(os, 'makedirs')
-  @mock.patch.object(os.path, 'exists')
-  def test_download_image(self, mock_path_exists, mock_mkdirs):
-
-    # Set mock and test values.
-    mock_cmd_exec = mock.Mock(spec=command_executer.CommandExecuter)
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.bucket_dir = os.path.join(self.tempdir, 'bucket')
+    self.store_dir = os.path.join(self.tempdir, 'chroot_tmp')
+    self.build_dir = os.path.join(self.bucket_dir, 'lumpy-release/R36-5814.0.0')
+    os.makedirs(self.build_dir)
+    self.downloader = download_images.ImageDownloader(
+        logger_to_use=MOCK_LOGGER,
+        bucket=LocalBucket(self.bucket_dir),
+        store_dir=self.store_dir)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _MakeArchive(self, archive, tar_flags, files):
+    src_dir = tempfile.mkdtemp(dir=self.tempdir)
+    for name in files:
+      path = os.path.join(src_dir, name)
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+      with open(path, 'w') as f:
+        f.write(name)
+    subprocess.check_call(
+        ['tar', tar_flags, os.path.join(self.build_dir, archive)] + files,
+        cwd=src_dir)
+
+  def test_download_image(self):
     test_chroot = '/usr/local/home/chromeos'
     test_build_id = 'lumpy-release/R36-5814.0.0'
-    image_path = ('gs://chromeos-image-archive/%s/chromiumos_test_image.tar.xz'
-                  % test_build_id)
-
-    downloader = download_images.ImageDownloader(
-        logger_to_use=MOCK_LOGGER, cmd_exec=mock_cmd_exec)
 
-    # Set os.path.exists to always return False and run downloader
-    mock_path_exists.return_value = False
-    test_flag.SetTestMode(True)
-    self.assertRaises(download_images.MissingImage, downloader.DownloadImage,
-                      test_chroot, test_build_id, image_path)
-
-    # Verify os.path.exists was called twice, with proper arguments.
-    self.assertEqual(mock_path_exists.call_count, 2)
-    mock_path_exists.assert_called_with(
-        '/usr/local/home/chromeos/chroot/tmp/lumpy-release/'
-        'R36-5814.0.0/chromiumos_test_image.bin')
-    mock_path_exists.assert_any_call(
-        '/usr/local/home/chromeos/chroot/tmp/lumpy-release/R36-5814.0.0')
-
-    # Verify we called os.mkdirs
-    self.assertEqual(mock_mkdirs.call_count, 1)
-    mock_mkdirs.assert_called_with(
-        '/usr/local/home/chromeos/chroot/tmp/lumpy-release/R36-5814.0.0')
-
-    # Verify we called RunCommand once, with proper arguments.
-    self.assertEqual(mock_cmd_exec.RunCommand.call_count, 1)
-    expected_args = (
-        '/usr/local/home/chromeos/chromium/tools/depot_tools/gsutil.py '
-        'cp gs://chromeos-image-archive/lumpy-release/R36-5814.0.0/'
-        'chromiumos_test_image.tar.xz '
-        '/usr/local/home/chromeos/chroot/tmp/lumpy-release/R36-5814.0.0')
-
-    mock_cmd_exec.RunCommand.assert_called_with(expected_args)
-
-    # Reset the velues in the mocks; set os.path.exists to always return True.
-    mock_path_exists.reset_mock()
-    mock_cmd_exec.reset_mock()
-    mock_path_exists.return_value = True
-
-    # Run downloader
-    downloader.DownloadImage(test_chroot, test_build_id, image_path)
-
-    # Verify os.path.exists was called twice, with proper arguments.
-    self.assertEqual(mock_path_exists.call_count, 2)
-    mock_path_exists.assert_called_with(
-        '/usr/local/home/chromeos/chroot/tmp/lumpy-release/'
-        'R36-5814.0.0/chromiumos_test_image.bin')
-    mock_path_exists.assert_any_call(
-        '/usr/local/home/chromeos/chroot/tmp/lumpy-release/R36-5814.0.0')
-
-    # Verify we made no RunCommand or ChrootRunCommand calls (since
-    # os.path.exists returned True, there was no work do be done).
-    self.assertEqual(mock_cmd_exec.RunCommand.call_count, 0)
-    self.assertEqual(mock_cmd_exec.ChrootRunCommand.call_count, 0)
-
-  @mock.patch.object(os.path, 'exists')
-  def test_uncompress_image(self, mock_path_exists):
-
-    # set mock and test values.
-    mock_cmd_exec = mock.Mock(spec=command_executer.CommandExecuter)
+    # The image is not in the bucket.
+    self.assertRaises(download_images.MissingImage,
+                      self.downloader.DownloadImage, test_chroot, test_build_id)
+
+    self._MakeArchive('chromiumos_test_image.tar.xz', '-Jcf',
+                      ['chromiumos_test_image.bin'])
+    image_path = self.downloader.DownloadImage(test_chroot, test_build_id)
+    self.assertEqual(image_path,
+                     os.path.join(self.store_dir, test_build_id,
+                                  'chromiumos_test_image.bin'))
+    with open(image_path) as f:
+      self.assertEqual(f.read(), 'chromiumos_test_image.bin')
+
+    # The image is only downloaded once.
+    os.remove(os.path.join(self.build_dir, 'chromiumos_test_image.tar.xz'))
+    self.assertEqual(
+        self.downloader.DownloadImage(test_chroot, test_build_id), image_path)
+
+  def test_download_autotest_files(self):
     test_chroot = '/usr/local/home/chromeos'
     test_build_id = 'lumpy-release/R36-5814.0.0'
-
-    downloader = download_images.ImageDownloader(
-        logger_to_use=MOCK_LOGGER, cmd_exec=mock_cmd_exec)
-
-    # Set os.path.exists to always return False and run uncompress.
-    mock_path_exists.return_value = False
-    self.assertRaises(download_images.MissingImage, downloader.UncompressImage,
-                      test_chroot, test_build_id)
-
-    # Verify os.path.exists was called once, with correct arguments.
-    self.assertEqual(mock_path_exists.call_count, 1)
-    mock_path_exists.assert_called_with(
-        '/usr/local/home/chromeos/chroot/tmp/lumpy-release/'
-        'R36-5814.0.0/chromiumos_test_image.bin')
-
-    # Verify RunCommand was called twice with correct arguments.
-    self.assertEqual(mock_cmd_exec.RunCommand.call_count, 2)
-    # Call 1, should have 2 arguments
-    self.assertEqual(len(mock_cmd_exec.RunCommand.call_args_list[0]), 2)
-    actual_arg = mock_cmd_exec.RunCommand.call_args_list[0][0]
-    expected_arg = (
-        'cd /usr/local/home/chromeos/chroot/tmp/lumpy-release/R36-5814.0.0 ; '
-        'tar -Jxf chromiumos_test_image.tar.xz ',)
-    self.assertEqual(expected_arg, actual_arg)
-    # 2nd arg must be exception handler
-    except_handler_string = 'RunCommandExceptionHandler.HandleException'
-    self.assertTrue(
-        except_handler_string in repr(
-            mock_cmd_exec.RunCommand.call_args_list[0][1]))
-
-    # Call 2, should have 2 arguments
-    self.assertEqual(len(mock_cmd_exec.RunCommand.call_args_list[1]), 2)
-    actual_arg = mock_cmd_exec.RunCommand.call_args_list[1][0]
-    expected_arg = (
-        'cd /usr/local/home/chromeos/chroot/tmp/lumpy-release/R36-5814.0.0 ; '
-        'rm -f chromiumos_test_image.bin ',)
-    self.assertEqual(expected_arg, actual_arg)
-    # 2nd arg must be empty
-    self.assertTrue('{}' in repr(mock_cmd_exec.RunCommand.call_args_list[1][1]))
-
-    # Set os.path.exists to always return True and run uncompress.
-    mock_path_exists.reset_mock()
-    mock_cmd_exec.reset_mock()
-    mock_path_exists.return_value = True
-    downloader.UncompressImage(test_chroot, test_build_id)
-
-    # Verify os.path.exists was called once, with correct arguments.
-    self.assertEqual(mock_path_exists.call_count, 1)
-    mock_path_exists.assert_called_with(
-        '/usr/local/home/chromeos/chroot/tmp/lumpy-release/'
-        'R36-5814.0.0/chromiumos_test_image.bin')
-
-    # Verify RunCommand was not called.
-    self.assertEqual(mock_cmd_exec.RunCommand.call_count, 0)
+    self._MakeArchive('autotest_packages.tar', '-cf',
+                      ['autotest/packages/client.tar.bz2'])
+    self._MakeArchive('autotest_server_package.tar.bz2', '-jcf',
+                      ['autotest/server/autoserv'])
+    self._MakeArchive('control_files.tar', '-cf',
+                      ['autotest/client/site_tests/control'])
+
+    autotest_path = self.downloader.DownloadAutotestFiles(
+        test_chroot, test_build_id)
+    self.assertEqual(autotest_path,
+                     '/tmp/lumpy-release/R36-5814.0.0/autotest_files')
+    autotest_dir = os.path.join(self.store_dir, test_build_id, 'autotest_files')
+    for name in ('packages/client.tar.bz2', 'server/autoserv',
+                 'client/site_tests/control'):
+      self.assertTrue(os.path.exists(os.path.join(autotest_dir, name)))
 
   def test_run(self):
 
@@ -164,7 +106,6 @@ class ImageDownloaderTestcast(unittest.TestCase):
 
     # Set values to test/check.
     self.called_download_image = False
-    self.called_uncompress_image = False
     self.called_get_build_id = False
     self.called_download_autotest_files = False
 
@@ -173,24 +114,18 @@ class ImageDownloaderTestcast(unittest.TestCase):
       self.called_get_build_id = True
       return 'lumpy-release/R36-5814.0.0'
 
-    def GoodDownloadImage(root, build_id, image_path):
-      if root or build_id or image_path:
+    def GoodDownloadImage(root, build_id):
+      if root or build_id:
         pass
       self.called_download_image = True
       return 'chromiumos_test_image.bin'
 
-    def BadDownloadImage(root, build_id, image_path):
-      if root or build_id or image_path:
+    def BadDownloadImage(root, build_id):
+      if root or build_id:
         pass
       self.called_download_image = True
       raise download_images.MissingImage('Could not download image')
 
-    def FakeUncompressImage(root, build_id):
-      if root or build_id:
-        pass
-      self.called_uncompress_image = True
-      return 0
-
     def FakeDownloadAutotestFiles(root, build_id):
       if root or build_id:
         pass
@@ -198,11 +133,11 @@ class ImageDownloaderTestcast(unittest.TestCase):
       return 'autotest'
 
     # Initialize downloader
+    test_flag.SetTestMode(True)
     downloader = download_images.ImageDownloader(logger_to_use=MOCK_LOGGER)
 
     # Set downloader to call fake stubs.
     downloader.GetBuildID = FakeGetBuildID
-    downloader.UncompressImage = FakeUncompressImage
     downloader.DownloadImage = GoodDownloadImage
     downloader.DownloadAutotestFiles = FakeDownloadAutotestFiles
 
@@ -210,9 +145,8 @@ class ImageDownloaderTestcast(unittest.TestCase):
     image_path, autotest_path = downloader.Run(test_chroot, test_build_id,
                                                test_empty_autotest_path)
 
-    # Make sure it called both _DownloadImage and _UncompressImage
+    # Make sure it called DownloadImage
     self.assertTrue(self.called_download_image)
-    self.assertTrue(self.called_uncompress_image)
     # Make sure it called DownloadAutotestFiles
     self.assertTrue(self.called_download_autotest_files)
     # Make sure it returned an image and  autotest path returned from this call
@@ -232,7 +166,6 @@ class ImageDownloaderTestcast(unittest.TestCase):
 
     # Reset values; Now use fake stub that simulates DownloadImage failing.
     self.called_download_image = False
-    self.called_uncompress_image = False
     self.called_download_autotest_files = False
     downloader.DownloadImage = BadDownloadImage
 
@@ -240,10 +173,9 @@ class ImageDownloaderTestcast(unittest.TestCase):
     self.assertRaises(download_images.MissingImage, downloader.Run, test_chroot,
                       test_autotest_path, test_build_id)
 
-    # Verify that UncompressImage and downloadAutotestFiles were not called,
-    # since _DownloadImage "failed"
+    # Verify that downloadAutotestFiles was not called, since DownloadImage
+    # "failed"
     self.assertTrue(self.called_download_image)
-    self.assertFalse(self.called_uncompress_image)
     self.assertFalse(self.called_download_autotest_files)
 
 
@@ -0,0 +1,236 @@
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Parallel, resumable downloads of build artifacts into a local store.
+
+An artifact is downloaded in segments by a pool of threads shared by all the
+downloads of the process, so the artifacts of all the labels of an experiment
+download at once. The segments are piped in order into the extraction command
+as they arrive, so an image is uncompressed while it downloads.
+
+The finished segments are kept until the artifact is extracted, so an
+interrupted download resumes where it stopped. The artifacts are extracted into
+a ContentStore, a directory per build ID. Each artifact is locked while it is
+fetched and renamed into place once it is complete, so concurrent labels and
+crosperf runs using the same build fetch it only once.
+"""
+
+from __future__ import print_function
+
+import contextlib
+import fcntl
+import os
+import shutil
+import subprocess
+import threading
+from multiprocessing import pool
+
+GS_ARCHIVE = 'gs://chromeos-image-archive'
+GS_UTIL = 'chromium/tools/depot_tools/gsutil.py'
+# Bytes of an artifact downloaded at a time.
+SEGMENT_SIZE = 64 * 1024 * 1024
+# Number of segments downloaded at once, over all the downloads of the process.
+DOWNLOAD_THREADS = 8
+
+
+class DownloadError(Exception):
+  """Raised when an artifact can not be downloaded or extracted."""
+
+
+class GSBucket(object):
+  """The Cloud Storage archive, accessed with gsutil."""
+
+  def __init__(self, chromeos_root, cmd_exec):
+    self._gsutil = os.path.join(chromeos_root, GS_UTIL)
+    self._ce = cmd_exec
+
+  def Exists(self, url):
+    return self._ce.RunCommand('%s ls %s' % (self._gsutil, url)) == 0
+
+  def Size(self, url):
+    status, out, _ = self._ce.RunCommandWOutput(
+        '%s ls -l %s' % (self._gsutil, url), print_to_console=False)
+    if status != 0 or not out.split():
+      raise DownloadError('Cannot find %s.' % url)
+    return int(out.split()[0])
+
+  def ReadRange(self, url, start, end, dest):
+    """Write the bytes [start, end) of url to the file dest."""
+    status = self._ce.RunCommand(
+        '%s cat -r %d-%d %s > %s' % (self._gsutil, start, end - 1, url, dest),
+        print_to_console=False)
+    if status != 0:
+      raise DownloadError('Cannot download %s.' % url)
+
+
+class LocalBucket(object):
+  """A local directory standing in for the Cloud Storage archive.
+
+  gs://chromeos-image-archive/<path> is read from <root>/<path>.
+  """
+
+  def __init__(self, root):
+    self.root = root
+
+  def _Path(self, url):
+    if not url.startswith(GS_ARCHIVE + '/'):
+      raise DownloadError('%s is not in %s.' % (url, GS_ARCHIVE))
+    return os.path.join(self.root, url[len(GS_ARCHIVE) + 1:])
+
+  def Exists(self, url):
+    return os.path.isfile(self._Path(url))
+
+  def Size(self, url):
+    try:
+      return os.path.getsize(self._Path(url))
+    except OSError:
+      raise DownloadError('Cannot find %s.' % url)
+
+  def ReadRange(self, url, start, end, dest):
+    with open(self._Path(url), 'rb') as src, open(dest, 'wb') as out:
+      src.seek(start)
+      out.write(src.read(end - start))
+
+
+class ContentStore(object):
+  """The extracted artifacts of the builds, a directory per build ID."""
+
+  def __init__(self, store_dir):
+    self.store_dir = store_dir
+
+  def BuildDir(self, build_id):
+    return os.path.join(self.store_dir, build_id)
+
+  def Path(self, build_id, name):
+    """Return the path of the artifact name of build_id.
+
+    Artifacts are renamed into place once complete, so they are complete if
+    they exist.
+    """
+    return os.path.join(self.BuildDir(build_id), name)
+
+  @contextlib.contextmanager
+  def Lock(self, build_id, name):
+    """Hold the lock on the artifact name of build_id.
+
+    flock locks are per open file, so this excludes the other threads of the
+    process as well as the other processes.
+    """
+    build_dir = self.BuildDir(build_id)
+    if not os.path.isdir(build_dir):
+      try:
+        os.makedirs(build_dir)
+      except OSError:
+        if not os.path.isdir(build_dir):
+          raise
+    with open(os.path.join(build_dir, '.%s.lock' % name), 'w') as f:
+      fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class DownloadManager(object):
+  """Fetch artifacts from a bucket into a ContentStore."""
+
+  _pool = None
+  _pool_lock = threading.Lock()
+
+  def __init__(self, bucket, store, logger_to_use=None,
+               segment_size=SEGMENT_SIZE):
+    self.bucket = bucket
+    self.store = store
+    self._logger = logger_to_use
+    self.segment_size = segment_size
+
+  @classmethod
+  def _GetPool(cls):
+    with cls._pool_lock:
+      if not cls._pool:
+        cls._pool = pool.ThreadPool(DOWNLOAD_THREADS)
+      return cls._pool
+
+  def _FetchSegment(self, url, start, end, segment):
+    # A segment file is only present once it is complete.
+    if (not os.path.exists(segment) or
+        os.path.getsize(segment) != end - start):
+      self.bucket.ReadRange(url, start, end, segment + '.tmp')
+      os.rename(segment + '.tmp', segment)
+    return segment
+
+  def _Download(self, url, parts_dir, extract_dir, extract_cmd):
+    """Download url in segments, piping them into extract_cmd in extract_dir."""
+    size = self.bucket.Size(url)
+    if not os.path.isdir(parts_dir):
+      os.makedirs(parts_dir)
+    segments = [
+        self._GetPool().apply_async(self._FetchSegment, (
+            url, start, min(start + self.segment_size, size),
+            os.path.join(parts_dir, str(i))))
+        for i, start in enumerate(xrange(0, size, self.segment_size))
+    ]
+
+    extract = subprocess.Popen(
+        extract_cmd, shell=True, stdin=subprocess.PIPE, cwd=extract_dir)
+    try:
+      for segment in segments:
+        with open(segment.get(), 'rb') as f:
+          shutil.copyfileobj(f, extract.stdin)
+    except IOError:
+      # Extraction stopped early, the archive is broken.
+      pass
+    finally:
+      extract.stdin.close()
+      retval = extract.wait()
+      # Let the download finish before its segments can be removed.
+      for segment in segments:
+        segment.wait()
+    if retval != 0:
+      # Fetch the archive again next time.
+      shutil.rmtree(parts_dir)
+      raise DownloadError('Cannot uncompress %s.' % url)
+
+  def Fetch(self, build_id, artifacts, extracted, name):
+    """Fetch and extract the artifacts of build_id, and store what it needs.
+
+    Args:
+      build_id: The build the artifacts belong to, e.g.
+        'lumpy-release/R36-5814.0.0'.
+      artifacts: A list of (file name in the build, extraction command). The
+        commands read the file from their stdin and run in the same directory.
+      extracted: The path in that directory of what is needed.
+      name: The name to store it as.
+
+    Returns:
+      The path it is stored at.
+    """
+    path = self.store.Path(build_id, name)
+    if os.path.exists(path):
+      return path
+
+    with self.store.Lock(build_id, name):
+      # Another label or crosperf run may have fetched it meanwhile.
+      if os.path.exists(path):
+        return path
+      if self._logger:
+        self._logger.LogOutput('Downloading %s of %s.' % (name, build_id))
+      build_dir = self.store.BuildDir(build_id)
+      extract_dir = os.path.join(build_dir, '.%s.tmp' % name)
+      shutil.rmtree(extract_dir, ignore_errors=True)
+      os.makedirs(extract_dir)
+      try:
+        for file_name, extract_cmd in artifacts:
+          url = '%s/%s/%s' % (GS_ARCHIVE, build_id, file_name)
+          parts_dir = os.path.join(build_dir, '.%s.parts' % file_name)
+          self._Download(url, parts_dir, extract_dir, extract_cmd)
+        if not os.path.exists(os.path.join(extract_dir, extracted)):
+          raise DownloadError('%s not found in %s.' % (extracted, build_id))
+        os.rename(os.path.join(extract_dir, extracted), path)
+      finally:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+      for file_name, _ in artifacts:
+        shutil.rmtree(
+            os.path.join(build_dir, '.%s.parts' % file_name),
+            ignore_errors=True)
+    return path
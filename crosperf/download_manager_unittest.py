@@ -0,0 +1,126 @@
+#!/usr/bin/env python2
+#
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Unittest for download_manager."""
+
+from __future__ import print_function
+
+import mock
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+
+from download_manager import ContentStore
+from download_manager import DownloadError
+from download_manager import DownloadManager
+from download_manager import LocalBucket
+
+BUILD_ID = 'lumpy-release/R36-5814.0.0'
+ARTIFACTS = [('image.tar.xz', 'tar -Jxf -')]
+
+
+class DownloadManagerTest(unittest.TestCase):
+  """Tests for DownloadManager, on a local bucket."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.bucket_dir = os.path.join(self.tempdir, 'bucket')
+    build_dir = os.path.join(self.bucket_dir, BUILD_ID)
+    os.makedirs(build_dir)
+    src_dir = os.path.join(self.tempdir, 'src')
+    os.makedirs(src_dir)
+    self.contents = os.urandom(10000)
+    with open(os.path.join(src_dir, 'image.bin'), 'wb') as f:
+      f.write(self.contents)
+    subprocess.check_call(
+        ['tar', '-Jcf', os.path.join(build_dir, 'image.tar.xz'), 'image.bin'],
+        cwd=src_dir)
+
+    self.bucket = LocalBucket(self.bucket_dir)
+    self.store = ContentStore(os.path.join(self.tempdir, 'store'))
+    # Small segments, so the archive downloads in several.
+    self.manager = DownloadManager(self.bucket, self.store, segment_size=1000)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testFetch(self):
+    path = self.manager.Fetch(BUILD_ID, ARTIFACTS, 'image.bin', 'image.bin')
+    self.assertEqual(path,
+                     os.path.join(self.tempdir, 'store', BUILD_ID, 'image.bin'))
+    with open(path, 'rb') as f:
+      self.assertEqual(f.read(), self.contents)
+    # Nothing but the artifact and its lock is left behind.
+    self.assertItemsEqual(
+        os.listdir(self.store.BuildDir(BUILD_ID)),
+        ['image.bin', '.image.bin.lock'])
+
+  def testFetchOnce(self):
+    with mock.patch.object(
+        self.bucket, 'ReadRange', wraps=self.bucket.ReadRange) as read_range:
+      threads = [
+          threading.Thread(
+              target=self.manager.Fetch,
+              args=(BUILD_ID, ARTIFACTS, 'image.bin', 'image.bin'))
+          for _ in range(3)
+      ]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+      segments = read_range.call_count
+      self.manager.Fetch(BUILD_ID, ARTIFACTS, 'image.bin', 'image.bin')
+    self.assertEqual(
+        segments,
+        (self.bucket.Size('gs://chromeos-image-archive/%s/image.tar.xz' %
+                          BUILD_ID) + 999) / 1000)
+    self.assertEqual(read_range.call_count, segments)
+
+  def testResume(self):
+    read_range = self.bucket.ReadRange
+    reads = []
+
+    def FailingReadRange(url, start, end, dest):
+      if start == 2000:
+        raise DownloadError('Connection lost.')
+      reads.append(start)
+      read_range(url, start, end, dest)
+
+    with mock.patch.object(self.bucket, 'ReadRange', FailingReadRange):
+      self.assertRaises(DownloadError, self.manager.Fetch, BUILD_ID, ARTIFACTS,
+                        'image.bin', 'image.bin')
+    self.assertFalse(os.path.exists(self.store.Path(BUILD_ID, 'image.bin')))
+    fetched = set(reads)
+    self.assertIn(0, fetched)
+
+    with mock.patch.object(
+        self.bucket, 'ReadRange', wraps=read_range) as resumed_read_range:
+      path = self.manager.Fetch(BUILD_ID, ARTIFACTS, 'image.bin', 'image.bin')
+    # Only the segments missing after the failure are downloaded again.
+    refetched = set(call[0][1] for call in resumed_read_range.call_args_list)
+    self.assertFalse(refetched & fetched)
+    self.assertIn(2000, refetched)
+    with open(path, 'rb') as f:
+      self.assertEqual(f.read(), self.contents)
+
+  def testBrokenArchive(self):
+    with open(
+        os.path.join(self.bucket_dir, BUILD_ID, 'image.tar.xz'), 'wb') as f:
+      f.write('not an archive')
+    self.assertRaises(DownloadError, self.manager.Fetch, BUILD_ID, ARTIFACTS,
+                      'image.bin', 'image.bin')
+    self.assertItemsEqual(
+        os.listdir(self.store.BuildDir(BUILD_ID)), ['.image.bin.lock'])
+
+  def testMissingArtifact(self):
+    self.assertRaises(DownloadError, self.manager.Fetch, BUILD_ID,
+                      [('missing.tar', 'tar -xf -')], 'image.bin', 'image.bin')
+
+
+if __name__ == '__main__':
+  unittest.main()
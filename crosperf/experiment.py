@@ -79,9 +79,8 @@ class Experiment(object):
                                               log_level, locks_directory)
     self.l = logger.GetLogger(log_dir)
 
-    for machine in self.remote:
-      # machine_manager.AddMachine only adds reachable machines.
-      self.machine_manager.AddMachine(machine)
+    # machine_manager.AddMachines only adds reachable machines.
+    self.machine_manager.AddMachines(self.remote)
     # Now machine_manager._all_machines contains a list of reachable
     # machines. This is a subset of self.remote. We make both lists the same.
     self.remote = [m.name for m in self.machine_manager.GetAllMachines()]
@@ -117,6 +116,9 @@ class Experiment(object):
   def _GenerateBenchmarkRuns(self):
     """Generate benchmark runs from labels and benchmark defintions."""
     benchmark_runs = []
+    # The logs of all the runs go to one container, extract them with
+    # extract_run_logs.py.
+    self.run_logs = logger.LogContainer(self.log_dir, 'run')
     for label in self.labels:
       for benchmark in self.benchmarks:
         for iteration in xrange(1, benchmark.iterations + 1):
@@ -124,8 +126,8 @@ class Experiment(object):
           benchmark_run_name = '%s: %s (%s)' % (label.name, benchmark.name,
                                                 iteration)
           full_name = '%s_%s_%s' % (label.name, benchmark.name, iteration)
-          logger_to_use = logger.Logger(self.log_dir, 'run.%s' % (full_name),
-                                        True)
+          logger_to_use = logger.ContainerLogger(self.run_logs,
+                                                 'run.%s' % (full_name), True)
           benchmark_runs.append(
               benchmark_run.BenchmarkRun(benchmark_run_name, benchmark, label,
                                          iteration, self.cache_conditions,
@@ -191,7 +193,8 @@ class Experiment(object):
       run.SetCacheConditions(cache_conditions)
 
   def Cleanup(self):
-    """Make sure all machines are unlocked."""
+    """Write the run logs and make sure all machines are unlocked."""
+    self.run_logs.Close()
     if self.locks_dir:
       # We are using the file locks mechanism, so call machine_manager.Cleanup
       # to unlock everything.
@@ -4,6 +4,7 @@
 """A module to generate experiments."""
 
 from __future__ import print_function
+from multiprocessing import pool
 import os
 import re
 import socket
@@ -11,8 +12,10 @@ import socket
 from benchmark import Benchmark
 import config
 from experiment import Experiment
+from image_checksummer import ImageChecksummer
 from label import Label
 from label import MockLabel
+from results_cache import CACHE_CODECS
 from results_cache import CacheConditions
 import test_flag
 import file_lock_machine
@@ -122,6 +125,16 @@ class ExperimentFactory(object):
     cache_dir = global_settings.GetField('cache_dir')
     cache_only = global_settings.GetField('cache_only')
     config.AddConfig('no_email', global_settings.GetField('no_email'))
+    cache_compression = global_settings.GetField('cache_compression')
+    if cache_compression not in CACHE_CODECS:
+      raise RuntimeError('Unknown cache_compression: %s (valid values: %s)' %
+                         (cache_compression, ', '.join(CACHE_CODECS)))
+    config.AddConfig('cache_compression', cache_compression)
+    config.AddConfig('async_cache_store',
+                     global_settings.GetField('async_cache_store'))
+    config.AddConfig('work_stealing', global_settings.GetField('work_stealing'))
+    config.AddConfig('concurrent_images',
+                     global_settings.GetField('concurrent_images'))
     share_cache = global_settings.GetField('share_cache')
     results_dir = global_settings.GetField('results_dir')
     use_file_locks = global_settings.GetField('use_file_locks')
@@ -258,6 +271,29 @@ class ExperimentFactory(object):
     labels = []
     all_label_settings = experiment_file.GetSettings('label')
     all_remote = list(remote)
+    if not test_flag.GetTestMode():
+      # Hash the local images concurrently, the labels wait for theirs.
+      ImageChecksummer().Prefetch(
+          os.path.expanduser(label_settings.GetField('chromeos_image'))
+          for label_settings in all_label_settings
+          if label_settings.GetField('chromeos_image'))
+    # Download the images of all the labels at once.
+    downloads = [
+        label_settings for label_settings in all_label_settings
+        if label_settings.GetField('chromeos_image') == ''
+    ]
+    downloaded = {}
+    if downloads:
+      workers = pool.ThreadPool(len(downloads))
+      try:
+        downloaded = dict(
+            zip([label_settings.name for label_settings in downloads],
+                workers.map(
+                    lambda label_settings: self._GetXbuddyPath(
+                        label_settings, board, log_level), downloads)))
+      finally:
+        workers.close()
+        workers.join()
     for label_settings in all_label_settings:
       label_name = label_settings.name
       image = label_settings.GetField('chromeos_image')
@@ -272,11 +308,7 @@ class ExperimentFactory(object):
           new_remote.append(c)
       my_remote = new_remote
       if image == '':
-        build = label_settings.GetField('build')
-        if len(build) == 0:
-          raise RuntimeError("Can not have empty 'build' field!")
-        image, autotest_path = label_settings.GetXbuddyPath(
-            build, autotest_path, board, chromeos_root, log_level)
+        image, autotest_path = downloaded[label_name]
 
       cache_dir = label_settings.GetField('cache_dir')
       chrome_src = label_settings.GetField('chrome_src')
@@ -317,6 +349,15 @@ class ExperimentFactory(object):
 
     return experiment
 
+  def _GetXbuddyPath(self, label_settings, board, log_level):
+    """Download the build of a label, return its image and autotest paths."""
+    build = label_settings.GetField('build')
+    if len(build) == 0:
+      raise RuntimeError("Can not have empty 'build' field!")
+    return label_settings.GetXbuddyPath(
+        build, label_settings.GetField('autotest_path'), board,
+        label_settings.GetField('chromeos_root'), log_level)
+
   def GetDefaultRemotes(self, board):
     default_remotes_file = os.path.join(
         os.path.dirname(__file__), 'default_remotes')
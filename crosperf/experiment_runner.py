@@ -21,6 +21,7 @@ import config
 from experiment_status import ExperimentStatus
 from results_cache import CacheConditions
 from results_cache import ResultsCache
+from results_cache import WaitForCacheStores
 from results_report import HTMLResultsReport
 from results_report import TextResultsReport
 from results_report import JSONResultsReport
@@ -210,6 +211,11 @@ class ExperimentRunner(object):
     finally:
       if not experiment.locks_dir:
         self._UnlockAllMachines(experiment)
+      ssh_pool = command_executer.GetSshConnectionPool()
+      if ssh_pool.num_commands:
+        self.l.LogOutput('Ran %d remote commands over shared ssh connections, '
+                         'saving %d ssh round trips.' %
+                         (ssh_pool.num_commands, ssh_pool.round_trips_saved))
 
   def _PrintTable(self, experiment):
     self.l.LogOutput(TextResultsReport.FromExperiment(experiment).GetReport())
@@ -288,6 +294,9 @@ class ExperimentRunner(object):
       # Always print the report at the end of the run.
       self._PrintTable(self._experiment)
       if not self._terminated:
+        # The results are cleaned up below, so they must be in the cache by
+        # then.
+        WaitForCacheStores()
         self._StoreResults(self._experiment)
         self._Email(self._experiment)
 
@@ -0,0 +1,48 @@
+#!/usr/bin/env python2
+#
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Extract the logs of benchmark runs from the log container of an experiment.
+
+The runs of an experiment log to logs/run.log under its log_dir. This writes
+the .cmd, .out and .err logs of the given runs, e.g.
+'run.label_benchmark_1', to files like the ones the runs used to write.
+Without runs, it lists the runs in the container.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+from cros_utils.logger import LogContainer
+
+
+def Main(argv):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument(
+      '--dest_dir',
+      default='.',
+      help='Directory to write the logs in. Defaults to the current one.')
+  parser.add_argument('container', help='The container, e.g. logs/run.log.')
+  parser.add_argument('runs', nargs='*', help='The runs to extract.')
+  options = parser.parse_args(argv)
+
+  names = LogContainer.Names(options.container)
+  if not options.runs:
+    print('\n'.join(names))
+    return 0
+
+  for run in options.runs:
+    if run not in names:
+      print('No logs of %s in %s.' % (run, options.container))
+      return 1
+    LogContainer.Extract(options.container, run, options.dest_dir)
+    print('Extracted %s.' % os.path.join(options.dest_dir, '%s.*' % run))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(Main(sys.argv[1:]))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python2
+
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Benchmark the image checksums computed when an experiment starts.
+
+Times the checksums of the images of N labels with md5sum, one image after the
+other as crosperf used to, and with ImageChecksummer, cold (empty index) and
+warm (the images were hashed by an earlier experiment).
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from image_checksummer import ChecksumIndex
+from image_checksummer import ImageChecksummer
+
+
+def TimeMd5sum(images):
+  start = time.time()
+  for image in images:
+    subprocess.check_output(['md5sum', image])
+  return time.time() - start
+
+
+def TimeChecksummer(images, index_file):
+  # A new experiment: nothing is known in process.
+  checksummer = ImageChecksummer()
+  checksummer.index = ChecksumIndex(index_file)
+  ImageChecksummer._image_checksums.clear()
+  start = time.time()
+  checksummer.Prefetch(images)
+  for image in images:
+    checksummer.GetImageChecksum(image).Get()
+  return time.time() - start
+
+
+def Main(argv):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument(
+      '--labels',
+      type=int,
+      default=4,
+      help='Number of labels, each with its own image. '
+      'Defaults to %(default)s.')
+  parser.add_argument(
+      '--image_size',
+      type=int,
+      default=512,
+      help='Size of the images in MB. Defaults to %(default)s.')
+  parser.add_argument(
+      '--dir',
+      default=None,
+      help='Directory to create the images in. Defaults to a temp dir.')
+  options = parser.parse_args(argv)
+
+  tempdir = tempfile.mkdtemp(dir=options.dir)
+  try:
+    images = []
+    block = os.urandom(1024 * 1024)
+    for i in range(options.labels):
+      image = os.path.join(tempdir, 'chromiumos_test_image%d.bin' % i)
+      with open(image, 'wb') as f:
+        for _ in range(options.image_size):
+          f.write(block)
+        # Make the images differ.
+        f.write(str(i))
+      images.append(image)
+    index_file = os.path.join(tempdir, 'image_checksums.json')
+
+    md5sum = TimeMd5sum(images)
+    cold = TimeChecksummer(images, index_file)
+    warm = TimeChecksummer(images, index_file)
+  finally:
+    shutil.rmtree(tempdir)
+
+  print('Labels: %d, %d MB images' % (options.labels, options.image_size))
+  print('md5sum: %.2f s' % md5sum)
+  print('Cold:   %.2f s (%.1fx)' % (cold, md5sum / cold))
+  print('Warm:   %.3f s (%.0fx)' % (warm, md5sum / warm))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(Main(sys.argv[1:]))
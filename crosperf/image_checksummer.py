@@ -1,13 +1,126 @@
 # Copyright 2011 Google Inc. All Rights Reserved.
-"""Compute image checksum."""
+"""Compute image checksum.
+
+Images are hashed in the crosperf process, a thread per image, and the
+checksums are kept in an index on disk keyed by the path, inode, size and mtime
+of the image, so an unchanged image is only hashed once across experiments.
+"""
 
 from __future__ import print_function
 
+import hashlib
+import json
+import mmap
 import os
+import tempfile
 import threading
 
 from cros_utils import logger
-from cros_utils.file_utils import FileUtils
+
+# The checksums of the images hashed by earlier experiments.
+CHECKSUM_INDEX_FILE = os.path.expanduser('~/cros_scratch/image_checksums.json')
+# Bytes of an image mapped and hashed at a time. A multiple of
+# mmap.ALLOCATIONGRANULARITY.
+CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def Md5File(path, chunk_size=CHUNK_SIZE):
+  """Return the md5 of the file at path, like md5sum does."""
+  md5 = hashlib.md5()
+  with open(path, 'rb') as f:
+    size = os.fstat(f.fileno()).st_size
+    for offset in xrange(0, size, chunk_size):
+      chunk = mmap.mmap(
+          f.fileno(),
+          min(chunk_size, size - offset),
+          access=mmap.ACCESS_READ,
+          offset=offset)
+      try:
+        # hashlib releases the GIL while hashing, so the images hash in
+        # parallel.
+        md5.update(chunk)
+      finally:
+        chunk.close()
+  return md5.hexdigest()
+
+
+class ChecksumIndex(object):
+  """The on-disk index of image checksums."""
+
+  def __init__(self, index_file):
+    self.index_file = index_file
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def _Key(path):
+    st = os.stat(path)
+    return [st.st_ino, st.st_size, st.st_mtime]
+
+  def _Read(self):
+    try:
+      with open(self.index_file) as f:
+        return json.load(f)
+    except (IOError, ValueError):
+      return {}
+
+  def Lookup(self, path):
+    """Return the indexed checksum of the image at path, or None."""
+    path = os.path.realpath(path)
+    entry = self._Read().get(path)
+    if entry and entry['key'] == self._Key(path):
+      return entry['checksum']
+    return None
+
+  def Store(self, path, key, checksum):
+    """Index the checksum of the image at path, whose key was key."""
+    path = os.path.realpath(path)
+    with self._lock:
+      # Other experiments may have indexed images meanwhile, merge with theirs.
+      index = self._Read()
+      index[path] = {'key': key, 'checksum': checksum}
+      index = dict((p, e) for p, e in index.iteritems() if os.path.exists(p))
+      index_dir = os.path.dirname(self.index_file)
+      if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+      fd, temp_file = tempfile.mkstemp(dir=index_dir)
+      with os.fdopen(fd, 'w') as f:
+        json.dump(index, f)
+      os.rename(temp_file, self.index_file)
+
+  def Checksum(self, path):
+    """Return the checksum of the image at path, hashing it if needed."""
+    checksum = self.Lookup(path)
+    if not checksum:
+      # The key is taken before hashing, so an image changed meanwhile is
+      # hashed again next time.
+      key = self._Key(path)
+      checksum = Md5File(path)
+      self.Store(path, key, checksum)
+    return checksum
+
+
+class ImageChecksum(object):
+  """The checksum of an image, computed by a thread of its own."""
+
+  def __init__(self, path, index):
+    self.path = path
+    self._checksum = None
+    self._error = None
+    self._thread = threading.Thread(target=self._Run, args=(index,))
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _Run(self, index):
+    try:
+      self._checksum = index.Checksum(self.path)
+    except EnvironmentError as e:
+      self._error = e
+
+  def Get(self):
+    self._thread.join()
+    if self._error:
+      raise self._error
+    return self._checksum
 
 
 class ImageChecksummer(object):
@@ -16,11 +129,12 @@ class ImageChecksummer(object):
   class PerImageChecksummer(object):
     """Compute checksum for an image."""
 
-    def __init__(self, label, log_level):
+    def __init__(self, label, log_level, checksummer):
       self._lock = threading.Lock()
       self.label = label
       self._checksum = None
       self.log_level = log_level
+      self._checksummer = checksummer
 
     def Checksum(self):
       with self._lock:
@@ -32,8 +146,8 @@ class ImageChecksummer(object):
             raise RuntimeError('Called Checksum on non-local image!')
           if self.label.chromeos_image:
             if os.path.exists(self.label.chromeos_image):
-              self._checksum = FileUtils().Md5File(
-                  self.label.chromeos_image, log_level=self.log_level)
+              self._checksum = self._checksummer.GetImageChecksum(
+                  self.label.chromeos_image).Get()
               logger.GetLogger().LogOutput('Computed checksum is '
                                            ': %s' % self._checksum)
           if not self._checksum:
@@ -44,21 +158,38 @@ class ImageChecksummer(object):
   _instance = None
   _lock = threading.Lock()
   _per_image_checksummers = {}
+  _image_checksums = {}
+  index_file = CHECKSUM_INDEX_FILE
 
   def __new__(cls, *args, **kwargs):
     with cls._lock:
       if not cls._instance:
         cls._instance = super(ImageChecksummer, cls).__new__(
             cls, *args, **kwargs)
+        cls._instance.index = ChecksumIndex(cls.index_file)
       return cls._instance
 
+  def GetImageChecksum(self, path):
+    """Return the ImageChecksum of the image at path, starting it if needed."""
+    path = os.path.realpath(path)
+    with self._lock:
+      if path not in self._image_checksums:
+        self._image_checksums[path] = ImageChecksum(path, self.index)
+      return self._image_checksums[path]
+
+  def Prefetch(self, images):
+    """Start computing the checksums of the local images in the background."""
+    for image in images:
+      if os.path.isfile(image):
+        self.GetImageChecksum(image)
+
   def Checksum(self, label, log_level):
     if label.image_type != 'local':
       raise RuntimeError('Attempt to call Checksum on non-local image.')
     with self._lock:
       if label.name not in self._per_image_checksummers:
         self._per_image_checksummers[label.name] = (
-            ImageChecksummer.PerImageChecksummer(label, log_level))
+            ImageChecksummer.PerImageChecksummer(label, log_level, self))
       checksummer = self._per_image_checksummers[label.name]
 
     try:
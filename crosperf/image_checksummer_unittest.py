@@ -0,0 +1,85 @@
+#!/usr/bin/env python2
+#
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Unittest for image_checksummer."""
+
+from __future__ import print_function
+
+import hashlib
+import mmap
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+import image_checksummer
+from image_checksummer import ChecksumIndex
+from image_checksummer import ImageChecksummer
+from label import MockLabel
+
+
+class ImageChecksummerTest(unittest.TestCase):
+  """Tests for the image checksums and their index."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.image = os.path.join(self.tempdir, 'chromiumos_test_image.bin')
+    # Spans several chunks, the last one partial.
+    self.contents = os.urandom(2 * mmap.ALLOCATIONGRANULARITY + 100)
+    with open(self.image, 'wb') as f:
+      f.write(self.contents)
+    self.index_file = os.path.join(self.tempdir, 'index', 'checksums.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testMd5File(self):
+    expected = hashlib.md5(self.contents).hexdigest()
+    self.assertEqual(image_checksummer.Md5File(self.image), expected)
+    self.assertEqual(
+        image_checksummer.Md5File(
+            self.image, chunk_size=mmap.ALLOCATIONGRANULARITY), expected)
+    empty = os.path.join(self.tempdir, 'empty')
+    open(empty, 'w').close()
+    self.assertEqual(
+        image_checksummer.Md5File(empty), hashlib.md5().hexdigest())
+
+  @mock.patch.object(image_checksummer, 'Md5File')
+  def testIndex(self, mock_md5file):
+    mock_md5file.return_value = 'checksum'
+    index = ChecksumIndex(self.index_file)
+    self.assertIsNone(index.Lookup(self.image))
+    self.assertEqual(index.Checksum(self.image), 'checksum')
+    self.assertEqual(mock_md5file.call_count, 1)
+
+    # Another experiment finds the checksum in the index.
+    index = ChecksumIndex(self.index_file)
+    self.assertEqual(index.Checksum(self.image), 'checksum')
+    self.assertEqual(mock_md5file.call_count, 1)
+
+    # A rebuilt image is hashed again.
+    os.utime(self.image, (0, 0))
+    self.assertIsNone(index.Lookup(self.image))
+    mock_md5file.return_value = 'new_checksum'
+    self.assertEqual(index.Checksum(self.image), 'new_checksum')
+    self.assertEqual(mock_md5file.call_count, 2)
+
+  def testChecksum(self):
+    checksummer = ImageChecksummer()
+    checksummer.index = ChecksumIndex(self.index_file)
+    checksummer.Prefetch([self.image, os.path.join(self.tempdir, 'missing')])
+    label = MockLabel('label', self.image, '', '', 'board', [], '', '', False,
+                      'average', 'gcc')
+    self.assertEqual(
+        checksummer.Checksum(label, 'average'),
+        hashlib.md5(self.contents).hexdigest())
+    self.assertEqual(
+        ChecksumIndex(self.index_file).Lookup(self.image),
+        hashlib.md5(self.contents).hexdigest())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -6,9 +6,11 @@
 from __future__ import print_function
 
 import collections
+import config
 import file_lock_machine
 import hashlib
 import image_chromeos
+import json
 import math
 import os.path
 import re
@@ -21,6 +23,20 @@ from cros_utils import command_executer
 from cros_utils import logger
 
 CHECKSUM_FILE = '/usr/local/osimage_checksum_file'
+# The default number of machines imaged at the same time.
+DEFAULT_CONCURRENT_IMAGES = 4
+# Where the fingerprints of the machines are cached, and for how many seconds.
+FINGERPRINT_CACHE_DIR = '~/cros_scratch/machine_fingerprints'
+FINGERPRINT_TTL = 3600
+# Collects everything that goes into the machine checksums in one go. Each
+# command's output follows a marker line.
+FINGERPRINT_MARKER = 'CROSPERF_FINGERPRINT:'
+FINGERPRINT_COMMANDS = collections.OrderedDict([
+    ('meminfo', 'cat /proc/meminfo'),
+    ('cpuinfo', 'cat /proc/cpuinfo'),
+    ('vpd', 'dump_vpd_log --full --stdout'),
+    ('ifconfig', 'ifconfig'),
+])
 
 
 class BadChecksum(Exception):
@@ -66,16 +82,89 @@ class CrosMachine(object):
     self.SetUpChecksumInfo()
 
   def SetUpChecksumInfo(self):
-    if not self.IsReachable():
-      self.machine_checksum = None
-      return
-    self._GetMemoryInfo()
-    self._GetCPUInfo()
+    fingerprint = self._GetCachedFingerprint()
+    if fingerprint:
+      # Still make sure that the machine is up.
+      if not self.IsReachable():
+        self.machine_checksum = None
+        return
+    else:
+      fingerprint = self._GetFingerprint()
+      if not fingerprint:
+        self.machine_checksum = None
+        return
+      self._CacheFingerprint(fingerprint)
+    self.meminfo = fingerprint['meminfo']
+    self.cpuinfo = fingerprint['cpuinfo']
+    self.machine_id = fingerprint['machine_id']
+    self._ParseMemoryInfo()
     self._ComputeMachineChecksumString()
-    self._GetMachineID()
     self.machine_checksum = self._GetMD5Checksum(self.checksum_string)
     self.machine_id_checksum = self._GetMD5Checksum(self.machine_id)
 
+  def _GetFingerprint(self):
+    """Collect the machine's meminfo, cpuinfo and id in one remote command.
+
+    Returns:
+      A dict with the meminfo, cpuinfo and machine_id of the machine, or None
+      if the machine is not reachable.
+    """
+    command = '; '.join(
+        'echo %s%s; %s 2>/dev/null' % (FINGERPRINT_MARKER, name, cmd)
+        for name, cmd in FINGERPRINT_COMMANDS.iteritems())
+    ret, out, _ = self.ce.CrosRunCommandWOutput(
+        command + '; exit 0',
+        machine=self.name,
+        chromeos_root=self.chromeos_root)
+    if ret:
+      return None
+    sections = dict((name, []) for name in FINGERPRINT_COMMANDS)
+    lines = None
+    for line in out.splitlines(True):
+      if line.startswith(FINGERPRINT_MARKER):
+        lines = sections.get(line[len(FINGERPRINT_MARKER):].strip())
+      elif lines is not None:
+        lines.append(line)
+    sections = dict((name, ''.join(l)) for name, l in sections.iteritems())
+    assert sections['meminfo'], ('Could not get meminfo from machine: %s' %
+                                 self.name)
+    assert sections['cpuinfo'], ('Could not get cpuinfo from machine: %s' %
+                                 self.name)
+    return {
+        'meminfo': sections['meminfo'],
+        'cpuinfo': sections['cpuinfo'],
+        'machine_id': self._ParseMachineID(sections['vpd'],
+                                           sections['ifconfig'])
+    }
+
+  def _GetFingerprintFile(self):
+    return os.path.join(
+        os.path.expanduser(FINGERPRINT_CACHE_DIR), '%s.json' % self.name)
+
+  def _GetCachedFingerprint(self):
+    """Return the cached fingerprint of the machine, if it is recent enough."""
+    fingerprint_file = self._GetFingerprintFile()
+    try:
+      if time.time() - os.path.getmtime(fingerprint_file) > FINGERPRINT_TTL:
+        return None
+      with open(fingerprint_file) as f:
+        return json.load(f)
+    except (EnvironmentError, ValueError):
+      return None
+
+  def _CacheFingerprint(self, fingerprint):
+    fingerprint_file = self._GetFingerprintFile()
+    tmp_file = '%s.%d.tmp' % (fingerprint_file, os.getpid())
+    try:
+      if not os.path.isdir(os.path.dirname(fingerprint_file)):
+        os.makedirs(os.path.dirname(fingerprint_file))
+      with open(tmp_file, 'w') as f:
+        json.dump(fingerprint, f)
+      os.rename(tmp_file, fingerprint_file)
+    except EnvironmentError:
+      # The cache is only an optimization.
+      pass
+
   def IsReachable(self):
     command = 'ls'
     ret = self.ce.CrosRunCommand(
@@ -145,27 +234,17 @@ class CrosMachine(object):
     else:
       return ''
 
-  def _GetMachineID(self):
-    command = 'dump_vpd_log --full --stdout'
-    _, if_out, _ = self.ce.CrosRunCommandWOutput(
-        command, machine=self.name, chromeos_root=self.chromeos_root)
-    b = if_out.splitlines()
-    a = [l for l in b if 'Product' in l]
+  def _ParseMachineID(self, vpd_out, ifconfig_out):
+    a = [l for l in vpd_out.splitlines() if 'Product' in l]
     if len(a):
-      self.machine_id = a[0]
-      return
-    command = 'ifconfig'
-    _, if_out, _ = self.ce.CrosRunCommandWOutput(
-        command, machine=self.name, chromeos_root=self.chromeos_root)
-    b = if_out.splitlines()
+      return a[0]
+    b = ifconfig_out.splitlines()
     a = [l for l in b if 'HWaddr' in l]
     if len(a):
-      self.machine_id = '_'.join(a)
-      return
+      return '_'.join(a)
     a = [l for l in b if 'ether' in l]
     if len(a):
-      self.machine_id = '_'.join(a)
-      return
+      return '_'.join(a)
     assert 0, 'Could not get machine_id from machine: %s' % self.name
 
   def __str__(self):
@@ -200,7 +279,14 @@ class MachineManager(object):
     self._lock = threading.RLock()
     self._all_machines = []
     self._machines = []
-    self.image_lock = threading.Lock()
+    # Bounds the number of image pushes in flight. Each machine is only imaged
+    # by one thread at a time, and each image is staged once for all of them.
+    self.image_pool = threading.BoundedSemaphore(
+        config.GetConfig('concurrent_images') or DEFAULT_CONCURRENT_IMAGES)
+    self._host_image_locks = collections.defaultdict(threading.Lock)
+    self._image_stager = image_chromeos.ImageStager()
+    self._num_imaging = 0
+    self._save_ce_log_level = None
     self.num_reimages = 0
     self.chromeos_root = None
     self.machine_checksum = {}
@@ -260,44 +346,68 @@ class MachineManager(object):
     if label.board:
       image_chromeos_args.append('--board=%s' % label.board)
 
-    # Currently can't image two machines at once.
-    # So have to serialized on this lock.
-    save_ce_log_level = self.ce.log_level
-    if self.log_level != 'verbose':
-      self.ce.log_level = 'average'
+    self._BeginImaging()
+    try:
+      with self._lock:
+        host_lock = self._host_image_locks[machine.name]
+      with host_lock, self.image_pool:
+        # Another thread may have imaged the machine while we waited.
+        if checksum and (machine.checksum == checksum):
+          return 0
+        retval = self._DoImage(machine, image_chromeos_args)
+        if retval:
+          raise RuntimeError("Could not image machine: '%s'." % machine.name)
+        with self._lock:
+          self.num_reimages += 1
+        machine.checksum = checksum
+        machine.image = label.chromeos_image
+        machine.label = label
+
+      if not label.chrome_version:
+        label.chrome_version = self.GetChromeVersion(machine)
+    finally:
+      self._EndImaging()
+    return retval
+
+  def _BeginImaging(self):
+    # The command executer is shared by all the imaging threads, so only the
+    # first one in switches its log level, and the last one out restores it.
+    with self._lock:
+      if not self._num_imaging:
+        self._save_ce_log_level = self.ce.log_level
+        if self.log_level != 'verbose':
+          self.ce.log_level = 'average'
+      self._num_imaging += 1
 
-    with self.image_lock:
+  def _EndImaging(self):
+    with self._lock:
+      self._num_imaging -= 1
+      if not self._num_imaging:
+        self.ce.log_level = self._save_ce_log_level
+
+  def _DoImage(self, machine, image_chromeos_args):
+    """Push an image onto machine, rebooting it and retrying once."""
+    if self.log_level != 'verbose':
+      self.logger.LogOutput('Pushing image onto machine %s.' % machine.name)
+      self.logger.LogOutput('Running image_chromeos.DoImage with %s' %
+                            ' '.join(image_chromeos_args))
+    retval = 0
+    if not test_flag.GetTestMode():
+      retval = image_chromeos.DoImage(
+          image_chromeos_args, stager=self._image_stager)
+    if retval:
+      cmd = 'reboot && exit'
+      if self.log_level != 'verbose':
+        self.logger.LogOutput('reboot & exit.')
+      self.ce.CrosRunCommand(
+          cmd, machine=machine.name, chromeos_root=self.chromeos_root)
+      time.sleep(60)
       if self.log_level != 'verbose':
-        self.logger.LogOutput('Pushing image onto machine.')
+        self.logger.LogOutput('Pushing image onto machine %s.' % machine.name)
         self.logger.LogOutput('Running image_chromeos.DoImage with %s' %
                               ' '.join(image_chromeos_args))
-      retval = 0
-      if not test_flag.GetTestMode():
-        retval = image_chromeos.DoImage(image_chromeos_args)
-      if retval:
-        cmd = 'reboot && exit'
-        if self.log_level != 'verbose':
-          self.logger.LogOutput('reboot & exit.')
-        self.ce.CrosRunCommand(
-            cmd, machine=machine.name, chromeos_root=self.chromeos_root)
-        time.sleep(60)
-        if self.log_level != 'verbose':
-          self.logger.LogOutput('Pushing image onto machine.')
-          self.logger.LogOutput('Running image_chromeos.DoImage with %s' %
-                                ' '.join(image_chromeos_args))
-        retval = image_chromeos.DoImage(image_chromeos_args)
-      if retval:
-        raise RuntimeError("Could not image machine: '%s'." % machine.name)
-      else:
-        self.num_reimages += 1
-      machine.checksum = checksum
-      machine.image = label.chromeos_image
-      machine.label = label
-
-    if not label.chrome_version:
-      label.chrome_version = self.GetChromeVersion(machine)
-
-    self.ce.log_level = save_ce_log_level
+      retval = image_chromeos.DoImage(
+          image_chromeos_args, stager=self._image_stager)
     return retval
 
   def ComputeCommonCheckSum(self, label):
@@ -355,17 +465,44 @@ class MachineManager(object):
 
   # This is called from single threaded mode.
   def AddMachine(self, machine_name):
+    self.AddMachines([machine_name])
+
+  def AddMachines(self, machine_names):
+    """Probe the machines in parallel, and add the reachable ones in order."""
     with self._lock:
-      for m in self._all_machines:
-        assert m.name != machine_name, 'Tried to double-add %s' % machine_name
+      for machine_name in machine_names:
+        for m in self._all_machines:
+          assert m.name != machine_name, 'Tried to double-add %s' % machine_name
+
+    machines = [None] * len(machine_names)
+    errors = []
 
+    def _Probe(i, machine_name):
       if self.log_level != 'verbose':
         self.logger.LogOutput('Setting up remote access to %s' % machine_name)
         self.logger.LogOutput(
             'Checking machine characteristics for %s' % machine_name)
-      cm = CrosMachine(machine_name, self.chromeos_root, self.log_level)
-      if cm.machine_checksum:
-        self._all_machines.append(cm)
+      try:
+        machines[i] = CrosMachine(machine_name, self.chromeos_root,
+                                  self.log_level)
+      except Exception:  # pylint: disable=broad-except
+        errors.append(sys.exc_info())
+
+    threads = [
+        threading.Thread(target=_Probe, args=(i, machine_name))
+        for i, machine_name in enumerate(machine_names)
+    ]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    if errors:
+      raise errors[0][0], errors[0][1], errors[0][2]
+
+    with self._lock:
+      for cm in machines:
+        if cm and cm.machine_checksum:
+          self._all_machines.append(cm)
 
   def RemoveMachine(self, machine_name):
     with self._lock:
@@ -378,9 +515,23 @@ class MachineManager(object):
 
   def ForceSameImageToAllMachines(self, label):
     machines = self.GetMachines(label)
-    for m in machines:
-      self.ImageMachine(m, label)
-      m.SetUpChecksumInfo()
+    errors = []
+
+    def _ImageOne(m):
+      try:
+        self.ImageMachine(m, label)
+        m.SetUpChecksumInfo()
+      except RuntimeError as e:
+        errors.append(e)
+
+    # ImageMachine bounds how many of these actually push at the same time.
+    threads = [threading.Thread(target=_ImageOne, args=(m,)) for m in machines]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    if errors:
+      raise errors[0]
 
   def AcquireMachine(self, label):
     image_checksum = label.checksum
@@ -462,6 +613,7 @@ class MachineManager(object):
           break
 
   def Cleanup(self):
+    self._image_stager.Cleanup()
     with self._lock:
       # Unlock all machines (via file lock)
       for m in self._machines:
@@ -664,6 +816,10 @@ class MockMachineManager(MachineManager):
       if cm.IsReachable():
         self._all_machines.append(cm)
 
+  def AddMachines(self, machine_names):
+    for machine_name in machine_names:
+      self.AddMachine(machine_name)
+
   def GetChromeVersion(self, machine):
     return 'Mock Chrome Version R50'
 
@@ -6,12 +6,16 @@
 from __future__ import print_function
 
 import os.path
+import shutil
+import tempfile
+import threading
 import time
 import hashlib
 
 import mock
 import unittest
 
+import image_chromeos
 import label
 import machine_manager
 import image_checksummer
@@ -221,6 +225,57 @@ class MachineManagerTest(unittest.TestCase):
     self.assertEqual(mock_run_croscmd.call_count, 0)
     self.assertEqual(mock_sleep.call_count, 0)
 
+  @mock.patch.object(image_chromeos, 'DoImage')
+  def test_image_machines_concurrently(self, mock_do_image):
+    lock = threading.Lock()
+    in_flight = []
+    max_in_flight = [0]
+    stagers = set()
+
+    def FakeDoImage(args, stager=None):
+      remote = [a for a in args if a.startswith('--remote=')][0]
+      with lock:
+        self.assertNotIn(remote, in_flight)
+        in_flight.append(remote)
+        max_in_flight[0] = max(max_in_flight[0], len(in_flight))
+        stagers.add(stager)
+      time.sleep(0.1)
+      with lock:
+        in_flight.remove(remote)
+      return 0
+
+    mock_do_image.side_effect = FakeDoImage
+    self.mm.GetChromeVersion = mock.Mock(return_value='R50')
+    self.mm.image_pool = threading.BoundedSemaphore(2)
+    machines = [
+        self.mock_lumpy1, self.mock_lumpy2, self.mock_lumpy3, self.mock_lumpy4
+    ]
+    for m in machines:
+      m.checksum = 'old_checksum'
+    LABEL_LUMPY.checksum = 'new_checksum'
+    test_flag.SetTestMode(False)
+    try:
+      # The same machine is imaged twice at the same time, e.g. by two
+      # benchmark runs; the second push must be skipped.
+      threads = [
+          threading.Thread(target=self.mm.ImageMachine, args=(m, LABEL_LUMPY))
+          for m in machines + [self.mock_lumpy1]
+      ]
+      for t in threads:
+        t.start()
+      for t in threads:
+        t.join()
+    finally:
+      test_flag.SetTestMode(True)
+      LABEL_LUMPY.checksum = ''
+
+    self.assertEqual(mock_do_image.call_count, 4)
+    self.assertEqual(self.mm.num_reimages, 4)
+    self.assertEqual(max_in_flight[0], 2)
+    self.assertEqual(stagers, set([self.mm._image_stager]))
+    for m in machines:
+      self.assertEqual(m.checksum, 'new_checksum')
+
   def test_compute_common_checksum(self):
 
     self.mm.machine_checksum = {}
@@ -274,6 +329,24 @@ class MachineManagerTest(unittest.TestCase):
 
     self.assertRaises(Exception, self.mm.AddMachine, 'lumpy1')
 
+  @mock.patch.object(machine_manager, 'CrosMachine')
+  def test_add_machines(self, mock_machine):
+
+    def FakeCrosMachine(name, _chromeos_root, _log_level):
+      # Finish the probes out of order.
+      time.sleep(0.05 if name == 'daisy3' else 0)
+      cm = mock.Mock(spec=machine_manager.CrosMachine)
+      cm.name = name
+      cm.machine_checksum = None if name == 'daisy5' else name + '_checksum'
+      return cm
+
+    mock_machine.side_effect = FakeCrosMachine
+    self.mm.AddMachines(['daisy3', 'daisy4', 'daisy5', 'daisy6'])
+    self.assertEqual(mock_machine.call_count, 4)
+    self.assertEqual([m.name for m in self.mm._all_machines[5:]],
+                     ['daisy3', 'daisy4', 'daisy6'])
+    self.assertRaises(Exception, self.mm.AddMachines, ['daisy7', 'lumpy1'])
+
   def test_remove_machine(self):
     self.mm._machines = self.mm._all_machines
     self.assertTrue(self.mock_lumpy2 in self.mm._machines)
@@ -297,6 +370,8 @@ class MachineManagerTest(unittest.TestCase):
 
     self.mm.ForceSameImageToAllMachines(LABEL_LUMPY)
     self.assertEqual(len(self.image_log), 3)
+    # The machines are imaged concurrently, in no particular order.
+    self.image_log.sort()
     self.assertEqual(self.image_log[0],
                      'Pushed lumpy_chromeos_image onto lumpy1')
     self.assertEqual(self.image_log[1],
@@ -679,45 +754,62 @@ class CrosMachineTest(unittest.TestCase):
     self.assertEqual(cm.chromeos_root, '/usr/local/chromeos')
     self.assertEqual(cm.log_level, 'average')
 
-  @mock.patch.object(machine_manager.CrosMachine, 'IsReachable')
-  @mock.patch.object(machine_manager.CrosMachine, '_GetMemoryInfo')
-  @mock.patch.object(machine_manager.CrosMachine, '_GetCPUInfo')
-  @mock.patch.object(machine_manager.CrosMachine,
-                     '_ComputeMachineChecksumString')
-  @mock.patch.object(machine_manager.CrosMachine, '_GetMachineID')
-  @mock.patch.object(machine_manager.CrosMachine, '_GetMD5Checksum')
-  def test_setup_checksum_info(self, mock_md5sum, mock_machineid,
-                               mock_checkstring, mock_cpuinfo, mock_meminfo,
-                               mock_isreachable):
+  def test_setup_checksum_info(self):
+    tmpdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tmpdir)
+    patcher = mock.patch.object(machine_manager, 'FINGERPRINT_CACHE_DIR',
+                                tmpdir)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    mock_run_cmd = mock.Mock()
+    mock_reachable_cmd = mock.Mock(return_value=0)
+    self.mock_cmd_exec.CrosRunCommandWOutput = mock_run_cmd
+    self.mock_cmd_exec.CrosRunCommand = mock_reachable_cmd
 
     # Test 1. Machine is not reachable; SetUpChecksumInfo is called via
     # __init__.
-    mock_isreachable.return_value = False
-    mock_md5sum.return_value = 'md5_checksum'
+    mock_run_cmd.return_value = [255, '', '']
     cm = machine_manager.CrosMachine('daisy.cros', '/usr/local/chromeos',
                                      'average', self.mock_cmd_exec)
-    cm.checksum_string = 'This is a checksum string.'
-    cm.machine_id = 'machine_id1'
-    self.assertEqual(mock_isreachable.call_count, 1)
+    self.assertEqual(mock_run_cmd.call_count, 1)
     self.assertIsNone(cm.machine_checksum)
-    self.assertEqual(mock_meminfo.call_count, 0)
 
-    # Test 2. Machine is reachable. Call explicitly.
-    mock_isreachable.return_value = True
-    cm.checksum_string = 'This is a checksum string.'
-    cm.machine_id = 'machine_id1'
+    # Test 2. Machine is reachable; everything is collected in one command.
+    marker = machine_manager.FINGERPRINT_MARKER
+    mock_run_cmd.return_value = [
+        0, ''.join([
+            marker + 'meminfo\n', MEMINFO_STRING, marker + 'cpuinfo\n',
+            CPUINFO_STRING, marker + 'vpd\n', DUMP_VPD_STRING,
+            marker + 'ifconfig\n', IFCONFIG_STRING
+        ]), ''
+    ]
     cm.SetUpChecksumInfo()
-    self.assertEqual(mock_isreachable.call_count, 2)
-    self.assertEqual(mock_meminfo.call_count, 1)
-    self.assertEqual(mock_cpuinfo.call_count, 1)
-    self.assertEqual(mock_checkstring.call_count, 1)
-    self.assertEqual(mock_machineid.call_count, 1)
-    self.assertEqual(mock_md5sum.call_count, 2)
-    self.assertEqual(cm.machine_checksum, 'md5_checksum')
-    self.assertEqual(cm.machine_id_checksum, 'md5_checksum')
-    self.assertEqual(mock_md5sum.call_args_list[0][0][0],
-                     'This is a checksum string.')
-    self.assertEqual(mock_md5sum.call_args_list[1][0][0], 'machine_id1')
+    self.assertEqual(mock_run_cmd.call_count, 2)
+    self.assertEqual(cm.meminfo, MEMINFO_STRING)
+    self.assertEqual(cm.checksum_string, CHECKSUM_STRING)
+    self.assertEqual(cm.machine_id, '"Product_S/N"="HT4L91SC300208"')
+    self.assertEqual(cm.machine_checksum,
+                     hashlib.md5(CHECKSUM_STRING).hexdigest())
+    self.assertEqual(cm.machine_id_checksum,
+                     hashlib.md5(cm.machine_id).hexdigest())
+    self.assertEqual(mock_reachable_cmd.call_count, 0)
+
+    # Test 3. The fingerprint is cached; only check that the machine is up.
+    cm2 = machine_manager.CrosMachine('daisy.cros', '/usr/local/chromeos',
+                                      'average', self.mock_cmd_exec)
+    self.assertEqual(mock_run_cmd.call_count, 2)
+    self.assertEqual(mock_reachable_cmd.call_count, 1)
+    self.assertEqual(cm2.machine_checksum, cm.machine_checksum)
+    self.assertEqual(cm2.machine_id_checksum, cm.machine_id_checksum)
+
+    # Test 4. The cached fingerprint expired.
+    fingerprint_file = os.path.join(tmpdir, 'daisy.cros.json')
+    old = time.time() - machine_manager.FINGERPRINT_TTL - 1
+    os.utime(fingerprint_file, (old, old))
+    machine_manager.CrosMachine('daisy.cros', '/usr/local/chromeos', 'average',
+                                self.mock_cmd_exec)
+    self.assertEqual(mock_run_cmd.call_count, 3)
+    self.assertEqual(mock_reachable_cmd.call_count, 1)
 
   @mock.patch.object(command_executer.CommandExecuter, 'CrosRunCommand')
   @mock.patch.object(machine_manager.CrosMachine, 'SetUpChecksumInfo')
@@ -816,28 +908,20 @@ class CrosMachineTest(unittest.TestCase):
     checksum_str = cm._GetMD5Checksum(temp_str)
     self.assertEqual(checksum_str, '')
 
-  @mock.patch.object(command_executer.CommandExecuter, 'CrosRunCommandWOutput')
   @mock.patch.object(machine_manager.CrosMachine, 'SetUpChecksumInfo')
-  def test_get_machine_id(self, _mock_setup, mock_run_cmd):
+  def test_parse_machine_id(self, _mock_setup):
     cm = machine_manager.CrosMachine('daisy.cros', '/usr/local/chromeos',
                                      'average', self.mock_cmd_exec)
-    self.mock_cmd_exec.CrosRunCommandWOutput = mock_run_cmd
-    mock_run_cmd.return_value = [0, DUMP_VPD_STRING, '']
-
-    cm._GetMachineID()
-    self.assertEqual(cm.machine_id, '"Product_S/N"="HT4L91SC300208"')
-
-    mock_run_cmd.return_value = [0, IFCONFIG_STRING, '']
-    cm._GetMachineID()
     self.assertEqual(
-        cm.machine_id,
+        cm._ParseMachineID(DUMP_VPD_STRING, ''),
+        '"Product_S/N"="HT4L91SC300208"')
+    self.assertEqual(
+        cm._ParseMachineID('', IFCONFIG_STRING),
         '        ether 00:50:b6:63:db:65  txqueuelen 1000  (Ethernet)_        '
         'ether e8:03:9a:9c:50:3d  txqueuelen 1000  (Ethernet)_        ether '
         '44:6d:57:20:4a:c5  txqueuelen 1000  (Ethernet)')
-
-    mock_run_cmd.return_value = [0, 'invalid hardware config', '']
-    self.assertRaises(cm._GetMachineID)
-
+    self.assertRaises(AssertionError, cm._ParseMachineID, '',
+                      'invalid hardware config')
 
 if __name__ == '__main__':
   unittest.main()
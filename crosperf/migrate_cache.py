@@ -0,0 +1,107 @@
+#!/usr/bin/env python2
+
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Convert crosperf cache entries from results.txt to the cache record format.
+
+Older entries keep the stdout, stderr and retval of a run pickled one after
+another in results.txt. This writes each of them again as a cache record (see
+results_cache.WriteCacheRecord), so reading them back no longer unpickles the
+whole output. The keyvals of migrated entries are left unknown; they are
+computed from the cached results on a cache hit, as before.
+
+Crosperf versions that predate the record format can not read it, so the
+record goes to a new entry under the key of the current cache version, and
+the old entry is left for them. The other files of the entry are hard linked
+into the new one where possible.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+import cache_index
+import results_cache
+
+
+def _LinkOrCopy(src, dst):
+  if os.path.isdir(src):
+    shutil.copytree(src, dst)
+    return
+  try:
+    os.link(src, dst)
+  except OSError:
+    shutil.copy2(src, dst)
+
+
+def MigrateCacheDir(cache_dir):
+  """Convert one cache entry.
+
+  Returns:
+    The path of the new entry, or None if cache_dir needed no converting.
+  """
+  cache_root, dirname = os.path.split(os.path.abspath(cache_dir))
+  keys = cache_index.ParseCacheDirName(dirname)
+  if (not keys or
+      int(keys[-1]) not in results_cache.ResultsCache.OLD_CACHE_VERSIONS):
+    return None
+  # The version is the last component of the name.
+  new_dir = os.path.join(
+      cache_root, dirname[:-len(keys[-1])] +
+      str(results_cache.ResultsCache.CACHE_VERSION))
+  results_file = os.path.join(cache_dir, results_cache.RESULTS_FILE)
+  if not os.path.exists(results_file) or os.path.exists(new_dir):
+    return None
+  with open(results_file, 'r') as f:
+    out = pickle.load(f)
+    err = pickle.load(f)
+    retval = pickle.load(f)
+  # Build the new entry aside, so that it only shows up once complete.
+  temp_dir = tempfile.mkdtemp(prefix='.migrate.', dir=cache_root)
+  try:
+    for name in os.listdir(cache_dir):
+      if name != results_cache.RESULTS_FILE:
+        _LinkOrCopy(os.path.join(cache_dir, name), os.path.join(temp_dir, name))
+    results_cache.WriteCacheRecord(temp_dir, out, err, retval)
+    os.chmod(temp_dir, os.stat(cache_dir).st_mode)
+    os.rename(temp_dir, new_dir)
+  except Exception:
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    raise
+  return new_dir
+
+
+def Main(argv):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument(
+      'cache_roots',
+      nargs='*',
+      default=[results_cache.SCRATCH_DIR],
+      help='Cache root directories. Defaults to %(default)s.')
+  options = parser.parse_args(argv)
+
+  num_migrated = 0
+  num_failed = 0
+  for cache_root in options.cache_roots:
+    for dirname in os.listdir(cache_root):
+      cache_dir = os.path.join(cache_root, dirname)
+      if not os.path.isdir(cache_dir):
+        continue
+      try:
+        if MigrateCacheDir(cache_dir):
+          num_migrated += 1
+      except (EnvironmentError, pickle.UnpicklingError, EOFError) as e:
+        print('Could not migrate %s: %s' % (cache_dir, e))
+        num_failed += 1
+  print('Migrated %d cache entries, %d failed.' % (num_migrated, num_failed))
+  return 1 if num_failed else 0
+
+
+if __name__ == '__main__':
+  sys.exit(Main(sys.argv[1:]))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python2
+
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Unit tests for the cache migration tool."""
+
+from __future__ import print_function
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import cache_index
+import migrate_cache
+import results_cache
+
+KEYS = ('54524606abaae4fdf7b02f49f7ae7127', 'sunspider', '1',
+        'fda29412ceccb72977516c4785d08e2c', 'FakeImageChecksumabc123',
+        'FakeMachineChecksumabc987', '')
+
+
+class MigrateCacheTest(unittest.TestCase):
+  """Tests for migrate_cache."""
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.tmpdir,
+                                  cache_index.GetCacheDirName(KEYS + ('6',)))
+    self.new_cache_dir = os.path.join(
+        self.tmpdir, cache_index.GetCacheDirName(KEYS + ('7',)))
+    shutil.copytree('test_cache/test_puretelemetry_input', self.cache_dir)
+    with open(os.path.join(self.cache_dir, 'results.txt'), 'r') as f:
+      self.out = pickle.load(f)
+      self.err = pickle.load(f)
+      self.retval = pickle.load(f)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_migrate_cache_dir(self):
+    self.assertEqual(
+        migrate_cache.MigrateCacheDir(self.cache_dir), self.new_cache_dir)
+    # The old entry is left for older crosperf.
+    self.assertTrue(os.path.exists(os.path.join(self.cache_dir, 'results.txt')))
+    self.assertIsNone(results_cache.ReadCacheRecord(self.cache_dir))
+
+    self.assertEqual(
+        sorted(os.listdir(self.new_cache_dir)),
+        ['machine.txt', 'record.json', 'stderr.gz', 'stdout.gz'])
+    record = results_cache.ReadCacheRecord(self.new_cache_dir)
+    self.assertEqual(record['retval'], self.retval)
+    self.assertIsNone(record['keyvals'])
+    self.assertEqual(
+        results_cache.ReadCacheBlob(self.new_cache_dir, 'stdout.gz'), self.out)
+    self.assertEqual(
+        results_cache.ReadCacheBlob(self.new_cache_dir, 'stderr.gz'), self.err)
+
+    # Migrated entries are left alone.
+    self.assertIsNone(migrate_cache.MigrateCacheDir(self.cache_dir))
+    self.assertIsNone(migrate_cache.MigrateCacheDir(self.new_cache_dir))
+
+  def test_main(self):
+    with open(os.path.join(self.tmpdir, 'stray_file'), 'w'):
+      pass
+    os.mkdir(os.path.join(self.tmpdir, 'stray_dir'))
+    self.assertEqual(migrate_cache.Main([self.tmpdir]), 0)
+    self.assertIsNotNone(results_cache.ReadCacheRecord(self.new_cache_dir))
+    self.assertEqual(
+        sorted(os.listdir(self.tmpdir)),
+        sorted([
+            os.path.basename(self.cache_dir),
+            os.path.basename(self.new_cache_dir), 'stray_dir', 'stray_file'
+        ]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,98 @@
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Parse the output of perf report, for the results cache and reports."""
+
+from __future__ import print_function
+
+import itertools
+import re
+
+# Parsed perf reports are stored next to the reports, with this suffix, so that
+# the reports are only parsed once.
+PERF_SUMMARY_SUFFIX = '.summary.json'
+# Number of functions kept per event in a parsed perf report. perf report sorts
+# them by percentage, and only the top ResultsReport.PERF_ROWS are shown.
+PERF_SUMMARY_ENTRIES = 100
+
+
+def ParseStandardPerfReport(report_data, max_entries=None):
+  """Parses the output of `perf report`.
+
+  It'll parse the following:
+  {{garbage}}
+  # Samples: 1234M of event 'foo'
+
+  1.23% command shared_object location function::name
+
+  1.22% command shared_object location function2::name
+
+  # Samples: 999K of event 'bar'
+
+  0.23% command shared_object location function3::name
+  {{etc.}}
+
+  Into:
+    {'foo': {'function::name': 1.23, 'function2::name': 1.22},
+     'bar': {'function3::name': 0.23, etc.}}
+
+  If max_entries is given, only the first max_entries functions of each event
+  are parsed; the rest of its lines are skipped without being matched.
+  """
+  # This function fails silently on its if it's handed a string (as opposed to a
+  # list of lines). So, auto-split if we do happen to get a string.
+  if isinstance(report_data, basestring):
+    report_data = report_data.splitlines()
+
+  # Samples: N{K,M,G} of event 'event-name'
+  samples_regex = re.compile(r"#\s+Samples: \d+\S? of event '([^']+)'")
+
+  # We expect lines like:
+  # N.NN%  command  samples  shared_object  [location] symbol
+  #
+  # Note that we're looking at stripped lines, so there is no space at the
+  # start.
+  perf_regex = re.compile(r'^(\d+(?:.\d*)?)%'  # N.NN%
+                          r'\s*\d+'  # samples count (ignored)
+                          r'\s*\S+'  # command (ignored)
+                          r'\s*\S+'  # shared_object (ignored)
+                          r'\s*\[.\]'  # location (ignored)
+                          r'\s*(\S.+)'  # function
+                         )
+
+  stripped_lines = (l.strip() for l in report_data)
+  nonempty_lines = (l for l in stripped_lines if l)
+  # Ignore all lines before we see samples_regex
+  interesting_lines = itertools.dropwhile(lambda x: not samples_regex.match(x),
+                                          nonempty_lines)
+
+  first_sample_line = next(interesting_lines, None)
+  # Went through the entire file without finding a 'samples' header. Quit.
+  if first_sample_line is None:
+    return {}
+
+  sample_name = samples_regex.match(first_sample_line).group(1)
+  current_result = {}
+  results = {sample_name: current_result}
+  for line in interesting_lines:
+    if (max_entries is not None and len(current_result) >= max_entries and
+        not line.startswith('#')):
+      continue
+    samples_match = samples_regex.match(line)
+    if samples_match:
+      sample_name = samples_match.group(1)
+      current_result = {}
+      results[sample_name] = current_result
+      continue
+
+    match = perf_regex.match(line)
+    if not match:
+      continue
+    percentage_str, func_name = match.groups()
+    try:
+      percentage = float(percentage_str)
+    except ValueError:
+      # Couldn't parse it; try to be "resilient".
+      continue
+    current_result[func_name] = percentage
+  return results
@@ -5,12 +5,19 @@
 
 from __future__ import print_function
 
+import collections
 import glob
+import gzip
 import hashlib
+import multiprocessing
+from multiprocessing import pool
 import os
 import pickle
+import Queue
 import re
 import tempfile
+import threading
+import time
 import json
 
 from cros_utils import command_executer
@@ -18,15 +25,122 @@ from cros_utils import misc
 
 from image_checksummer import ImageChecksummer
 
+import cache_index
+import config
+import perf_report
 import results_report
 import test_flag
 
 SCRATCH_DIR = os.path.expanduser('~/cros_scratch')
+# Pickled stdout, stderr and retval of the run, in CACHE_VERSION 6 entries.
+# Only read nowadays, newer entries have the record below instead.
 RESULTS_FILE = 'results.txt'
 MACHINE_FILE = 'machine.txt'
 AUTOTEST_TARBALL = 'autotest.tbz2'
 PERF_RESULTS_FILE = 'perf-results.txt'
 CACHE_KEYS_FILE = 'cache_keys.txt'
+# A cache record is a small JSON header holding the retval, the processed
+# keyvals and the tarball members with the perf files, plus the raw stdout
+# and stderr of the run in separate compressed files that are only read when
+# somebody asks for them.
+RECORD_FILE = 'record.json'
+STDOUT_FILE = 'stdout.gz'
+STDERR_FILE = 'stderr.gz'
+RECORD_VERSION = 1
+PERF_DATA_FILE = 'perf.data'
+# Compressors for the autotest tarball, selected by the cache_compression
+# setting. Each maps to the tarball name and the program tar compresses it
+# with; cached entries are read back with the codec their tarball name implies.
+CACHE_CODECS = collections.OrderedDict([
+    ('bzip2', (AUTOTEST_TARBALL, 'bzip2')),
+    ('pbzip2', (AUTOTEST_TARBALL, 'pbzip2')),
+    ('zstd', ('autotest.tar.zst', 'zstd -T0')),
+    ('lz4', ('autotest.tar.lz4', 'lz4')),
+])
+DEFAULT_CACHE_CODEC = 'bzip2'
+# Number of threads storing results to the cache in the background.
+CACHE_STORE_THREADS = 4
+# Maximum number of perf report commands run at once for a result.
+PERF_REPORT_JOBS = multiprocessing.cpu_count()
+
+
+def WriteCacheRecord(cache_dir,
+                     out,
+                     err,
+                     retval,
+                     keyvals=None,
+                     perf_data_files=None,
+                     perf_report_files=None,
+                     run_duration=None,
+                     perf_summaries=None):
+  """Write a cache record to cache_dir.
+
+  keyvals may be None if they are unknown, e.g. for migrated entries; they are
+  then computed from the cached results on a cache hit, as for old entries.
+  run_duration is the time the run took on the DUT, in seconds, if known.
+  perf_summaries are the parsed perf_report_files, see
+  perf_report.ParseStandardPerfReport.
+  """
+  for name, data in ((STDOUT_FILE, out), (STDERR_FILE, err)):
+    f = gzip.open(os.path.join(cache_dir, name), 'wb')
+    try:
+      f.write(data or '')
+    finally:
+      f.close()
+  # The header goes last, its presence marks a complete record.
+  with open(os.path.join(cache_dir, RECORD_FILE), 'w') as f:
+    json.dump({
+        'version': RECORD_VERSION,
+        'retval': retval,
+        'keyvals': keyvals,
+        'perf_data_files': perf_data_files or [],
+        'perf_report_files': perf_report_files or [],
+        'run_duration': run_duration,
+        'perf_summaries': perf_summaries or []
+    }, f)
+
+
+def _StrFromJson(value):
+  """Turn the unicode strings json gives back into the str they were."""
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+  if isinstance(value, list):
+    return [_StrFromJson(v) for v in value]
+  if isinstance(value, dict):
+    return dict((_StrFromJson(k), _StrFromJson(v)) for k, v in value.items())
+  return value
+
+
+def ReadCacheRecord(cache_dir):
+  """Return the cache record header in cache_dir, or None if it has none."""
+  record_file = os.path.join(cache_dir, RECORD_FILE)
+  if not os.path.exists(record_file):
+    return None
+  with open(record_file, 'r') as f:
+    # Keyvals must be str as in fresh runs, reports tell strings by that.
+    record = _StrFromJson(json.load(f))
+  if record['version'] > RECORD_VERSION:
+    raise RuntimeError('Unsupported cache record version %s in %s' %
+                       (record['version'], cache_dir))
+  return record
+
+
+def ReadCacheBlob(cache_dir, name):
+  f = gzip.open(os.path.join(cache_dir, name), 'rb')
+  try:
+    return f.read()
+  finally:
+    f.close()
+
+
+def GetCachedTarball(cache_dir):
+  """Return the autotest tarball in cache_dir and its compressor."""
+  for tarball, compressor in CACHE_CODECS.values():
+    path = os.path.join(cache_dir, tarball)
+    if os.path.exists(path):
+      return path, compressor
+  # Entries of telemetry runs have no tarball.
+  return os.path.join(cache_dir, AUTOTEST_TARBALL), None
 
 
 class Result(object):
@@ -38,6 +152,10 @@ class Result(object):
   """
 
   def __init__(self, logger, label, log_level, machine, cmd_exec=None):
+    # Whether out and err are still to be read from the cache record.
+    self._cached_output = False
+    self._out = None
+    self._err = None
     self.chromeos_root = label.chromeos_root
     self._logger = logger
     self.ce = cmd_exec or command_executer.GetCommandExecuter(
@@ -49,6 +167,8 @@ class Result(object):
     self.machine = machine
     self.perf_data_files = []
     self.perf_report_files = []
+    # The parsed perf_report_files, see perf_report.ParseStandardPerfReport.
+    self.perf_summaries = []
     self.results_file = []
     self.chrome_version = ''
     self.err = None
@@ -59,6 +179,32 @@ class Result(object):
     self.suite = None
     self.retval = None
     self.out = None
+    self.cache_dir = None
+    # Seconds the benchmark took to run on the DUT, if known.
+    self.run_duration = None
+    # Members of the cached tarball that are only extracted once they are
+    # actually needed, i.e. when copying results out (see CopyResultsTo).
+    self.deferred_members = []
+
+  @property
+  def out(self):
+    if self._out is None and self._cached_output:
+      self._out = ReadCacheBlob(self.cache_dir, STDOUT_FILE)
+    return self._out
+
+  @out.setter
+  def out(self, value):
+    self._out = value
+
+  @property
+  def err(self):
+    if self._err is None and self._cached_output:
+      self._err = ReadCacheBlob(self.cache_dir, STDERR_FILE)
+    return self._err
+
+  @err.setter
+  def err(self, value):
+    self._err = value
 
   def CopyFilesTo(self, dest_dir, files_to_copy):
     file_index = 0
@@ -73,8 +219,10 @@ class Result(object):
         raise IOError('Could not copy results file: %s' % file_to_copy)
 
   def CopyResultsTo(self, dest_dir):
+    self.ExtractDeferredMembers()
     self.CopyFilesTo(dest_dir, self.perf_data_files)
     self.CopyFilesTo(dest_dir, self.perf_report_files)
+    self.WritePerfSummaries(dest_dir)
     if len(self.perf_data_files) or len(self.perf_report_files):
       self._logger.LogOutput('Perf results files stored in %s.' % dest_dir)
 
@@ -221,6 +369,7 @@ class Result(object):
 
   def GeneratePerfReportFiles(self):
     perf_report_files = []
+    commands = []
     for perf_data_file in self.perf_data_files:
       # Generate a perf.report and store it side-by-side with the perf.data
       # file.
@@ -246,25 +395,73 @@ class Result(object):
                  '-i %s --stdio '
                  '> %s' % (perf_file, self.board, self.board, self.board,
                            chroot_perf_data_file, chroot_perf_report_file))
-      self.ce.ChrootRunCommand(self.chromeos_root, command)
+      commands.append(command)
 
       # Add a keyval to the dictionary for the events captured.
       perf_report_files.append(
           misc.GetOutsideChrootPath(self.chromeos_root,
                                     chroot_perf_report_file))
+
+    # The reports are independent, generate them concurrently.
+    if commands:
+      workers = pool.ThreadPool(min(len(commands), PERF_REPORT_JOBS))
+      try:
+        workers.map(
+            lambda command: self.ce.ChrootRunCommand(self.chromeos_root,
+                                                     command), commands)
+      finally:
+        workers.close()
+        workers.join()
     return perf_report_files
 
   def GatherPerfResults(self):
+    """Parse the perf reports into keyvals and self.perf_summaries.
+
+    Each report is read once, as a stream.
+    """
     report_id = 0
+    self.perf_summaries = []
     for perf_report_file in self.perf_report_files:
+      events = []
+
+      def _Lines(f):
+        for line in f:
+          if 'Events: ' in line:
+            events.extend(re.findall(r'Events: (\S+) (\S+)', line))
+          yield line
+
       with open(perf_report_file, 'r') as f:
-        report_contents = f.read()
-        for group in re.findall(r'Events: (\S+) (\S+)', report_contents):
-          num_events = group[0]
-          event_name = group[1]
-          key = 'perf_%s_%s' % (report_id, event_name)
-          value = str(misc.UnitToNumber(num_events))
-          self.keyvals[key] = value
+        self.perf_summaries.append(
+            perf_report.ParseStandardPerfReport(
+                _Lines(f), perf_report.PERF_SUMMARY_ENTRIES))
+      for num_events, event_name in events:
+        key = 'perf_%s_%s' % (report_id, event_name)
+        value = str(misc.UnitToNumber(num_events))
+        self.keyvals[key] = value
+
+  def WritePerfSummaries(self, dest_dir):
+    """Write the parsed perf reports next to the copies of the reports.
+
+    The reports of cache entries that predate perf_summaries are parsed here.
+    """
+    summaries = self.perf_summaries
+    if len(summaries) != len(self.perf_report_files):
+      summaries = []
+      for perf_report_file in self.perf_report_files:
+        try:
+          with open(perf_report_file, 'r') as f:
+            summaries.append(
+                perf_report.ParseStandardPerfReport(
+                    f, perf_report.PERF_SUMMARY_ENTRIES))
+        except IOError:
+          return
+    for perf_report_file, summary in zip(self.perf_report_files, summaries):
+      # Named like the copy of the report made by CopyFilesTo.
+      summary_file = os.path.join(
+          dest_dir, '%s.0%s' % (os.path.basename(perf_report_file),
+                                perf_report.PERF_SUMMARY_SUFFIX))
+      with open(summary_file, 'w') as f:
+        json.dump(summary, f)
 
   def PopulateFromRun(self, out, err, retval, test, suite):
     self.board = self.label.board
@@ -354,29 +551,83 @@ class Result(object):
             break
     return chrome_version
 
+  def UntarCachedResults(self, members=None, exclude=None):
+    """Extract (part of) the cached autotest tarball to self.temp_dir."""
+    if not self.temp_dir:
+      self.temp_dir = tempfile.mkdtemp(dir=os.path.join(self.chromeos_root,
+                                                        'chroot', 'tmp'))
+    tarball, compressor = GetCachedTarball(self.cache_dir)
+    command = 'cd %s && tar xf %s' % (self.temp_dir, tarball)
+    if not tarball.endswith(AUTOTEST_TARBALL):
+      # tar detects bzip2 by itself, but not every tar detects the others.
+      command += " -I '%s'" % compressor
+    if exclude:
+      command += ' --exclude=%s' % exclude
+    if members:
+      command += ' ' + ' '.join(members)
+    ret = self.ce.RunCommand(command, print_to_console=False)
+    if ret:
+      raise RuntimeError('Could not untar cached tarball')
+
+  def ExtractDeferredMembers(self):
+    """Extract the cached files whose extraction was put off on a cache hit.
+
+    On a cache hit only what ProcessResults needs is extracted; the perf data
+    files, which can be huge, are only extracted here once they are needed.
+    """
+    if not self.deferred_members:
+      return
+    self.UntarCachedResults(members=self.deferred_members)
+    for member in self.deferred_members:
+      path = os.path.normpath(os.path.join(self.temp_dir, member))
+      if path.endswith('.report'):
+        self.perf_report_files.append(path)
+      else:
+        self.perf_data_files.append(path)
+    self.deferred_members = []
+
+  def ReadFromCacheDir(self, cache_dir):
+    """Read the retval, output and possibly keyvals of a cached result."""
+    self.cache_dir = cache_dir
+    record = ReadCacheRecord(cache_dir)
+    if not record:
+      with open(os.path.join(cache_dir, RESULTS_FILE), 'r') as f:
+        self.out = pickle.load(f)
+        self.err = pickle.load(f)
+        self.retval = pickle.load(f)
+      return
+    self.retval = record['retval']
+    self.run_duration = record.get('run_duration')
+    self._cached_output = True
+    if record['keyvals'] is not None:
+      self.keyvals = record['keyvals']
+      self.perf_summaries = record.get('perf_summaries', [])
+      self.deferred_members = (
+          record['perf_data_files'] + record['perf_report_files'])
+
   def PopulateFromCacheDir(self, cache_dir, test, suite):
     self.test_name = test
     self.suite = suite
     # Read in everything from the cache directory.
-    with open(os.path.join(cache_dir, RESULTS_FILE), 'r') as f:
-      self.out = pickle.load(f)
-      self.err = pickle.load(f)
-      self.retval = pickle.load(f)
+    self.ReadFromCacheDir(cache_dir)
+    self.chrome_version = self.GetChromeVersionFromCache(cache_dir)
 
-    # Untar the tarball to a temporary directory
-    self.temp_dir = tempfile.mkdtemp(dir=os.path.join(self.chromeos_root,
-                                                      'chroot', 'tmp'))
+    # If the keyvals were stored along with the result, there is no need to
+    # touch the tarball until the perf files are asked for.
+    if self.keyvals is not None:
+      return
 
-    command = ('cd %s && tar xf %s' %
-               (self.temp_dir, os.path.join(cache_dir, AUTOTEST_TARBALL)))
-    ret = self.ce.RunCommand(command, print_to_console=False)
-    if ret:
-      raise RuntimeError('Could not untar cached tarball')
+    # Untar the tarball to a temporary directory, leaving out the perf data
+    # files, which are not needed to process the results.
+    self.UntarCachedResults(exclude=PERF_DATA_FILE)
     self.results_dir = self.temp_dir
     self.results_file = self.GetDataMeasurementsFiles()
-    self.perf_data_files = self.GetPerfDataFiles()
     self.perf_report_files = self.GetPerfReportFiles()
-    self.chrome_version = self.GetChromeVersionFromCache(cache_dir)
+    # Every perf.data file has a perf.data.report next to it.
+    self.deferred_members = [
+        os.path.join('.', os.path.relpath(f[:-len('.report')], self.temp_dir))
+        for f in self.perf_report_files
+    ]
     self.ProcessResults(use_cache=True)
 
   def CleanUp(self, rm_chroot_tmp):
@@ -391,15 +642,25 @@ class Result(object):
       command = 'rm -rf %s' % self.temp_dir
       self.ce.RunCommand(command)
 
+  def _GetTarballMembers(self, files):
+    return [
+        os.path.join('.', os.path.relpath(f, self.results_dir)) for f in files
+    ]
+
   def StoreToCacheDir(self, cache_dir, machine_manager, key_list):
     # Create the dir if it doesn't exist.
     temp_dir = tempfile.mkdtemp()
 
-    # Store to the temp directory.
-    with open(os.path.join(temp_dir, RESULTS_FILE), 'w') as f:
-      pickle.dump(self.out, f)
-      pickle.dump(self.err, f)
-      pickle.dump(self.retval, f)
+    # Store to the temp directory. The processed keyvals are stored too, so
+    # that a cache hit does not need to extract and re-parse the results.
+    if self.results_dir:
+      perf_data_files = self._GetTarballMembers(self.perf_data_files)
+      perf_report_files = self._GetTarballMembers(self.perf_report_files)
+    else:
+      perf_data_files = perf_report_files = None
+    WriteCacheRecord(temp_dir, self.out, self.err, self.retval, self.keyvals,
+                     perf_data_files, perf_report_files, self.run_duration,
+                     self.perf_summaries)
 
     if not test_flag.GetTestMode():
       with open(os.path.join(temp_dir, CACHE_KEYS_FILE), 'w') as f:
@@ -411,15 +672,25 @@ class Result(object):
           f.write('\n')
 
     if self.results_dir:
-      tarball = os.path.join(temp_dir, AUTOTEST_TARBALL)
+      codec = config.GetConfig('cache_compression') or DEFAULT_CACHE_CODEC
+      tarball_name, compressor = CACHE_CODECS[codec]
+      tarball = os.path.join(temp_dir, tarball_name)
+      if codec == DEFAULT_CACHE_CODEC:
+        compress_args = '-cjf'
+      else:
+        compress_args = "-I '%s' -cf" % compressor
       command = ('cd %s && '
                  'tar '
                  '--exclude=var/spool '
                  '--exclude=var/log '
-                 '-cjf %s .' % (self.results_dir, tarball))
+                 '%s %s .' % (self.results_dir, compress_args, tarball))
+      start_time = time.time()
       ret = self.ce.RunCommand(command)
       if ret:
         raise RuntimeError("Couldn't store autotest output directory.")
+      self._logger.LogOutput(
+          'Compressed results with %s in %.1fs: %d bytes in cache.' %
+          (codec, time.time() - start_time, os.path.getsize(tarball)))
     # Store machine info.
     # TODO(asharif): Make machine_manager a singleton, and don't pass it into
     # this function.
@@ -530,14 +801,11 @@ class TelemetryResult(Result):
   def PopulateFromCacheDir(self, cache_dir, test, suite):
     self.test_name = test
     self.suite = suite
-    with open(os.path.join(cache_dir, RESULTS_FILE), 'r') as f:
-      self.out = pickle.load(f)
-      self.err = pickle.load(f)
-      self.retval = pickle.load(f)
-
+    self.ReadFromCacheDir(cache_dir)
     self.chrome_version = \
         super(TelemetryResult, self).GetChromeVersionFromCache(cache_dir)
-    self.ProcessResults()
+    if self.keyvals is None:
+      self.ProcessResults()
 
 
 class CacheConditions(object):
@@ -574,7 +842,13 @@ class ResultsCache(object):
   is exactly stored (value). The value generation is handled by the Results
   class.
   """
-  CACHE_VERSION = 6
+  # Entries of version 7 on hold a cache record (see WriteCacheRecord) rather
+  # than results.txt, which older crosperf can not read, so they have keys of
+  # their own. See migrate_cache for converting older entries.
+  CACHE_VERSION = 7
+  # Versions of older entries that are still read, when there is no entry of
+  # CACHE_VERSION.
+  OLD_CACHE_VERSIONS = (6,)
 
   def __init__(self):
     # Proper initialization happens in the Init function below.
@@ -622,13 +896,22 @@ class ResultsCache(object):
     self.run_local = run_local
 
   def GetCacheDirForRead(self):
-    matching_dirs = []
-    for glob_path in self.FormCacheDir(self.GetCacheKeyList(True)):
-      matching_dirs += glob.glob(glob_path)
+    key_list = self.GetCacheKeyList(True)
+    for version in (self.CACHE_VERSION,) + self.OLD_CACHE_VERSIONS:
+      key_list = key_list[:-1] + (str(version),)
+      matching_dirs = []
+      for glob_path in self.FormCacheDir(key_list):
+        # Use the index of the cache root if we have one, rather than globbing
+        # every entry in it.
+        index = cache_index.GetCacheIndex(os.path.dirname(glob_path))
+        if index:
+          matching_dirs += index.Lookup(key_list)
+        else:
+          matching_dirs += glob.glob(glob_path)
 
-    if matching_dirs:
-      # Cache file found.
-      return matching_dirs[0]
+      if matching_dirs:
+        # Cache file found.
+        return matching_dirs[0]
     return None
 
   def GetCacheDirForWrite(self, get_keylist=False):
@@ -694,18 +977,49 @@ class ResultsCache(object):
             machine_id_checksum = machine.machine_id_checksum
             break
 
+    return (image_path_checksum, self.test_name, str(self.iteration),
+            self.GetTestArgsChecksum(), checksum, machine_checksum,
+            machine_id_checksum, str(self.CACHE_VERSION))
+
+  def GetTestArgsChecksum(self):
     temp_test_args = '%s %s %s' % (self.test_args, self.profiler_args,
                                    self.run_local)
-    test_args_checksum = hashlib.md5(temp_test_args).hexdigest()
-    return (image_path_checksum, self.test_name, str(self.iteration),
-            test_args_checksum, checksum, machine_checksum, machine_id_checksum,
-            str(self.CACHE_VERSION))
+    return hashlib.md5(temp_test_args).hexdigest()
+
+  def GetPastRunDurations(self, max_entries=10):
+    """Return how long earlier runs of this benchmark took, in seconds.
+
+    This looks at cached runs of the same test with the same arguments, on any
+    image, machine and iteration.
+    """
+    key_list = ('*', self.test_name, '*', self.GetTestArgsChecksum(), '*', '*',
+                '*', str(self.CACHE_VERSION))
+    durations = []
+    for glob_path in self.FormCacheDir(key_list):
+      index = cache_index.GetCacheIndex(os.path.dirname(glob_path))
+      if index:
+        cache_dirs = index.Lookup(key_list)
+      else:
+        cache_dirs = glob.glob(glob_path)
+      for cache_dir in cache_dirs:
+        if len(durations) == max_entries:
+          return durations
+        try:
+          record = ReadCacheRecord(cache_dir)
+        except (EnvironmentError, ValueError, RuntimeError):
+          continue
+        if record and record.get('run_duration') is not None:
+          durations.append(record['run_duration'])
+    return durations
 
   def ReadResult(self):
     if CacheConditions.FALSE in self.cache_conditions:
       cache_dir = self.GetCacheDirForWrite()
       command = 'rm -rf %s' % (cache_dir,)
       self.ce.RunCommand(command)
+      index = cache_index.GetCacheIndex(os.path.dirname(cache_dir))
+      if index:
+        index.Remove(cache_dir)
       return None
     cache_dir = self.GetCacheDirForRead()
 
@@ -730,8 +1044,74 @@ class ResultsCache(object):
     return None
 
   def StoreResult(self, result):
+    """Store result to the cache, in the background if so configured."""
+    if config.GetConfig('async_cache_store'):
+      GetCacheStoreQueue().Put(self, result)
+    else:
+      self.StoreResultNow(result)
+
+  def StoreResultNow(self, result):
+    start_time = time.time()
     cache_dir, keylist = self.GetCacheDirForWrite(get_keylist=True)
     result.StoreToCacheDir(cache_dir, self.machine_manager, keylist)
+    self._logger.LogOutput('Stored result in %s in %.1fs.' %
+                           (cache_dir, time.time() - start_time))
+    index = cache_index.GetCacheIndex(os.path.dirname(cache_dir))
+    if index:
+      index.Add(self.GetCacheKeyList(False))
+
+
+class CacheStoreQueue(object):
+  """Threads that store results to the cache off the benchmark run threads.
+
+  Compressing the results of a run can take minutes; doing it here lets the
+  DUT that produced them go on with the next benchmark run meanwhile.
+  """
+
+  def __init__(self, num_threads=CACHE_STORE_THREADS):
+    self._queue = Queue.Queue()
+    for _ in xrange(num_threads):
+      thread = threading.Thread(target=self._Work)
+      thread.daemon = True
+      thread.start()
+
+  def _Work(self):
+    while True:
+      cache, result = self._queue.get()
+      try:
+        cache.StoreResultNow(result)
+      except Exception as e:  # pylint: disable=broad-except
+        # pylint: disable=protected-access
+        cache._logger.LogError('Could not store result to cache: %s' % e)
+      finally:
+        self._queue.task_done()
+
+  def Put(self, cache, result):
+    self._queue.put((cache, result))
+
+  def Wait(self):
+    """Wait until every queued result has been stored."""
+    self._queue.join()
+
+
+_cache_store_queue = None
+_cache_store_queue_lock = threading.Lock()
+
+
+def GetCacheStoreQueue():
+  global _cache_store_queue
+  with _cache_store_queue_lock:
+    if not _cache_store_queue:
+      _cache_store_queue = CacheStoreQueue()
+    return _cache_store_queue
+
+
+def WaitForCacheStores():
+  """Wait for the results being stored in the background, if any."""
+  with _cache_store_queue_lock:
+    store_queue = _cache_store_queue
+  if store_queue:
+    store_queue.Wait()
 
 
 class MockResultsCache(ResultsCache):
@@ -740,6 +1120,9 @@ class MockResultsCache(ResultsCache):
   def Init(self, *args):
     pass
 
+  def GetPastRunDurations(self, max_entries=10):
+    return []
+
   def ReadResult(self):
     return None
 
@@ -7,13 +7,19 @@
 
 from __future__ import print_function
 
+import glob
+import json
 import mock
 import os
+import shutil
 import tempfile
 import unittest
 
+import cache_index
+import config
 import image_checksummer
 import machine_manager
+import results_cache
 import test_flag
 
 from label import MockLabel
@@ -273,6 +279,49 @@ class ResultTest(unittest.TestCase):
     self.assertEqual(mockCopyFilesTo.call_args_list[1][0], ('/tmp/results/',
                                                             perf_report_files))
 
+  def test_copy_results_to_writes_perf_summaries(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      dest_dir = os.path.join(tmpdir, 'results')
+      os.mkdir(dest_dir)
+      perf_report_file = os.path.join(tmpdir, 'perf.data.report')
+      with open(perf_report_file, 'w') as f:
+        f.write("# Samples: 10 of event 'cycles'\n"
+                '50.00%  10  chrome  chrome  [.] main\n')
+      self.result.perf_report_files = [perf_report_file]
+      self.result.CopyFilesTo = mock.Mock()
+      summary_file = os.path.join(dest_dir, 'perf.data.report.0.summary.json')
+
+      # Reports from before perf_summaries are parsed when they are copied.
+      self.result.CopyResultsTo(dest_dir)
+      with open(summary_file) as f:
+        self.assertEqual(json.load(f), {'cycles': {'main': 50.0}})
+
+      self.result.perf_summaries = [{'cycles': {'foo': 1.0}}]
+      self.result.CopyResultsTo(dest_dir)
+      with open(summary_file) as f:
+        self.assertEqual(json.load(f), {'cycles': {'foo': 1.0}})
+    finally:
+      shutil.rmtree(tmpdir)
+
+  def test_gather_perf_results(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      perf_report_file = os.path.join(tmpdir, 'perf.data.report')
+      with open(perf_report_file, 'w') as f:
+        f.write('# Events: 1K cycles\n'
+                "# Samples: 10 of event 'cycles'\n"
+                '50.00%  10  chrome  chrome  [.] main\n'
+                '25.00%  5  chrome  chrome  [.] foo\n')
+      self.result.perf_report_files = [perf_report_file]
+      self.result.keyvals = {}
+      self.result.GatherPerfResults()
+      self.assertEqual(self.result.keyvals, {'perf_0_cycles': '1000.0'})
+      self.assertEqual(self.result.perf_summaries,
+                       [{'cycles': {'main': 50.0, 'foo': 25.0}}])
+    finally:
+      shutil.rmtree(tmpdir)
+
   def test_get_new_keyvals(self):
     kv_dict = {}
 
@@ -691,6 +740,65 @@ class ResultTest(unittest.TestCase):
     command = 'rm -Rf %s' % self.tmpdir
     self.result.ce.RunCommand(command)
 
+  def test_populate_from_cache_dir_with_keyvals(self):
+    tmpdir = tempfile.mkdtemp()
+    chromeos_root = os.path.join(tmpdir, 'chromeos')
+    os.makedirs(os.path.join(chromeos_root, 'chroot', 'tmp'))
+    results_dir = os.path.join(tmpdir, 'results')
+    os.makedirs(os.path.join(results_dir, 'profiling'))
+    perf_data_file = os.path.join(results_dir, 'profiling', 'perf.data')
+    for f in (perf_data_file, perf_data_file + '.report'):
+      with open(f, 'w') as out:
+        out.write('perf')
+    cache_dir = os.path.join(tmpdir, 'cache')
+    os.makedirs(cache_dir)
+
+    ce = command_executer.GetCommandExecuter(log_level='average')
+    ce.RunCommand('cd %s && tar -cjf %s .' %
+                  (results_dir, os.path.join(cache_dir, 'autotest.tbz2')))
+    results_cache.WriteCacheRecord(
+        cache_dir,
+        OUTPUT,
+        error,
+        0,
+        keyvals={'Total__Total': [444.0, 'ms'],
+                 'retval': 0},
+        perf_data_files=['./profiling/perf.data'],
+        perf_report_files=['./profiling/perf.data.report'],
+        perf_summaries=[{'cycles': {'main': 50.0}}])
+
+    self.result.ce = ce
+    self.result.chromeos_root = chromeos_root
+    self.result.PopulateFromCacheDir(cache_dir, 'sunspider',
+                                     'telemetry_Crosperf')
+    self.assertEqual(self.result.keyvals, {
+        'Total__Total': [444.0, 'ms'],
+        'retval': 0
+    })
+    # Strings come back as str, as in fresh results.
+    self.assertIs(type(self.result.keyvals['Total__Total'][1]), str)
+    self.assertIs(type(self.result.keyvals.keys()[0]), str)
+    self.assertEqual(self.result.retval, 0)
+    self.assertEqual(self.result.perf_summaries, [{'cycles': {'main': 50.0}}])
+    # Nothing has been extracted or read yet.
+    self.assertIsNone(self.result.temp_dir)
+    self.assertIsNone(self.result._out)
+    self.assertEqual(self.result.out, OUTPUT)
+    self.assertEqual(self.result.err, error)
+    self.assertEqual(self.result.perf_data_files, [])
+
+    self.result.ExtractDeferredMembers()
+    self.assertEqual(
+        self.result.perf_data_files,
+        [os.path.join(self.result.temp_dir, 'profiling/perf.data')])
+    self.assertEqual(self.result.perf_report_files, [
+        os.path.join(self.result.temp_dir, 'profiling/perf.data.report')
+    ])
+    self.assertTrue(os.path.exists(self.result.perf_data_files[0]))
+    self.assertEqual(self.result.deferred_members, [])
+
+    ce.RunCommand('rm -rf %s' % tmpdir)
+
   @mock.patch.object(misc, 'GetRoot')
   @mock.patch.object(command_executer.CommandExecuter, 'RunCommand')
   def test_cleanup(self, mock_runcmd, mock_getroot):
@@ -778,7 +886,9 @@ class ResultTest(unittest.TestCase):
     base_dir = os.path.join(os.getcwd(), 'test_cache/compare_output')
     self.assertTrue(os.path.exists(os.path.join(test_dir, 'autotest.tbz2')))
     self.assertTrue(os.path.exists(os.path.join(test_dir, 'machine.txt')))
-    self.assertTrue(os.path.exists(os.path.join(test_dir, 'results.txt')))
+    self.assertTrue(os.path.exists(os.path.join(test_dir, 'record.json')))
+    self.assertTrue(os.path.exists(os.path.join(test_dir, 'stdout.gz')))
+    self.assertTrue(os.path.exists(os.path.join(test_dir, 'stderr.gz')))
 
     f1 = os.path.join(test_dir, 'machine.txt')
     f2 = os.path.join(base_dir, 'machine.txt')
@@ -786,11 +896,12 @@ class ResultTest(unittest.TestCase):
     [_, out, _] = self.result.ce.RunCommandWOutput(cmd)
     self.assertEqual(len(out), 0)
 
-    f1 = os.path.join(test_dir, 'results.txt')
-    f2 = os.path.join(base_dir, 'results.txt')
-    cmd = 'diff %s %s' % (f1, f2)
-    [_, out, _] = self.result.ce.RunCommandWOutput(cmd)
-    self.assertEqual(len(out), 0)
+    record = results_cache.ReadCacheRecord(test_dir)
+    self.assertEqual(record['retval'], 0)
+    self.assertIsNone(record['keyvals'])
+    self.assertEqual(
+        results_cache.ReadCacheBlob(test_dir, 'stdout.gz'), OUTPUT)
+    self.assertEqual(results_cache.ReadCacheBlob(test_dir, 'stderr.gz'), error)
 
     # Clean up after test.
     tempfile.mkdtemp = save_real_mkdtemp
@@ -1000,7 +1111,7 @@ class ResultsCacheTest(unittest.TestCase):
                              'cache_dir/54524606abaae4fdf7b02f49f7ae7127_'
                              'sunspider_1_fda29412ceccb72977516c4785d08e2c_'
                              'FakeImageChecksumabc123_FakeMachineChecksum'
-                             'abc987__6')
+                             'abc987__7')
     self.assertEqual(result_path, comp_path)
 
   def test_form_cache_dir(self):
@@ -1008,15 +1119,33 @@ class ResultsCacheTest(unittest.TestCase):
     # from GetCacheDirForWrite).
     cache_key_list = ('54524606abaae4fdf7b02f49f7ae7127', 'sunspider', '1',
                       '7215ee9c7d9dc229d2921a40e899ec5f',
-                      'FakeImageChecksumabc123', '*', '*', '6')
+                      'FakeImageChecksumabc123', '*', '*', '7')
     path = self.results_cache.FormCacheDir(cache_key_list)
     self.assertEqual(len(path), 1)
     path1 = path[0]
     test_dirname = ('54524606abaae4fdf7b02f49f7ae7127_sunspider_1_7215ee9'
-                    'c7d9dc229d2921a40e899ec5f_FakeImageChecksumabc123_*_*_6')
+                    'c7d9dc229d2921a40e899ec5f_FakeImageChecksumabc123_*_*_7')
     comp_path = os.path.join(os.getcwd(), 'cache_dir', test_dirname)
     self.assertEqual(path1, comp_path)
 
+  @mock.patch.object(glob, 'glob')
+  @mock.patch.object(cache_index, 'GetCacheIndex')
+  def test_get_cache_dir_for_read(self, mock_get_index, mock_glob):
+    mock_get_index.return_value = None
+    self.results_cache.GetCacheKeyList = (
+        lambda read: ('*', 'sunspider', '1', 'args', '*', '*', '*', '7'))
+    cache_dir = os.path.join(os.getcwd(), 'cache_dir',
+                             '*_sunspider_1_args_*_*_*_')
+
+    # Entries of the current version come first.
+    mock_glob.side_effect = lambda path: [path]
+    self.assertEqual(self.results_cache.GetCacheDirForRead(), cache_dir + '7')
+    # Older entries are still read.
+    mock_glob.side_effect = lambda path: [path] if path.endswith('_6') else []
+    self.assertEqual(self.results_cache.GetCacheDirForRead(), cache_dir + '6')
+    mock_glob.side_effect = lambda path: []
+    self.assertIsNone(self.results_cache.GetCacheDirForRead())
+
   @mock.patch.object(image_checksummer.ImageChecksummer, 'Checksum')
   def test_get_cache_key_list(self, mock_checksum):
     # This tests the mechanism that generates the various pieces of the
@@ -1045,7 +1174,7 @@ class ResultsCacheTest(unittest.TestCase):
     self.assertEqual(key_list[4], 'FakeImageChecksumabc123')
     self.assertEqual(key_list[5], '*')
     self.assertEqual(key_list[6], '*')
-    self.assertEqual(key_list[7], '6')
+    self.assertEqual(key_list[7], '7')
 
     # Test 2. Generating cache name for writing, with local image type.
     key_list = self.results_cache.GetCacheKeyList(False)
@@ -1056,7 +1185,7 @@ class ResultsCacheTest(unittest.TestCase):
     self.assertEqual(key_list[4], 'FakeImageChecksumabc123')
     self.assertEqual(key_list[5], 'FakeMachineChecksumabc987')
     self.assertEqual(key_list[6], '')
-    self.assertEqual(key_list[7], '6')
+    self.assertEqual(key_list[7], '7')
 
     # Test 3. Generating cache name for writing, with trybot image type.
     self.results_cache.label.image_type = 'trybot'
@@ -1076,7 +1205,7 @@ class ResultsCacheTest(unittest.TestCase):
     self.assertEqual(key_list[4], '*')
     self.assertEqual(key_list[5], 'FakeMachineChecksumabc987')
     self.assertEqual(key_list[6], '')
-    self.assertEqual(key_list[7], '6')
+    self.assertEqual(key_list[7], '7')
 
     # Test 5. Generating cache name for writing, with local image type, and
     # specifying that the image path must match the cached image path.
@@ -1099,7 +1228,7 @@ class ResultsCacheTest(unittest.TestCase):
       return self.fakeCacheReturnResult
 
     def FakeGetCacheDirForWrite():
-      return self.fakeCacheReturnResult
+      return '/tmp/cache_root/cache_dir'
 
     mock_cmd_exec = mock.Mock(spec=command_executer.CommandExecuter)
     fake_result = Result(self.mock_logger, self.mock_label, 'average',
@@ -1120,9 +1249,14 @@ class ResultsCacheTest(unittest.TestCase):
 
     # Test 1. CacheCondition.FALSE, which means do not read from the cache.
     # (force re-running of test).  Result should be None.
-    res = self.results_cache.ReadResult()
+    with mock.patch.object(cache_index, 'GetCacheIndex') as mock_get_index:
+      res = self.results_cache.ReadResult()
     self.assertIsNone(res)
     self.assertEqual(mock_runcmd.call_count, 1)
+    # The removed entry is dropped from the index too.
+    mock_get_index.assert_called_once_with('/tmp/cache_root')
+    mock_get_index.return_value.Remove.assert_called_once_with(
+        '/tmp/cache_root/cache_dir')
 
     # Test 2. Remove CacheCondition.FALSE. Result should still be None,
     # because GetCacheDirForRead is returning None at the moment.
@@ -1170,6 +1304,38 @@ class ResultsCacheTest(unittest.TestCase):
     self.assertEqual(mock_runcmd.call_count, 0)
     self.assertIsNone(res)
 
+  @mock.patch.object(ResultsCache, 'StoreResultNow')
+  def test_store_result(self, mock_store):
+    fake_result = Result(self.mock_logger, self.mock_label, 'average',
+                         mock.Mock(spec=command_executer.CommandExecuter))
+
+    # Test 1. Results are stored right away by default.
+    self.results_cache.StoreResult(fake_result)
+    mock_store.assert_called_once_with(fake_result)
+
+    # Test 2. With async_cache_store, they are stored by the store queue.
+    mock_store.reset_mock()
+    config.AddConfig('async_cache_store', True)
+    try:
+      self.results_cache.StoreResult(fake_result)
+      results_cache.WaitForCacheStores()
+    finally:
+      config.AddConfig('async_cache_store', False)
+    mock_store.assert_called_once_with(fake_result)
+
+  def test_get_cached_tarball(self):
+    tmpdir = tempfile.mkdtemp()
+    self.assertEqual(
+        results_cache.GetCachedTarball(tmpdir),
+        (os.path.join(tmpdir, 'autotest.tbz2'), None))
+    with open(os.path.join(tmpdir, 'autotest.tar.zst'), 'w'):
+      pass
+    self.assertEqual(
+        results_cache.GetCachedTarball(tmpdir),
+        (os.path.join(tmpdir, 'autotest.tar.zst'), 'zstd -T0'))
+    os.remove(os.path.join(tmpdir, 'autotest.tar.zst'))
+    os.rmdir(tmpdir)
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -6,10 +6,8 @@ from __future__ import print_function
 
 import datetime
 import functools
-import itertools
 import json
 import os
-import re
 
 from cros_utils.tabulator import AmeanResult
 from cros_utils.tabulator import Cell
@@ -32,6 +30,8 @@ from cros_utils.tabulator import TablePrinter
 from update_telemetry_defaults import TelemetryDefaults
 
 from column_chart import ColumnChart
+from perf_report import PERF_SUMMARY_SUFFIX
+from perf_report import ParseStandardPerfReport
 from results_organizer import OrganizeResults
 
 import results_report_templates as templates
@@ -431,82 +431,6 @@ class HTMLResultsReport(ResultsReport):
         experiment_file=experiment_file)
 
 
-def ParseStandardPerfReport(report_data):
-  """Parses the output of `perf report`.
-
-  It'll parse the following:
-  {{garbage}}
-  # Samples: 1234M of event 'foo'
-
-  1.23% command shared_object location function::name
-
-  1.22% command shared_object location function2::name
-
-  # Samples: 999K of event 'bar'
-
-  0.23% command shared_object location function3::name
-  {{etc.}}
-
-  Into:
-    {'foo': {'function::name': 1.23, 'function2::name': 1.22},
-     'bar': {'function3::name': 0.23, etc.}}
-  """
-  # This function fails silently on its if it's handed a string (as opposed to a
-  # list of lines). So, auto-split if we do happen to get a string.
-  if isinstance(report_data, basestring):
-    report_data = report_data.splitlines()
-
-  # Samples: N{K,M,G} of event 'event-name'
-  samples_regex = re.compile(r"#\s+Samples: \d+\S? of event '([^']+)'")
-
-  # We expect lines like:
-  # N.NN%  command  samples  shared_object  [location] symbol
-  #
-  # Note that we're looking at stripped lines, so there is no space at the
-  # start.
-  perf_regex = re.compile(r'^(\d+(?:.\d*)?)%'  # N.NN%
-                          r'\s*\d+'  # samples count (ignored)
-                          r'\s*\S+'  # command (ignored)
-                          r'\s*\S+'  # shared_object (ignored)
-                          r'\s*\[.\]'  # location (ignored)
-                          r'\s*(\S.+)'  # function
-                         )
-
-  stripped_lines = (l.strip() for l in report_data)
-  nonempty_lines = (l for l in stripped_lines if l)
-  # Ignore all lines before we see samples_regex
-  interesting_lines = itertools.dropwhile(lambda x: not samples_regex.match(x),
-                                          nonempty_lines)
-
-  first_sample_line = next(interesting_lines, None)
-  # Went through the entire file without finding a 'samples' header. Quit.
-  if first_sample_line is None:
-    return {}
-
-  sample_name = samples_regex.match(first_sample_line).group(1)
-  current_result = {}
-  results = {sample_name: current_result}
-  for line in interesting_lines:
-    samples_match = samples_regex.match(line)
-    if samples_match:
-      sample_name = samples_match.group(1)
-      current_result = {}
-      results[sample_name] = current_result
-      continue
-
-    match = perf_regex.match(line)
-    if not match:
-      continue
-    percentage_str, func_name = match.groups()
-    try:
-      percentage = float(percentage_str)
-    except ValueError:
-      # Couldn't parse it; try to be "resilient".
-      continue
-    current_result[func_name] = percentage
-  return results
-
-
 def _ReadExperimentPerfReport(results_directory, label_name, benchmark_name,
                               benchmark_iteration):
   """Reads a perf report for the given benchmark. Returns {} on failure.
@@ -518,6 +442,11 @@ def _ReadExperimentPerfReport(results_directory, label_name, benchmark_name,
   raw_dir_name = label_name + benchmark_name + str(benchmark_iteration + 1)
   dir_name = ''.join(c for c in raw_dir_name if c.isalnum())
   file_name = os.path.join(results_directory, dir_name, 'perf.data.report.0')
+  try:
+    with open(file_name + PERF_SUMMARY_SUFFIX) as in_file:
+      return json.load(in_file)
+  except (IOError, ValueError):
+    pass
   try:
     with open(file_name) as in_file:
       return ParseStandardPerfReport(in_file)
@@ -11,8 +11,11 @@ from __future__ import print_function
 from StringIO import StringIO
 
 import collections
+import json
 import mock
 import os
+import shutil
+import tempfile
 import test_flag
 import unittest
 
@@ -23,12 +26,14 @@ from experiment_file import ExperimentFile
 from machine_manager import MockCrosMachine
 from machine_manager import MockMachineManager
 from results_cache import MockResult
+from perf_report import PERF_SUMMARY_SUFFIX
+from perf_report import ParseStandardPerfReport
 from results_report import BenchmarkResults
 from results_report import HTMLResultsReport
 from results_report import JSONResultsReport
 from results_report import ParseChromeosImage
-from results_report import ParseStandardPerfReport
 from results_report import TextResultsReport
+from results_report import _ReadExperimentPerfReport
 
 
 class FreeFunctionsTest(unittest.TestCase):
@@ -429,6 +434,38 @@ class PerfReportParserTest(unittest.TestCase):
       self.assertIn(k, report_instructions)
       self.assertEqual(v, report_instructions[k])
 
+  def testParserLimitsEntries(self):
+    full_report = ParseStandardPerfReport(self._ReadRealPerfReport())
+    report = ParseStandardPerfReport(self._ReadRealPerfReport(), max_entries=5)
+    self.assertItemsEqual(['cycles', 'instructions'], report.keys())
+    for event, functions in report.iteritems():
+      self.assertEqual(len(functions), 5)
+      # The report is sorted, so these are the hottest functions.
+      coldest = min(functions.values())
+      for k, v in full_report[event].iteritems():
+        if k not in functions:
+          self.assertLessEqual(v, coldest)
+
+  def testReadExperimentPerfReportPrefersSummary(self):
+    results_dir = tempfile.mkdtemp()
+    try:
+      report_dir = os.path.join(results_dir, 'labelbench1')
+      os.mkdir(report_dir)
+      report_file = os.path.join(report_dir, 'perf.data.report.0')
+      with open(report_file, 'w') as f:
+        f.write(self._ReadRealPerfReport())
+      self.assertEqual(
+          _ReadExperimentPerfReport(results_dir, 'label', 'bench', 0),
+          ParseStandardPerfReport(self._ReadRealPerfReport()))
+
+      summary = {'cycles': {'foo': 1.0}}
+      with open(report_file + PERF_SUMMARY_SUFFIX, 'w') as f:
+        json.dump(summary, f)
+      self.assertEqual(
+          _ReadExperimentPerfReport(results_dir, 'label', 'bench', 0), summary)
+    finally:
+      shutil.rmtree(results_dir)
+
 
 if __name__ == '__main__':
   test_flag.SetTestMode(True)
@@ -7,15 +7,24 @@ from __future__ import print_function
 
 import sys
 import test_flag
+import time
 import traceback
 
 from collections import defaultdict
+from collections import deque
 from machine_image_manager import MachineImageManager
 from threading import Lock
 from threading import Thread
 from cros_utils import command_executer
 from cros_utils import logger
 
+import config
+
+# Seconds a benchmark run, or a reimage, is assumed to take as long as nothing
+# better is known.
+DEFAULT_RUN_COST = 600.0
+DEFAULT_REIMAGE_COST = 600.0
+
 
 class DutWorker(Thread):
   """Working thread for a dut."""
@@ -107,16 +116,21 @@ class DutWorker(Thread):
     self._stat_num_reimage += 1
     self._stat_annotation = 'reimaging using "{}"'.format(label.name)
     try:
-      # Note, only 1 reimage at any given time, this is guaranteed in
-      # ImageMachine, so no sync needed below.
+      start_time = time.time()
+      # ImageMachine lets a bounded number of machines image at the same
+      # time, so other DutWorkers keep running benchmarks meanwhile. It never
+      # images the same machine twice at once, so no sync needed below.
       retval = self._sched.get_experiment().machine_manager.ImageMachine(
           self._dut, label)
 
       if retval:
+        self._sched.reimage_failed(self._dut)
         return 1
     except RuntimeError:
+      self._sched.reimage_failed(self._dut)
       return 1
 
+    self._sched.record_reimage_duration(time.time() - start_time)
     self._dut.label = label
     return 0
 
@@ -140,6 +154,8 @@ class DutWorker(Thread):
       with self._active_br_lock:
         self._active_br = br
       br.run()
+      if br.result and br.result.run_duration is not None:
+        self._sched.record_run_duration(br, br.result.run_duration)
     finally:
       self._sched.get_experiment().BenchmarkRunFinished(br)
       with self._active_br_lock:
@@ -216,6 +232,53 @@ class BenchmarkRunCacheReader(Thread):
         traceback.print_exc(file=sys.stderr)
 
 
+class RunCostEstimator(object):
+  """Estimate how long benchmark runs and reimages take.
+
+  The cost of a benchmark run starts out as the median duration of earlier
+  runs of the same benchmark found in the cache, and follows the runs of
+  this experiment as they finish. Reimage costs are learned the same way.
+  """
+
+  def __init__(self, br_list):
+    self._lock = Lock()
+    self._run_durations = {}
+    self._reimage_durations = []
+    for br in br_list:
+      name = br.benchmark.name
+      if name not in self._run_durations:
+        self._run_durations[name] = (br.cache.GetPastRunDurations()
+                                     if br.cache else [])
+
+  @staticmethod
+  def _median(values):
+    values = sorted(values)
+    return values[len(values) / 2]
+
+  def run_cost(self, br):
+    with self._lock:
+      durations = self._run_durations.get(br.benchmark.name)
+      if durations:
+        return self._median(durations)
+      # Nothing known about this benchmark, guess it is like the others.
+      known = [d for x in self._run_durations.itervalues() for d in x]
+      return sum(known) / len(known) if known else DEFAULT_RUN_COST
+
+  def reimage_cost(self):
+    with self._lock:
+      if self._reimage_durations:
+        return self._median(self._reimage_durations)
+      return DEFAULT_REIMAGE_COST
+
+  def record_run(self, br, seconds):
+    with self._lock:
+      self._run_durations.setdefault(br.benchmark.name, []).append(seconds)
+
+  def record_reimage(self, seconds):
+    with self._lock:
+      self._reimage_durations.append(seconds)
+
+
 class Schedv2(object):
   """New scheduler for crosperf."""
 
@@ -239,8 +302,8 @@ class Schedv2(object):
     # Read benchmarkrun cache.
     self._read_br_cache()
 
-    # Mapping from label to a list of benchmark_runs.
-    self._label_brl_map = dict((l, []) for l in self._labels)
+    # Mapping from label to a queue of benchmark_runs.
+    self._label_brl_map = dict((l, deque()) for l in self._labels)
     for br in self._experiment.benchmark_runs:
       assert br.label in self._label_brl_map
       # Only put no-cache-hit br into the map.
@@ -251,6 +314,17 @@ class Schedv2(object):
     self._mim = MachineImageManager(self._labels, self._duts)
     self._mim.compute_initial_allocation()
 
+    # In work stealing mode, labels are allocated to duts based on the
+    # estimated remaining work of each label, rather than by self._mim.
+    self._work_stealing = bool(config.GetConfig('work_stealing'))
+    self._estimator = None
+    # Mapping from dut name to the label it is being reimaged to.
+    self._reimage_targets = {}
+    if self._work_stealing:
+      self._estimator = RunCostEstimator(
+          [br for brl in self._label_brl_map.itervalues() for br in brl])
+      self._log_makespan_estimate()
+
     # Create worker thread, 1 per dut.
     self._active_workers = [DutWorker(dut, self) for dut in self._duts]
     self._finished_workers = []
@@ -371,7 +445,7 @@ class Schedv2(object):
       if not brl:
         return None
       # Return the first br.
-      return brl.pop(0)
+      return brl.popleft()
 
   def allocate_label(self, dut):
     """Allocate a label to a dut.
@@ -391,8 +465,84 @@ class Schedv2(object):
     if self._terminated:
       return None
 
+    if self._work_stealing:
+      with self.lock_on('_allocate'):
+        return self._steal_label(dut)
     return self._mim.allocate(dut, self)
 
+  def reimage_failed(self, dut):
+    """Forget the label dut was moved to, its reimage having failed."""
+    with self.lock_on('_allocate'):
+      self._reimage_targets.pop(dut.name, None)
+
+  def _get_label_work(self, label):
+    """Return the estimated seconds of work left in the queue of label."""
+    with self.lock_on(label):
+      brl = list(self._label_brl_map[label])
+    return sum(self._estimator.run_cost(br) for br in brl)
+
+  def _steal_label(self, dut):
+    """Pick the label whose remaining work dut should take a share of.
+
+    Joining the k duts already on a label with W seconds of work left brings
+    its predicted finish time from W / k down to (W + R) / (k + 1), R being
+    the cost of the reimage. The label with the largest reduction is picked;
+    labels no dut works on come first. If no label gains from another dut,
+    return None and let dut stop.
+    """
+
+    reimage_cost = self._estimator.reimage_cost()
+    with self._workers_lock:
+      other_duts = [w.dut() for w in self._active_workers if w.dut() != dut]
+    best_label = None
+    best_key = (0, 0)
+    for label in self._labels:
+      if label.remote and dut.name not in label.remote:
+        continue
+      work = self._get_label_work(label)
+      if not work:
+        continue
+      n_duts = len([
+          d for d in other_duts
+          if self._reimage_targets.get(d.name, d.label) == label
+      ])
+      if n_duts:
+        gain = work / n_duts - (work + reimage_cost) / (n_duts + 1)
+      else:
+        gain = float('inf')
+      if gain > 0 and (gain, work) > best_key:
+        best_label = label
+        best_key = (gain, work)
+
+    if best_label is not None:
+      self._reimage_targets[dut.name] = best_label
+      self._logger.LogOutput(
+          'Work stealing: moving dut {} to label "{}", predicted to save '
+          '{:.0f}s.'.format(dut.name, best_label.name, best_key[0]))
+    return best_label
+
+  def _log_makespan_estimate(self):
+    costs = [
+        self._estimator.run_cost(br)
+        for brl in self._label_brl_map.itervalues() for br in brl
+    ]
+    if not costs:
+      return
+    work = sum(costs)
+    makespan = (max(work / len(self._duts), max(costs)) +
+                self._estimator.reimage_cost())
+    self._logger.LogOutput(
+        'Estimated makespan: {:.0f}s ({} benchmark runs, {:.0f}s of work on '
+        '{} duts).'.format(makespan, len(costs), work, len(self._duts)))
+
+  def record_run_duration(self, br, seconds):
+    if self._estimator:
+      self._estimator.record_run(br, seconds)
+
+  def record_reimage_duration(self, seconds):
+    if self._estimator:
+      self._estimator.record_reimage(seconds)
+
   def dut_worker_finished(self, dut_worker):
     """Notify schedv2 that the dut_worker thread finished.
 
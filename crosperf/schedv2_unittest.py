@@ -10,11 +10,13 @@ import unittest
 import StringIO
 
 import benchmark_run
+import config
 import test_flag
 from experiment_factory import ExperimentFactory
 from experiment_file import ExperimentFile
 from cros_utils.command_executer import CommandExecuter
 from experiment_runner_unittest import FakeLogger
+from schedv2 import DutWorker
 from schedv2 import Schedv2
 
 EXPERIMENT_FILE_1 = """\
@@ -57,6 +59,24 @@ image2 {{
 }}
 """
 
+EXPERIMENT_FILE_2 = """\
+board: daisy
+remote: chromeos-daisy1.cros chromeos-daisy2.cros chromeos-daisy3.cros
+
+benchmark: kraken {
+  suite: telemetry_Crosperf
+  iterations: 30
+}
+
+image1 {
+  chromeos_image: /chromeos/src/build/images/daisy/latest/cros_image1.bin
+}
+
+image2 {
+  chromeos_image: /chromeos/src/build/imaages/daisy/latest/cros_image2.bin
+}
+"""
+
 
 class Schedv2Test(unittest.TestCase):
   """Class for setting up and running the unit tests."""
@@ -212,6 +232,70 @@ class Schedv2Test(unittest.TestCase):
           reduce(lambda a, x: a + len(x[1]),
                  my_schedv2.get_label_map().iteritems(), 0), 60)
 
+  def test_work_stealing(self):
+    """Test labels are allocated to duts by their remaining work."""
+
+    def MockReadCache(br):
+      br.cache_hit = False
+
+    with mock.patch(
+        'benchmark_run.MockBenchmarkRun.ReadCache', new=MockReadCache):
+      self.exp = self._make_fake_experiment(EXPERIMENT_FILE_2)
+      # The experiment factory sets work_stealing from the experiment file.
+      config.AddConfig('work_stealing', True)
+      try:
+        my_schedv2 = Schedv2(self.exp)
+      finally:
+        config.AddConfig('work_stealing', False)
+
+    image1, image2 = self.exp.labels
+    dut1, dut2, dut3 = sorted(
+        self.exp.machine_manager.GetMachines(), key=lambda d: d.name)
+    dut1.label = image1
+    # Nobody works on image2 yet, so that comes first.
+    self.assertEqual(my_schedv2.allocate_label(dut2), image2)
+    dut2.label = image2
+
+    # Leave a single run for image2; image1 has 30 runs for dut1 alone, so
+    # dut3 is better off helping there.
+    for _ in range(29):
+      self.assertIsNotNone(my_schedv2.get_benchmark_run(dut2))
+    self.assertEqual(my_schedv2.allocate_label(dut3), image1)
+    dut3.label = image1
+
+    # Once all queues are drained, there is nothing left to steal.
+    my_schedv2.get_benchmark_run(dut2)
+    while my_schedv2.get_benchmark_run(dut1):
+      pass
+    self.assertIsNone(my_schedv2.allocate_label(dut2))
+
+  def test_failed_reimage_forgets_target(self):
+    """Test a dut whose reimage fails no longer counts for its new label."""
+
+    def MockReadCache(br):
+      br.cache_hit = False
+
+    with mock.patch(
+        'benchmark_run.MockBenchmarkRun.ReadCache', new=MockReadCache):
+      self.exp = self._make_fake_experiment(EXPERIMENT_FILE_2)
+      # The experiment factory sets work_stealing from the experiment file.
+      config.AddConfig('work_stealing', True)
+      try:
+        my_schedv2 = Schedv2(self.exp)
+      finally:
+        config.AddConfig('work_stealing', False)
+
+    dut = min(self.exp.machine_manager.GetMachines(), key=lambda d: d.name)
+    label = my_schedv2.allocate_label(dut)
+    self.assertIsNotNone(label)
+    self.assertIn(dut.name, my_schedv2._reimage_targets)
+
+    worker = DutWorker(dut, my_schedv2)
+    with mock.patch.object(
+        self.exp.machine_manager, 'ImageMachine', return_value=1):
+      self.assertEqual(worker._reimage(label), 1)
+    self.assertNotIn(dut.name, my_schedv2._reimage_targets)
+
 
 if __name__ == '__main__':
   test_flag.SetTestMode(True)
@@ -259,6 +259,35 @@ class GlobalSettings(Settings):
             description='Path to alternate cache whose data '
             'you want to use. It accepts multiple directories '
             'separated by a ",".'))
+    self.AddField(
+        TextField(
+            'cache_compression',
+            default='bzip2',
+            description='The compressor for the results stored in the cache: '
+            'bzip2, pbzip2, zstd or lz4. Results cached with any of them '
+            'can be read back.'))
+    self.AddField(
+        BooleanField(
+            'async_cache_store',
+            default=True,
+            description='Whether to compress and store results to the cache '
+            'in the background, so that the machine can start the next '
+            'benchmark run meanwhile.'))
+    self.AddField(
+        BooleanField(
+            'work_stealing',
+            default=False,
+            description='Whether the scheduler should move machines over to '
+            'the labels with the most remaining work, estimated from earlier '
+            'runs in the cache, whenever an extra reimage is predicted to '
+            'shorten the experiment.'))
+    self.AddField(
+        IntegerField(
+            'concurrent_images',
+            default=4,
+            description='The maximum number of machines that are imaged at '
+            'the same time. Each image is only copied and checked once, '
+            'however many machines it is pushed to.'))
     self.AddField(
         TextField('results_dir', default='', description='The results dir.'))
     self.AddField(
@@ -48,7 +48,7 @@ class GlobalSettingsTest(unittest.TestCase):
   def test_init(self):
     res = settings_factory.GlobalSettings('g_settings')
     self.assertIsNotNone(res)
-    self.assertEqual(len(res.fields), 25)
+    self.assertEqual(len(res.fields), 29)
     self.assertEqual(res.GetField('name'), '')
     self.assertEqual(res.GetField('board'), '')
     self.assertEqual(res.GetField('remote'), None)
@@ -68,6 +68,10 @@ class GlobalSettingsTest(unittest.TestCase):
     self.assertEqual(res.GetField('no_email'), False)
     self.assertEqual(res.GetField('show_all_results'), False)
     self.assertEqual(res.GetField('share_cache'), '')
+    self.assertEqual(res.GetField('cache_compression'), 'bzip2')
+    self.assertEqual(res.GetField('async_cache_store'), True)
+    self.assertEqual(res.GetField('work_stealing'), False)
+    self.assertEqual(res.GetField('concurrent_images'), 4)
     self.assertEqual(res.GetField('results_dir'), '')
     self.assertEqual(res.GetField('chrome_src'), '')
 
@@ -92,7 +96,7 @@ class SettingsFactoryTest(unittest.TestCase):
     g_settings = settings_factory.SettingsFactory().GetSettings(
         'global', 'global')
     self.assertIsInstance(g_settings, settings_factory.GlobalSettings)
-    self.assertEqual(len(g_settings.fields), 25)
+    self.assertEqual(len(g_settings.fields), 29)
 
 
 if __name__ == '__main__':
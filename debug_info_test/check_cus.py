@@ -3,9 +3,9 @@
 # found in the LICENSE file.
 
 import os
-import subprocess
 
 import check_ngcc
+import dwarf
 
 cu_checks = [check_ngcc.not_by_gcc]
 
@@ -37,28 +37,17 @@ def check_compile_units(dso_path):
     """
 
     failed = set()
-    producer = ''
-    comp_path = ''
 
-    readelf = subprocess.Popen(['readelf', '--debug-dump=info',
-                                '--dwarf-depth=1', dso_path],
-                                stdout=subprocess.PIPE,
-                                stderr=open(os.devnull, 'w'))
-    for l in readelf.stdout:
-        if 'DW_TAG_compile_unit' in l:
-            if producer:
-                failed = failed.union(check_compile_unit(dso_path, producer,
-                                                         comp_path))
-            producer = ''
-            comp_path = ''
-        elif 'DW_AT_producer' in l:
-            producer = l
-        elif 'DW_AT_name' in l:
-            comp_path = os.path.join(comp_path, l.split(':')[-1].strip())
-        elif 'DW_AT_comp_dir' in l:
-            comp_path = os.path.join(l.split(':')[-1].strip(), comp_path)
-    if producer:
-        failed = failed.union(check_compile_unit(dso_path, producer, comp_path))
+    try:
+        _, compile_units = dwarf.read_debug_info(dso_path)
+    except dwarf.ElfError:
+        # Reported by check_exist_all.
+        compile_units = []
+    for cu in compile_units:
+        if cu.producer:
+            comp_path = os.path.join(cu.comp_dir or '', cu.name or '')
+            failed = failed.union(check_compile_unit(dso_path, cu.producer,
+                                                     comp_path))
 
     if failed:
         print('%s failed check: %s' % (dso_path, ' '.join(failed)))
@@ -2,9 +2,7 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-import os
-import re
-import subprocess
+import dwarf
 
 def check_identical_code_folding(dso_path):
     """check whether chrome was built with identical code folding.
@@ -19,16 +17,8 @@ def check_identical_code_folding(dso_path):
     if not dso_path.endswith('/chrome.debug'):
         return True
 
-    # Run 'nm' on the chrome binary and read the output.
-    nm = subprocess.Popen(['nm', dso_path],
-                          stdout=subprocess.PIPE,
-                          stderr=open(os.devnull, 'w'))
-    nm_output, _ = nm.communicate()
-
-    # Search for addresses of text symbols.
-    text_addresses = re.findall('^[0-9a-f]+[ ]+[tT] ',
-                                nm_output,
-                                re.MULTILINE)
+    # Read the addresses of the text symbols, as 'nm' would show them.
+    text_addresses = dwarf.text_symbol_addresses(dso_path)
 
     # Calculate number of text symbols in chrome binary.
     num_text_addresses = len(text_addresses)
@@ -4,9 +4,17 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
 import os
 import subprocess
 import sys
+import tempfile
+import time
+from StringIO import StringIO
 
 import check_icf
 import check_cus
@@ -16,6 +24,79 @@ elf_checks = [check_exist.check_exist_all,
               check_cus.check_compile_units,
               check_icf.check_identical_code_folding]
 
+DEFAULT_CACHE_DIR = os.path.expanduser('~/.cache/debug_info_test')
+
+def checker_digest(dirname=None):
+    """Hash the checks and the whitelists, which the cached results depend on.
+
+    Args:
+        dirname: the directory of the checks, this one by default.
+    Returns:
+        The hex digest.
+    """
+    h = hashlib.sha1()
+    if dirname is None:
+        dirname = os.path.dirname(os.path.abspath(__file__))
+    for fn in sorted(glob.glob(os.path.join(dirname, '*.py')) +
+                     glob.glob(os.path.join(dirname, '*.whitelist'))):
+        with open(fn, 'rb') as f:
+            h.update(os.path.basename(fn) + '\0' + f.read())
+    return h.hexdigest()
+
+def cache_key(dso_path, digest):
+    """Return the cache key of the results of the checks of a file.
+
+    The results depend on the path, through the whitelists, and the content.
+    """
+    h = hashlib.sha1(digest + '\0' + dso_path + '\0')
+    with open(dso_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), ''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def run_checks(dso_path):
+    """Run all the checks on a file.
+
+    Returns:
+        A (passed, output) pair, output being what the checks printed.
+    """
+    output = StringIO()
+    stdout = sys.stdout
+    sys.stdout = output
+    try:
+        results = [c(dso_path) for c in elf_checks]
+    finally:
+        sys.stdout = stdout
+    return all(results), output.getvalue()
+
+def check_file(args):
+    """Run the checks on a file, unless their results are in the cache.
+
+    Args:
+        args: (dso_path, cache_dir, digest) tuple. cache_dir may be None.
+    Returns:
+        A (passed, output, cached) tuple.
+    """
+    dso_path, cache_dir, digest = args
+    if not cache_dir:
+        return run_checks(dso_path) + (False,)
+
+    cache_file = os.path.join(cache_dir, cache_key(dso_path, digest))
+    try:
+        with open(cache_file) as f:
+            passed, output = json.load(f)
+        return passed, output, True
+    except (IOError, ValueError):
+        pass
+
+    passed, output = run_checks(dso_path)
+    # Write a temp file and rename it, so that a result is never partial.
+    fd, temp = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, 'w') as f:
+        json.dump([passed, output], f)
+    os.rename(temp, cache_file)
+    return passed, output, False
+
 def scanelf(root):
     """find ELFs in root
 
@@ -29,25 +110,50 @@ def scanelf(root):
     return [l.strip() for l in p.stdout]
 
 def Main(argv):
-    if len(argv) < 2:
-        print('usage: %s [file|dir]')
-        return 1
+    parser = argparse.ArgumentParser()
+    parser.add_argument('cand', metavar='file|dir',
+                        help='ELF file or directory to check.')
+    parser.add_argument('--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='Number of files to check in parallel.')
+    parser.add_argument('--cache_dir', default=DEFAULT_CACHE_DIR,
+                        help='Where to keep the results of the files, which '
+                        'are not checked again while their content, the '
+                        'checks and the whitelists are the same. Pass "" '
+                        'to disable.')
+    options = parser.parse_args(argv[1:])
 
     files = []
-    cand = argv[1]
+    cand = options.cand
     if os.path.isfile(cand):
         files = [cand]
     elif os.path.isdir(cand):
         files = scanelf(cand)
     else:
-        print('usage: %s [file|dir]')
+        parser.print_usage()
         return 1
 
+    if options.cache_dir and not os.path.isdir(options.cache_dir):
+        os.makedirs(options.cache_dir)
+    digest = checker_digest()
+
+    start = time.time()
     failed = False
-    for f in files:
-        for c in elf_checks:
-            if not c(f):
+    num_cached = 0
+    pool = multiprocessing.Pool(options.jobs)
+    try:
+        args = [(f, options.cache_dir, digest) for f in files]
+        for passed, output, cached in pool.imap(check_file, args):
+            sys.stdout.write(output)
+            if not passed:
                 failed = True
+            if cached:
+                num_cached += 1
+    finally:
+        pool.close()
+        pool.join()
+    sys.stderr.write('Checked %d files (%d cached) in %.1fs.\n' %
+                     (len(files), num_cached, time.time() - start))
 
     if failed:
         return 1
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Tests for the result cache of debug_info_test."""
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+import debug_info_test
+
+
+class CheckFileTest(unittest.TestCase):
+    """Tests for check_file and its cache."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        os.mkdir(self.cache_dir)
+        self.dso_path = os.path.join(self.tmpdir, 'lib.so')
+        with open(self.dso_path, 'w') as f:
+            f.write('content')
+
+        # The checks of a copy of this directory, whose whitelists can change.
+        self.checks_dir = os.path.join(self.tmpdir, 'checks')
+        os.mkdir(self.checks_dir)
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        for fn in glob.glob(os.path.join(dirname, '*.whitelist')):
+            shutil.copy(fn, self.checks_dir)
+
+        self.checked = []
+        self.saved_checks = debug_info_test.elf_checks
+        debug_info_test.elf_checks = [self.fake_check]
+
+    def tearDown(self):
+        debug_info_test.elf_checks = self.saved_checks
+        shutil.rmtree(self.tmpdir)
+
+    def fake_check(self, dso_path):
+        self.checked.append(dso_path)
+        print('%s failed check: fake' % dso_path)
+        return False
+
+    def check_file(self):
+        return debug_info_test.check_file(
+            (self.dso_path, self.cache_dir,
+             debug_info_test.checker_digest(self.checks_dir)))
+
+    def test_cached_result_is_reused(self):
+        result = (False, '%s failed check: fake\n' % self.dso_path)
+        self.assertEqual(self.check_file(), result + (False,))
+        self.assertEqual(self.check_file(), result + (True,))
+        self.assertEqual(self.checked, [self.dso_path])
+
+    def test_file_change_misses(self):
+        self.check_file()
+        with open(self.dso_path, 'a') as f:
+            f.write('more content')
+        self.assertFalse(self.check_file()[2])
+        self.assertEqual(len(self.checked), 2)
+
+    def test_whitelist_change_misses(self):
+        self.check_file()
+        with open(os.path.join(self.checks_dir, 'ngcc_dso_path.whitelist'),
+                  'a') as f:
+            f.write('.*/lib.so\n')
+        self.assertFalse(self.check_file()[2])
+        self.assertEqual(len(self.checked), 2)
+
+    def test_no_cache(self):
+        for _ in range(2):
+            passed, _, cached = debug_info_test.check_file(
+                (self.dso_path, None, 'digest'))
+            self.assertFalse(passed)
+            self.assertFalse(cached)
+        self.assertEqual(len(self.checked), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
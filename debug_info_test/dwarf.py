@@ -0,0 +1,466 @@
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Read the compile units and the symbols of an ELF file without binutils.
+
+The file is mmapped. Only the headers of the compile units and their top level
+DIE are decoded, which is what 'readelf --debug-dump=info --dwarf-depth=1'
+shows, so the rest of the debug info is never touched.
+"""
+
+import collections
+import mmap
+import os
+import struct
+import zlib
+
+ELF_MAGIC = '\x7fELF'
+
+SHF_EXECINSTR = 0x4
+SHF_COMPRESSED = 0x800
+SHT_NOBITS = 8
+ELFCOMPRESS_ZLIB = 1
+
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STT_SECTION = 3
+STT_FILE = 4
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xff00
+
+DW_TAG_compile_unit = 0x11
+DW_AT_name = 0x03
+DW_AT_comp_dir = 0x1b
+DW_AT_producer = 0x25
+DW_AT_str_offsets_base = 0x72
+DW_UT_skeleton = 0x04
+DW_UT_split_compile = 0x05
+DW_UT_type = 0x02
+DW_UT_split_type = 0x06
+
+# The (e_shoff, e_shentsize, e_shnum, e_shstrndx) of the ELF header, the
+# (sh_name, sh_type, sh_flags, sh_offset, sh_size) of a section header, the
+# (st_value, st_info, st_shndx) of a symbol, in the (st_info, st_shndx,
+# st_value) order for 64 bit files, and the (ch_type, ch_size) of a compression
+# header, for 32 and 64 bit files.
+ELF_FORMATS = {
+    1: ('16x16xI10xHHH', 'IIIxxxxII', 'xxxxIxxxxBxH', 'IIxxxx'),
+    2: ('16x24xQ10xHHH', 'IIQxxxxxxxxQQ', 'xxxxBxHQxxxxxxxx', 'IxxxxQ8x'),
+}
+
+CompileUnit = collections.namedtuple('CompileUnit',
+                                     ['producer', 'name', 'comp_dir'])
+
+
+class ElfError(Exception):
+    """The file is not an ELF file or its debug info can not be read."""
+
+
+class NotElfError(ElfError):
+    """The file is not an ELF file."""
+
+
+class Section(object):
+    """The data of a section: data[start:end], data being the mmap if the
+    section is not compressed."""
+
+    def __init__(self, data, start, end):
+        self.data = data
+        self.start = start
+        self.end = end
+
+
+class ElfFile(object):
+    """An mmapped ELF file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error) as e:
+                if not os.fstat(f.fileno()).st_size:
+                    raise NotElfError('%s: empty file' % path)
+                raise ElfError('%s: %s' % (path, e))
+        try:
+            self._read_headers()
+        except struct.error as e:
+            self.close()
+            raise ElfError('%s: truncated ELF file: %s' % (path, e))
+        except ElfError:
+            self.close()
+            raise
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _read_headers(self):
+        mm = self._mm
+        if mm[:4] != ELF_MAGIC or mm[4] not in '\1\2':
+            raise NotElfError('not an ELF file')
+        self.endian = '<' if mm[5] == '\1' else '>'
+        self.elf_class = ord(mm[4])
+        header, section, symbol, chdr = ELF_FORMATS[self.elf_class]
+        self._symbol = struct.Struct(self.endian + symbol)
+        self._chdr = struct.Struct(self.endian + chdr)
+        shoff, shentsize, shnum, shstrndx = struct.unpack_from(
+            self.endian + header, mm, 0)
+        section = struct.Struct(self.endian + section)
+        self.section_headers = [section.unpack_from(mm, shoff + i * shentsize)
+                                for i in range(shnum)]
+        self.sections = {}
+        if shstrndx >= shnum:
+            return
+        names_offset = self.section_headers[shstrndx][3]
+        for index, (name, _, _, _, _) in enumerate(self.section_headers):
+            start = names_offset + name
+            self.sections[mm[start:mm.find('\0', start)]] = index
+
+    def has_section(self, name):
+        return name in self.sections
+
+    def section(self, name):
+        """Return the Section called name, or its .zdebug twin, or None."""
+        if name in self.sections:
+            _, sh_type, flags, offset, size = (
+                self.section_headers[self.sections[name]])
+            if sh_type == SHT_NOBITS:
+                return None
+            if offset + size > len(self._mm):
+                raise ElfError('section %s is out of the file' % name)
+            if not flags & SHF_COMPRESSED:
+                return Section(self._mm, offset, offset + size)
+            ch_type, _ = self._chdr.unpack_from(self._mm, offset)
+            if ch_type != ELFCOMPRESS_ZLIB:
+                raise ElfError('unknown compression of section %s' % name)
+            data = self._mm[offset + self._chdr.size:offset + size]
+        else:
+            zname = name.replace('.debug_', '.zdebug_', 1)
+            if zname not in self.sections:
+                return None
+            _, _, _, offset, size = self.section_headers[self.sections[zname]]
+            # 'ZLIB' and the big endian uncompressed size precede the data.
+            data = self._mm[offset + 12:offset + size]
+        try:
+            data = zlib.decompress(data)
+        except zlib.error as e:
+            raise ElfError('section %s: %s' % (name, e))
+        return Section(data, 0, len(data))
+
+    def code_sections(self):
+        """Return the indices of the sections that hold code."""
+        return set(i for i, (_, _, flags, _, _)
+                   in enumerate(self.section_headers)
+                   if flags & SHF_EXECINSTR)
+
+    def symbols(self):
+        """Yield the (st_value, st_info, st_shndx) of each symbol in .symtab."""
+        symtab = self.section('.symtab')
+        if symtab is None:
+            return
+        unpack_from = self._symbol.unpack_from
+        for pos in xrange(symtab.start, symtab.end - self._symbol.size + 1,
+                          self._symbol.size):
+            if self.elf_class == 1:
+                yield unpack_from(symtab.data, pos)
+            else:
+                info, shndx, value = unpack_from(symtab.data, pos)
+                yield value, info, shndx
+
+
+def _uleb128(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _sleb128(data, pos):
+    value, end = _uleb128(data, pos)
+    bits = 7 * (end - pos)
+    if value & (1 << (bits - 1)):
+        value -= 1 << bits
+    return value, end
+
+
+# The size of the fixed size forms. Other forms are handled by _read_form.
+_FIXED_FORMS = {
+    0x05: 2, 0x06: 4, 0x07: 8, 0x0b: 1, 0x0c: 1, 0x11: 1, 0x12: 2, 0x13: 4,
+    0x14: 8, 0x19: 0, 0x1c: 4, 0x1e: 16, 0x20: 8, 0x21: 0, 0x24: 8,
+    0x29: 1, 0x2a: 2, 0x2b: 3, 0x2c: 4,
+}
+# The forms whose value is a ULEB128 that is not needed here.
+_ULEB_FORMS = frozenset([0x0f, 0x15, 0x1b, 0x22, 0x23, 0x1f01])
+# The forms that hold an offset into a string section.
+_STRP_FORMS = {0x0e: '.debug_str', 0x1f: '.debug_line_str'}
+# The forms that hold an index into .debug_str_offsets, with the index size.
+_STRX_FORMS = {0x25: 1, 0x26: 2, 0x27: 3, 0x28: 4}
+DW_FORM_addr = 0x01
+DW_FORM_block2 = 0x03
+DW_FORM_block4 = 0x04
+DW_FORM_string = 0x08
+DW_FORM_block = 0x09
+DW_FORM_block1 = 0x0a
+DW_FORM_sdata = 0x0d
+DW_FORM_ref_addr = 0x10
+DW_FORM_indirect = 0x16
+DW_FORM_sec_offset = 0x17
+DW_FORM_exprloc = 0x18
+DW_FORM_strx = 0x1a
+DW_FORM_strp_sup = 0x1d
+DW_FORM_GNU_str_index = 0x1f02
+DW_FORM_GNU_ref_alt = 0x1f20
+DW_FORM_GNU_strp_alt = 0x1f21
+
+
+class _DebugInfoReader(object):
+    """Decode the top level DIE of each unit in .debug_info."""
+
+    def __init__(self, elf):
+        self._elf = elf
+        self._info = elf.section('.debug_info')
+        self._abbrev = elf.section('.debug_abbrev')
+        self._strings = {}
+        self._abbrevs = {}
+
+    def _unpack(self, fmt, data, pos):
+        return struct.unpack_from(self._elf.endian + fmt, data, pos)[0]
+
+    def _uint(self, data, pos, size):
+        if size == 3:
+            low, high = struct.unpack_from(self._elf.endian + 'HB', data, pos)
+            if self._elf.endian == '>':
+                return (low << 8) | high
+            return low | (high << 16)
+        return self._unpack({1: 'B', 2: 'H', 4: 'I', 8: 'Q'}[size], data, pos)
+
+    def _string_section(self, name):
+        if name not in self._strings:
+            self._strings[name] = self._elf.section(name)
+        return self._strings[name]
+
+    def _string(self, section_name, offset):
+        section = self._string_section(section_name)
+        if section is None:
+            return '(%s offset 0x%x)' % (section_name, offset)
+        start = section.start + offset
+        end = section.data.find('\0', start, section.end)
+        return section.data[start:end if end >= 0 else section.end]
+
+    def _abbreviation(self, offset, code):
+        """Return the (tag, attribute specs) of the abbreviation code of the
+        abbreviation table at offset."""
+        key = (offset, code)
+        if key in self._abbrevs:
+            return self._abbrevs[key]
+        data = self._abbrev.data
+        pos = self._abbrev.start + offset
+        while pos < self._abbrev.end:
+            entry_code, pos = _uleb128(data, pos)
+            if not entry_code:
+                break
+            tag, pos = _uleb128(data, pos)
+            pos += 1  # DW_CHILDREN_*
+            specs = []
+            while True:
+                name, pos = _uleb128(data, pos)
+                form, pos = _uleb128(data, pos)
+                if not name and not form:
+                    break
+                if form == 0x21:  # DW_FORM_implicit_const
+                    _, pos = _sleb128(data, pos)
+                specs.append((name, form))
+            self._abbrevs[(offset, entry_code)] = (tag, specs)
+            if entry_code == code:
+                return tag, specs
+        raise ElfError('abbreviation %d not found at 0x%x' % (code, offset))
+
+    def _read_form(self, form, data, pos, unit):
+        """Decode an attribute value.
+
+        Returns:
+            The value, which is only meaningful for the string and the
+            constant forms, and the position of the next attribute.
+        """
+        version, offset_size, address_size, _ = unit
+        if form in _FIXED_FORMS:
+            size = _FIXED_FORMS[form]
+            if size not in (1, 2, 4, 8):
+                return None, pos + size
+            return self._uint(data, pos, size), pos + size
+        if form in _ULEB_FORMS:
+            return _uleb128(data, pos)
+        if form in _STRP_FORMS:
+            offset = self._uint(data, pos, offset_size)
+            return ('strp', _STRP_FORMS[form], offset), pos + offset_size
+        if form in _STRX_FORMS:
+            size = _STRX_FORMS[form]
+            return ('strx', self._uint(data, pos, size)), pos + size
+        if form == DW_FORM_strx:
+            index, pos = _uleb128(data, pos)
+            return ('strx', index), pos
+        if form == DW_FORM_string:
+            end = data.find('\0', pos)
+            return data[pos:end], end + 1
+        if form == DW_FORM_addr:
+            return None, pos + address_size
+        if form == DW_FORM_ref_addr:
+            return None, pos + (address_size if version == 2 else offset_size)
+        if form in (DW_FORM_sec_offset, DW_FORM_strp_sup, DW_FORM_GNU_ref_alt):
+            return self._uint(data, pos, offset_size), pos + offset_size
+        if form == DW_FORM_GNU_strp_alt:
+            offset = self._uint(data, pos, offset_size)
+            return '(alt indirect string 0x%x)' % offset, pos + offset_size
+        if form == DW_FORM_GNU_str_index:
+            index, pos = _uleb128(data, pos)
+            return '(indexed string 0x%x)' % index, pos
+        if form == DW_FORM_sdata:
+            return _sleb128(data, pos)
+        if form in (DW_FORM_block, DW_FORM_exprloc):
+            length, pos = _uleb128(data, pos)
+            return None, pos + length
+        if form in (DW_FORM_block1, DW_FORM_block2, DW_FORM_block4):
+            size = {DW_FORM_block1: 1, DW_FORM_block2: 2,
+                    DW_FORM_block4: 4}[form]
+            return None, pos + size + self._uint(data, pos, size)
+        if form == DW_FORM_indirect:
+            form, pos = _uleb128(data, pos)
+            return self._read_form(form, data, pos, unit)
+        raise ElfError('unknown DW_FORM 0x%x' % form)
+
+    def _resolve(self, value, str_offsets_base, offset_size):
+        if not isinstance(value, tuple):
+            return value
+        if value[0] == 'strp':
+            return self._string(value[1], value[2])
+        offsets = self._string_section('.debug_str_offsets')
+        if offsets is None:
+            return '(indexed string 0x%x)' % value[1]
+        offset = self._uint(offsets.data, offsets.start + str_offsets_base +
+                            value[1] * offset_size, offset_size)
+        return self._string('.debug_str', offset)
+
+    def compile_units(self):
+        """Yield a CompileUnit for each compile unit."""
+        if self._info is None:
+            return
+        if self._abbrev is None:
+            raise ElfError('.debug_info without .debug_abbrev')
+        data = self._info.data
+        pos = self._info.start
+        while pos < self._info.end:
+            length = self._uint(data, pos, 4)
+            offset_size = 4
+            pos += 4
+            if length == 0xffffffff:
+                length = self._uint(data, pos, 8)
+                offset_size = 8
+                pos += 8
+            next_unit = pos + length
+            version = self._uint(data, pos, 2)
+            pos += 2
+            if version >= 5:
+                unit_type = self._uint(data, pos, 1)
+                address_size = self._uint(data, pos + 1, 1)
+                abbrev_offset = self._uint(data, pos + 2, offset_size)
+                pos += 2 + offset_size
+                if unit_type in (DW_UT_skeleton, DW_UT_split_compile):
+                    pos += 8
+                elif unit_type in (DW_UT_type, DW_UT_split_type):
+                    pos += 8 + offset_size
+            else:
+                abbrev_offset = self._uint(data, pos, offset_size)
+                address_size = self._uint(data, pos + offset_size, 1)
+                pos += offset_size + 1
+            unit = (version, offset_size, address_size, abbrev_offset)
+
+            code, pos = _uleb128(data, pos)
+            if code:
+                tag, specs = self._abbreviation(abbrev_offset, code)
+                if tag == DW_TAG_compile_unit:
+                    yield self._compile_unit(specs, data, pos, unit)
+            pos = next_unit
+
+    def _compile_unit(self, specs, data, pos, unit):
+        attributes = {}
+        for name, form in specs:
+            value, pos = self._read_form(form, data, pos, unit)
+            attributes[name] = value
+        offset_size = unit[1]
+        # The base defaults to the first contribution to .debug_str_offsets,
+        # after its header.
+        str_offsets_base = attributes.get(DW_AT_str_offsets_base)
+        if str_offsets_base is None:
+            str_offsets_base = 2 * offset_size
+        return CompileUnit(*[
+            self._resolve(attributes.get(name), str_offsets_base, offset_size)
+            for name in (DW_AT_producer, DW_AT_name, DW_AT_comp_dir)])
+
+
+# The last file read by read_debug_info, as several checks read each file.
+_last_debug_info = [None, None]
+
+
+def read_debug_info(dso_path):
+    """Read the compile units of an ELF file.
+
+    Args:
+        dso_path: path to the elf/dso
+    Returns:
+        A (has_debug_info, compile_units) pair. has_debug_info tells whether
+        the file has a .debug_info section, compile_units is a list of
+        CompileUnit. A file that is not an ELF file has no debug info.
+    Raises:
+        ElfError: the file is a truncated or corrupt ELF file, or its debug
+            info can not be read.
+    """
+    st = os.stat(dso_path)
+    key = (dso_path, st.st_size, st.st_mtime)
+    if _last_debug_info[0] != key:
+        try:
+            with ElfFile(dso_path) as elf:
+                has_debug_info = (elf.has_section('.debug_info') or
+                                  elf.has_section('.zdebug_info'))
+                units = list(_DebugInfoReader(elf).compile_units())
+            result = (has_debug_info, units)
+        except NotElfError:
+            result = (False, [])
+        except (ElfError, struct.error, IndexError, EnvironmentError) as e:
+            result = ElfError('cannot read the debug info: %s' % e)
+        _last_debug_info[:] = [key, result]
+
+    result = _last_debug_info[1]
+    if isinstance(result, ElfError):
+        raise result
+    return result
+
+
+def text_symbol_addresses(dso_path):
+    """Return the addresses of the text symbols, the 't' and 'T' of nm."""
+    try:
+        elf = ElfFile(dso_path)
+    except ElfError:
+        return []
+    with elf:
+        code_sections = elf.code_sections()
+        addresses = []
+        for value, info, shndx in elf.symbols():
+            bind = info >> 4
+            sym_type = info & 0xf
+            if (shndx in code_sections and shndx != SHN_UNDEF and
+                    shndx < SHN_LORESERVE and
+                    bind in (STB_LOCAL, STB_GLOBAL) and
+                    sym_type not in (STT_SECTION, STT_FILE)):
+                addresses.append(value)
+    return addresses
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Compare the dwarf module with readelf and nm on small ELF files."""
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import check_exist
+import dwarf
+
+SOURCE = '''
+static int add_one(int x) { return x + 1; }
+int main(int argc, char **argv) { return add_one(argc); }
+'''
+
+# How gcc is asked to build each test file.
+BUILDS = {
+    'dwarf5': ['-g', '-gdwarf-5'],
+    'dwarf4': ['-g', '-gdwarf-4'],
+    'dwarf2': ['-g', '-gdwarf-2'],
+    'zlib': ['-g', '-gz'],
+    'zlib_gnu': ['-g', '-gz=zlib-gnu'],
+    'no_debug': [],
+}
+
+_READELF_ATTRIBUTE = re.compile(
+    r'DW_AT_(producer|name|comp_dir)\s*:\s*(?:\([^)]*\):\s*)?(.*)$')
+
+
+def _have_tools():
+    with open(os.devnull, 'w') as devnull:
+        return all(subprocess.call(['which', tool], stdout=devnull) == 0
+                   for tool in ('gcc', 'readelf', 'nm'))
+
+
+def readelf_compile_units(path):
+    """Return the compile units of path, as readelf shows them."""
+    output = subprocess.check_output(
+        ['readelf', '--debug-dump=info', '--dwarf-depth=1', path])
+    units = []
+    for line in output.splitlines():
+        if 'DW_TAG_compile_unit' in line:
+            units.append({})
+            continue
+        match = _READELF_ATTRIBUTE.search(line)
+        if match and units:
+            units[-1][match.group(1)] = match.group(2).strip()
+    return [dwarf.CompileUnit(u.get('producer'), u.get('name'),
+                              u.get('comp_dir')) for u in units]
+
+
+def nm_text_addresses(path):
+    """Return the addresses of the 't' and 'T' symbols, as nm shows them."""
+    output = subprocess.check_output(['nm', path])
+    return [int(address, 16) for address in
+            re.findall('^([0-9a-f]+) +[tT] ', output, re.MULTILINE)]
+
+
+@unittest.skipUnless(_have_tools(), 'needs gcc, readelf and nm')
+class DwarfTest(unittest.TestCase):
+    """Tests for the dwarf module."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        source = os.path.join(cls.tmpdir, 'test.c')
+        with open(source, 'w') as f:
+            f.write(SOURCE)
+        cls.files = {}
+        for name, options in BUILDS.iteritems():
+            path = os.path.join(cls.tmpdir, name)
+            subprocess.check_call(['gcc'] + options + ['-o', path, 'test.c'],
+                                  cwd=cls.tmpdir)
+            cls.files[name] = path
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def test_read_debug_info(self):
+        for name, path in self.files.iteritems():
+            has_debug_info, units = dwarf.read_debug_info(path)
+            self.assertEqual(has_debug_info, name != 'no_debug', name)
+            self.assertEqual(units, readelf_compile_units(path), name)
+        units = dwarf.read_debug_info(self.files['dwarf4'])[1]
+        self.assertEqual(units[0].name, 'test.c')
+        self.assertEqual(units[0].comp_dir, self.tmpdir)
+        self.assertIn('-gdwarf-4', units[0].producer)
+
+    def test_text_symbol_addresses(self):
+        for name, path in self.files.iteritems():
+            self.assertEqual(sorted(dwarf.text_symbol_addresses(path)),
+                             sorted(nm_text_addresses(path)), name)
+
+    def test_not_elf(self):
+        path = os.path.join(self.tmpdir, 'script.sh')
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n')
+        self.assertEqual(dwarf.read_debug_info(path), (False, []))
+        self.assertEqual(dwarf.text_symbol_addresses(path), [])
+
+    def test_corrupt_elf(self):
+        with open(self.files['dwarf4'], 'rb') as f:
+            data = f.read()
+        with dwarf.ElfFile(self.files['dwarf4']) as elf:
+            section = elf.section('.debug_info')
+        # Truncated, and with garbage in place of the debug info.
+        corrupt = {
+            'truncated': data[:100],
+            'garbage': (data[:section.start] +
+                        '\xff' * (section.end - section.start) +
+                        data[section.end:]),
+        }
+        for name, content in corrupt.iteritems():
+            path = os.path.join(self.tmpdir, name)
+            with open(path, 'wb') as f:
+                f.write(content)
+            self.assertRaises(dwarf.ElfError, dwarf.read_debug_info, path)
+            # The check reports the file instead of passing or failing on
+            # missing debug info.
+            output = StringIO()
+            stdout = sys.stdout
+            sys.stdout = output
+            try:
+                self.assertFalse(check_exist.check_exist_all(path))
+            finally:
+                sys.stdout = stdout
+            self.assertIn('cannot read the debug info', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,8 +10,8 @@ import re
 # performance also depends largely on the implementation. It appears to be fast
 # enough according to the tests.
 #
-# The performance bottleneck of this script is readelf. Unless this becomes
-# slower than readelf, don't waste time here.
+# The performance bottleneck of this script is reading the debug info. Unless
+# this becomes slower than that, don't waste time here.
 def is_whitelisted(list_name, pattern):
     """chech whether the given pattern is specified in the whitelist.
 
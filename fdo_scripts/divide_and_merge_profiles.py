@@ -4,12 +4,17 @@
 """Script to divide and merge profiles."""
 
 import copy
+import errno
+import multiprocessing
+from multiprocessing import pool
 import optparse
 import os
 import pickle
 import re
+import shutil
 import sys
 import tempfile
+import time
 
 import build_chrome_browser
 import lock_machine
@@ -18,28 +23,37 @@ from cros_utils import command_executer
 from cros_utils import logger
 
 
+# How the files of a chunk are put into its input directories.
+STAGING_MODES = ('hardlink', 'symlink', 'copy')
+PROFILE_SUFFIXES = ('.gcda', '.imports')
+
+
 class ProfileMerger:
 
-  def __init__(self, inputs, output, chunk_size, merge_program, multipliers):
+  def __init__(self,
+               inputs,
+               output,
+               chunk_size,
+               merge_program,
+               multipliers,
+               staging='hardlink',
+               jobs=1):
     self._inputs = inputs
     self._output = output
     self._chunk_size = chunk_size
     self._merge_program = merge_program
     self._multipliers = multipliers
+    self._staging = staging
+    self._jobs = jobs
     self._ce = command_executer.GetCommandExecuter()
     self._l = logger.GetLogger()
 
   def _GetFilesSetForInputDir(self, input_dir):
-    output_file = tempfile.mktemp()
-    command = "find %s -name '*.gcda' -o -name '*.imports' > %s" % (input_dir,
-                                                                    output_file)
-    self._ce.RunCommand(command)
-    files = open(output_file, 'r').read()
     files_set = set([])
-    for f in files.splitlines():
-      stripped_file = f.replace(input_dir, '', 1)
-      stripped_file = stripped_file.lstrip('/')
-      files_set.add(stripped_file)
+    for dirpath, _, filenames in os.walk(input_dir):
+      for f in filenames:
+        if f.endswith(PROFILE_SUFFIXES):
+          files_set.add(os.path.relpath(os.path.join(dirpath, f), input_dir))
     return files_set
 
   def _PopulateFilesSet(self):
@@ -56,40 +70,80 @@ class ProfileMerger:
       ret.append(self._files_set.pop())
     return ret
 
-  def _CopyFilesTree(self, input_dir, files, output_dir):
+  def _StageFile(self, src_file, dst_file):
+    if self._staging == 'hardlink':
+      try:
+        os.link(src_file, dst_file)
+        return
+      except OSError as e:
+        # Hard links can not cross file systems.
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+          raise
+    if self._staging == 'copy':
+      shutil.copy(src_file, dst_file)
+    else:
+      os.symlink(os.path.abspath(src_file), dst_file)
+
+  def _StageFilesTree(self, input_dir, files, output_dir):
+    """Put the files of input_dir into output_dir, linked or copied."""
     for f in files:
       src_file = os.path.join(input_dir, f)
+      if not os.path.exists(src_file):
+        # Not every input has every profile.
+        continue
       dst_file = os.path.join(output_dir, f)
       if not os.path.isdir(os.path.dirname(dst_file)):
-        command = 'mkdir -p %s' % os.path.dirname(dst_file)
-        self._ce.RunCommand(command)
-      command = 'cp %s %s' % (src_file, dst_file)
-      self._ce.RunCommand(command)
+        os.makedirs(os.path.dirname(dst_file))
+      self._StageFile(src_file, dst_file)
 
   def _DoChunkMerge(self, current_files):
     temp_dirs = []
-    for i in self._inputs:
-      temp_dir = tempfile.mkdtemp()
-      temp_dirs.append(temp_dir)
-      self._CopyFilesTree(i, current_files, temp_dir)
-    # Now do the merge.
-    command = ('%s --inputs=%s --output=%s' %
-               (self._merge_program, ','.join(temp_dirs), self._output))
-    if self._multipliers:
-      command = ('%s --multipliers=%s' % (command, self._multipliers))
-    ret = self._ce.RunCommand(command)
-    assert ret == 0, '%s command failed!' % command
-    for temp_dir in temp_dirs:
-      command = 'rm -rf %s' % temp_dir
-      self._ce.RunCommand(command)
+    try:
+      for i in self._inputs:
+        temp_dir = tempfile.mkdtemp()
+        temp_dirs.append(temp_dir)
+        self._StageFilesTree(i, current_files, temp_dir)
+      # Now do the merge.
+      command = ('%s --inputs=%s --output=%s' %
+                 (self._merge_program, ','.join(temp_dirs), self._output))
+      if self._multipliers:
+        command = ('%s --multipliers=%s' % (command, self._multipliers))
+      ret = self._ce.RunCommand(command)
+      assert ret == 0, '%s command failed!' % command
+    finally:
+      for temp_dir in temp_dirs:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return len(current_files)
 
   def DoMerge(self):
+    """Merge the profiles a chunk at a time.
+
+    The chunks hold different files, so their merges write different output
+    files and run concurrently, on up to self._jobs threads.
+    """
+    start = time.time()
     self._PopulateFilesSet()
+    chunks = []
     while True:
       current_files = self._GetSubset()
       if not current_files:
         break
-      self._DoChunkMerge(current_files)
+      chunks.append(current_files)
+
+    # The work is done by the merge program processes and by file system
+    # calls, so threads are enough.
+    workers = pool.ThreadPool(self._jobs)
+    num_files = 0
+    try:
+      for merged in workers.imap_unordered(self._DoChunkMerge, chunks):
+        num_files += merged
+    finally:
+      workers.close()
+      workers.join()
+    elapsed = time.time() - start
+    self._l.LogOutput('Merged %d files in %d chunks in %.1fs: %.1f files/s.' %
+                      (num_files, len(chunks), elapsed,
+                       num_files / elapsed if elapsed else 0))
 
 
 def Main(argv):
@@ -115,6 +169,19 @@ def Main(argv):
   parser.add_option('--multipliers',
                     dest='multipliers',
                     help='multipliers to use when merging. (optional)')
+  parser.add_option('--staging',
+                    dest='staging',
+                    type='choice',
+                    choices=STAGING_MODES,
+                    default='hardlink',
+                    help=('How to put the files of a chunk into its input '
+                          'directories: hardlink (falls back to symlink '
+                          'across file systems), symlink or copy.'))
+  parser.add_option('--jobs',
+                    dest='jobs',
+                    type='int',
+                    default=multiprocessing.cpu_count(),
+                    help='Number of chunks to merge concurrently.')
 
   options, _ = parser.parse_args(argv)
 
@@ -125,7 +192,8 @@ def Main(argv):
   try:
     pm = ProfileMerger(
         options.inputs.split(','), options.output, int(options.chunk_size),
-        options.merge_program, options.multipliers)
+        options.merge_program, options.multipliers, options.staging,
+        options.jobs)
     pm.DoMerge()
     retval = 0
   except:
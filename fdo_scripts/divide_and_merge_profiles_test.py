@@ -122,6 +122,15 @@ program: $(OBJS)
     shutil.rmtree(reference_output)
     self.assertTrue(ret == 0)
 
+  def testParallelMerge(self):
+    reference_output = self._getReferenceOutput()
+    my_output = self._getMyOutput('--jobs=4 --staging=symlink')
+
+    ret = self._diffOutputs(reference_output, my_output)
+    shutil.rmtree(my_output)
+    shutil.rmtree(reference_output)
+    self.assertTrue(ret == 0)
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -8,7 +8,13 @@ Here is an example execution:
    --output_dir=/home/x/y
 
 With the cutoff, it will ignore any basic blocks that have a count less
-than what is specified (in this example 10000)
+than what is specified (in this example 10000). With --top=N, only the N
+hottest blocks of each file are kept. The files are summarized in parallel
+(--jobs) and with --incremental, the summaries of the files that did not
+change since the last run are reused.
+The blocks are listed hottest first, in the order 'LC_ALL=C sort -nr --merge'
+gave them: the blocks of a file with the same count are in file order, and
+those of different files in reverse byte order of their summary lines.
 The script looks inside the directory (this is typically a directory where
 the object files are generated) for files with *.profile and *.optimized
 suffixes. To get these, the following flags were added to the compiler
@@ -39,113 +45,165 @@ of each block so that it is easy to identify the origin of the basic block.
 
 __author__ = 'llozano@google.com (Luis Lozano)'
 
+import fnmatch
+import heapq
+import itertools
+import multiprocessing
 import optparse
 import os
+import cPickle as pickle
 import re
-import shutil
 import sys
-import tempfile
 
-from cros_utils import command_executer
+BLOCK_RE = re.compile(r'.*# BLOCK \d+ .*count:(\d+)')
+LINENO_RE = re.compile(r'^\s*\[.*: \d*:\d*]')
 
 
 # Given a line, check if it has a block count and return it.
 # Return -1 if there is no match
 def GetBlockCount(line):
-  match_obj = re.match('.*# BLOCK \d+ .*count:(\d+)', line)
+  match_obj = BLOCK_RE.match(line)
   if match_obj:
     return int(match_obj.group(1))
   else:
     return -1
 
 
+def SummarizeLines(data_file, cutoff, top=None):
+  """Find the blocks with a count of at least cutoff.
+
+  Args:
+    data_file: the open *.profile or *.optimized file.
+    cutoff: the minimum block count.
+    top: if set, only keep the top hottest blocks.
+
+  Returns:
+    A list of (count, summary line) of the blocks, hottest first.
+  """
+  # Only the top blocks are kept, in a min heap of (count, index, line).
+  heap = []
+  index = 0
+  search_lno = False
+  for line in data_file:
+    # Most lines are not block headers, skip the regex for them.
+    count = GetBlockCount(line) if '# BLOCK ' in line else -1
+    if count != -1:
+      if count >= cutoff:
+        search_lno = True
+        sum_line = line.strip()
+        sum_count = count
+    # look for a line that starts with line number information
+    elif search_lno and LINENO_RE.match(line):
+      search_lno = False
+      entry = (sum_count, -index, '%d:%s: %s %s' %
+               (sum_count, data_file.name, sum_line, line))
+      index += 1
+      if top is None or len(heap) < top:
+        heapq.heappush(heap, entry)
+      elif entry > heap[0]:
+        heapq.heapreplace(heap, entry)
+  heap.sort(reverse=True)
+  return [(count, sum_line) for count, _, sum_line in heap]
+
+
+def SummarizeFile(args):
+  """Summarize a file, in a worker process. See SummarizeLines."""
+  file_name, cutoff, top = args
+  with open(file_name, 'r') as f:
+    return SummarizeLines(f, cutoff, top)
+
+
+class _Descending(str):
+  """A string that sorts in reverse byte order."""
+
+  def __lt__(self, other):
+    return str.__lt__(other, self)
+
+
 class Collector(object):
 
-  def __init__(self, data_dir, cutoff, output_dir, tempdir):
+  def __init__(self, data_dir, cutoff, output_dir, top=None, jobs=None,
+               incremental=False):
     self._data_dir = data_dir
     self._cutoff = cutoff
     self._output_dir = output_dir
-    self._tempdir = tempdir
-    self._ce = command_executer.GetCommandExecuter()
-
-  def CollectFileList(self, file_exp, list_file):
-    command = ("find %s -type f -name '%s' > %s" %
-               (self._data_dir, file_exp,
-                os.path.join(self._tempdir, list_file)))
-    ret = self._ce.RunCommand(command)
-    if ret:
-      raise RuntimeError('Failed: %s' % command)
-
-  def SummarizeLines(self, data_file):
-    sum_lines = []
-    search_lno = False
-    for line in data_file:
-      count = GetBlockCount(line)
-      if count != -1:
-        if count >= self._cutoff:
-          search_lno = True
-          sum_line = line.strip()
-          sum_count = count
-      # look for a line that starts with line number information
-      elif search_lno and re.match('^\s*\[.*: \d*:\d*]', line):
-        search_lno = False
-        sum_lines.append('%d:%s: %s %s' %
-                         (sum_count, data_file.name, sum_line, line))
-    return sum_lines
-
-  # Look for blocks in the data file that have a count larger than the cutoff
-  # and generate a sorted summary file of the hottest blocks.
-  def SummarizeFile(self, data_file, sum_file):
-    with open(data_file, 'r') as f:
-      sum_lines = self.SummarizeLines(f)
-
-    # sort reverse the list in place by the block count number
-    sum_lines.sort(key=GetBlockCount, reverse=True)
-
-    with open(sum_file, 'w') as sf:
-      sf.write(''.join(sum_lines))
-
-    print 'Generated file Summary: ', sum_file
-
-  # Find hottest blocks in the list of files, generate a sorted summary for
-  # each file and then do a sorted merge of all the summaries.
-  def SummarizeList(self, list_file, summary_file):
-    with open(os.path.join(self._tempdir, list_file)) as f:
-      sort_list = []
-      for file_name in f:
-        file_name = file_name.strip()
-        sum_file = '%s.sum' % file_name
-        sort_list.append('%s%s' % (sum_file, chr(0)))
-        self.SummarizeFile(file_name, sum_file)
-
-    tmp_list_file = os.path.join(self._tempdir, 'file_list.dat')
-    with open(tmp_list_file, 'w') as file_list_file:
-      for x in sort_list:
-        file_list_file.write(x)
-
-    merge_command = ('sort -nr -t: -k1 --merge --files0-from=%s > %s ' %
-                     (tmp_list_file, summary_file))
-
-    ret = self._ce.RunCommand(merge_command)
-    if ret:
-      raise RuntimeError('Failed: %s' % merge_command)
+    self._top = top
+    self._jobs = jobs or multiprocessing.cpu_count()
+    self._incremental = incremental
+
+  def CollectFileList(self, file_exp):
+    file_list = []
+    for dirpath, _, filenames in os.walk(self._data_dir):
+      for file_name in fnmatch.filter(filenames, file_exp):
+        file_list.append(os.path.join(dirpath, file_name))
+    return sorted(file_list)
+
+  def _LoadCache(self, cache_file):
+    if not self._incremental:
+      return {}
+    try:
+      with open(cache_file, 'rb') as f:
+        return pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError):
+      return {}
+
+  # Find hottest blocks in the list of files, summarize each file in a worker
+  # process and then do a sorted merge of all the summaries.
+  def SummarizeList(self, file_list, summary_file):
+    # The summaries of the files, keyed on the file name. An entry is reused
+    # when the file and the options are the same as when it was computed.
+    cache_file = '%s.cache' % summary_file
+    cache = self._LoadCache(cache_file)
+    summaries = {}
+    todo = []
+    for file_name in file_list:
+      st = os.stat(file_name)
+      key = (st.st_size, st.st_mtime, self._cutoff, self._top)
+      if file_name in cache and cache[file_name][0] == key:
+        summaries[file_name] = cache[file_name]
+      else:
+        summaries[file_name] = (key, None)
+        todo.append(file_name)
+
+    pool = multiprocessing.Pool(self._jobs)
+    try:
+      args = [(file_name, self._cutoff, self._top) for file_name in todo]
+      for file_name, sum_lines in itertools.izip(
+          todo, pool.imap(SummarizeFile, args)):
+        summaries[file_name] = (summaries[file_name][0], sum_lines)
+    finally:
+      pool.close()
+      pool.join()
+    print 'Summarized %d files (%d unchanged).' % (
+        len(file_list), len(file_list) - len(todo))
+
+    # Merge the summaries, which are sorted hottest first. Like sort -r, the
+    # merge breaks the ties between the files on the whole line, reversed.
+    merged = heapq.merge(*[[(-count, _Descending(sum_line))
+                            for count, sum_line in summaries[f][1]]
+                           for f in file_list])
+    with open(summary_file, 'w') as sf:
+      for _, sum_line in merged:
+        sf.write(sum_line)
+
+    if self._incremental:
+      with open(cache_file, 'wb') as f:
+        pickle.dump(summaries, f, pickle.HIGHEST_PROTOCOL)
     print 'Generated general summary: ', summary_file
 
   def SummarizePreOptimized(self, summary_file):
-    self.CollectFileList('*.profile', 'chrome.profile.list')
-    self.SummarizeList('chrome.profile.list',
+    self.SummarizeList(self.CollectFileList('*.profile'),
                        os.path.join(self._output_dir, summary_file))
 
   def SummarizeOptimized(self, summary_file):
-    self.CollectFileList('*.optimized', 'chrome.optimized.list')
-    self.SummarizeList('chrome.optimized.list',
+    self.SummarizeList(self.CollectFileList('*.optimized'),
                        os.path.join(self._output_dir, summary_file))
 
 
 def Main(argv):
-  command_executer.InitCommandExecuter()
   usage = ('usage: %prog --data_dir=<dir> --cutoff=<value> '
-           '--output_dir=<dir> [--keep_tmp]')
+           '--output_dir=<dir> [--top=<n>] [--jobs=<n>] [--incremental] '
+           '[--keep_tmp]')
   parser = optparse.OptionParser(usage=usage)
   parser.add_option('--data_dir',
                     dest='data_dir',
@@ -158,27 +216,37 @@ def Main(argv):
                     dest='output_dir',
                     help=('directory where summary data will be generated'
                           '(pre_optimized.txt, optimized.txt)'))
+  parser.add_option('--top',
+                    dest='top',
+                    type='int',
+                    help='Only keep the top hottest blocks of each file')
+  parser.add_option('--jobs',
+                    dest='jobs',
+                    type='int',
+                    help='Number of files to summarize in parallel '
+                    '(defaults to the number of cpus)')
+  parser.add_option('--incremental',
+                    action='store_true',
+                    dest='incremental',
+                    default=False,
+                    help=('Reuse the summaries of the files that did not '
+                          'change since the last --incremental run. They are '
+                          'kept in <summary>.cache in the output directory'))
   parser.add_option('--keep_tmp',
                     action='store_true',
                     dest='keep_tmp',
                     default=False,
-                    help=('Keep directory with temporary files'
-                          '(for debugging purposes)'))
+                    help='Ignored, no temporary files are made any more')
   options = parser.parse_args(argv)[0]
   if not all((options.data_dir, options.cutoff, options.output_dir)):
     parser.print_help()
     sys.exit(1)
 
-  tempdir = tempfile.mkdtemp()
-
   co = Collector(options.data_dir, int(options.cutoff), options.output_dir,
-                 tempdir)
+                 options.top, options.jobs, options.incremental)
   co.SummarizePreOptimized('pre_optimized.txt')
   co.SummarizeOptimized('optimized.txt')
 
-  if not options.keep_tmp:
-    shutil.rmtree(tempdir, ignore_errors=True)
-
   return 0
 
 
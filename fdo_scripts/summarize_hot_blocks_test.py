@@ -0,0 +1,111 @@
+#!/usr/bin/python2
+#
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Tests for summarize_hot_blocks."""
+
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import summarize_hot_blocks
+
+BLOCK = """# BLOCK %d freq:100 count:%d, starting at line %d
+# PRED: 1 [100.0%%]  count:%d (fallthru,exec)
+  [file%d.cc : %d:1] x_%d = y_%d;
+# SUCC: 2 [100.0%%]  count:%d (fallthru,exec)
+"""
+
+
+def WriteProfiles(data_dir, num_files, rand):
+  for i in range(num_files):
+    suffix = rand.choice(['profile', 'optimized'])
+    with open(os.path.join(data_dir, 'f%d.%s' % (i, suffix)), 'w') as f:
+      for block in range(rand.randint(0, 40)):
+        # Few distinct counts, so that there are ties within and across files.
+        count = rand.choice([0, 10, 500, 1000, 1000, 20000])
+        line = rand.randint(1, 999)
+        f.write(BLOCK % (block, count, line, count, i, line, block, block,
+                         count))
+
+
+def OldSummarizeList(file_list, summary_file, cutoff):
+  """The summary as the sort based pipeline made it."""
+  tempdir = tempfile.mkdtemp()
+  try:
+    sort_list = []
+    for n, file_name in enumerate(file_list):
+      with open(file_name) as f:
+        sum_lines = []
+        search_lno = False
+        for line in f:
+          count = summarize_hot_blocks.GetBlockCount(line)
+          if count != -1:
+            if count >= cutoff:
+              search_lno = True
+              sum_line = line.strip()
+              sum_count = count
+          elif search_lno and summarize_hot_blocks.LINENO_RE.match(line):
+            search_lno = False
+            sum_lines.append('%d:%s: %s %s' % (sum_count, file_name, sum_line,
+                                               line))
+      sum_lines.sort(key=summarize_hot_blocks.GetBlockCount, reverse=True)
+      sum_file = os.path.join(tempdir, '%d.sum' % n)
+      with open(sum_file, 'w') as f:
+        f.write(''.join(sum_lines))
+      sort_list.append(sum_file + '\0')
+    list_file = os.path.join(tempdir, 'file_list.dat')
+    with open(list_file, 'w') as f:
+      f.write(''.join(sort_list))
+    subprocess.check_call('LC_ALL=C sort -nr -t: -k1 --merge '
+                          '--files0-from=%s > %s' % (list_file, summary_file),
+                          shell=True)
+  finally:
+    shutil.rmtree(tempdir)
+
+
+class SummarizeHotBlocksTest(unittest.TestCase):
+  """Tests for the Collector class and Main."""
+
+  def setUp(self):
+    self.data_dir = tempfile.mkdtemp()
+    self.output_dir = tempfile.mkdtemp()
+    WriteProfiles(self.data_dir, 12, random.Random(0))
+
+  def tearDown(self):
+    shutil.rmtree(self.data_dir)
+    shutil.rmtree(self.output_dir)
+
+  def testSameAsSortPipeline(self):
+    for cutoff in (0, 1000):
+      collector = summarize_hot_blocks.Collector(self.data_dir, cutoff,
+                                                 self.output_dir)
+      for file_exp in ('*.profile', '*.optimized'):
+        file_list = collector.CollectFileList(file_exp)
+        summary_file = os.path.join(self.output_dir, 'summary.txt')
+        collector.SummarizeList(file_list, summary_file)
+        old_summary_file = os.path.join(self.output_dir, 'old_summary.txt')
+        OldSummarizeList(file_list, old_summary_file, cutoff)
+        with open(summary_file) as f, open(old_summary_file) as old:
+          summary = f.read()
+          self.assertEqual(summary, old.read())
+        self.assertTrue(summary)
+
+  def testKeepTmpIsAccepted(self):
+    self.assertEqual(
+        summarize_hot_blocks.Main([
+            'summarize_hot_blocks.py', '--data_dir', self.data_dir,
+            '--cutoff', '1000', '--output_dir', self.output_dir, '--keep_tmp'
+        ]), 0)
+    self.assertTrue(
+        os.path.exists(os.path.join(self.output_dir, 'optimized.txt')))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -19,6 +19,7 @@ import re
 import shutil
 import sys
 import tempfile
+import threading
 import time
 
 from cros_utils import command_executer
@@ -105,8 +106,107 @@ def FindChromeOSImage(image_file, chromeos_root):
   return chroot_image
 
 
-def DoImage(argv):
-  """Image ChromeOS."""
+class StagedImage(object):
+  """A local image prepared for flashing.
+
+  The image checksum, the copy of the image into the chroot and the checks
+  that mount the image are done at most once, however many machines the image
+  is pushed to, and concurrent callers wait for the first one to finish.
+  """
+
+  def __init__(self, chromeos_root, image, board, log_level):
+    self.chromeos_root = chromeos_root
+    self.image = image
+    self.board = board
+    self.log_level = log_level
+    self._lock = threading.Lock()
+    self._checksum = None
+    self._located_image = None
+    self._is_temp_copy = False
+    self._chroot_image = None
+    self._is_test_image = None
+    self._chrome_checksum = None
+
+  def GetChecksum(self):
+    with self._lock:
+      if self._checksum is None:
+        self._checksum = str(
+            FileUtils().Md5File(self.image, log_level=self.log_level))
+      return self._checksum
+
+  def Locate(self):
+    """Make the image available in the chroot.
+
+    Returns:
+      A tuple of the image path inside the chroot and whether it is a test
+      image.
+    """
+    with self._lock:
+      if self._chroot_image is None:
+        found, self._located_image = LocateOrCopyImage(
+            self.chromeos_root, self.image, board=self.board)
+        self._is_temp_copy = not found
+        self._chroot_image = FindChromeOSImage(self._located_image,
+                                               self.chromeos_root)
+        self._is_test_image = IsImageModdedForTest(
+            self.chromeos_root, self._chroot_image, self.log_level)
+      return self._chroot_image, self._is_test_image
+
+  def GetChromeChecksum(self):
+    """Return the md5sum of the chrome binary in the image."""
+    chroot_image, _ = self.Locate()
+    with self._lock:
+      if self._chrome_checksum is None:
+        self._chrome_checksum = GetImageChromeChecksum(
+            self.chromeos_root, chroot_image, self.log_level)
+      return self._chrome_checksum
+
+  def Cleanup(self):
+    with self._lock:
+      if self._is_temp_copy:
+        temp_dir = os.path.dirname(self._located_image)
+        logger.GetLogger().LogOutput('Deleting temp image dir: %s' % temp_dir)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        self._is_temp_copy = False
+        self._chroot_image = None
+
+
+class ImageStager(object):
+  """Hands out one StagedImage per image, to share it between DoImage calls."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._images = {}
+
+  def GetImage(self, chromeos_root, image, board, log_level):
+    key = (os.path.realpath(chromeos_root), image, board)
+    with self._lock:
+      if key not in self._images:
+        self._images[key] = StagedImage(chromeos_root, image, board, log_level)
+      return self._images[key]
+
+  def Cleanup(self):
+    """Delete the temporary copies of the staged images."""
+    with self._lock:
+      images = self._images.values()
+      self._images = {}
+    for staged_image in images:
+      staged_image.Cleanup()
+
+
+def DoImage(argv, stager=None):
+  """Image ChromeOS.
+
+  Args:
+    argv: The command line arguments, including the program name.
+    stager: An ImageStager to share the staged local images with other
+      DoImage calls, possibly running concurrently for other remotes. The
+      caller then owns the staged images and has to clean them up. If None,
+      the image is staged just for this call.
+
+  Returns:
+    0 on success.
+  """
 
   parser = argparse.ArgumentParser()
   parser.add_argument(
@@ -186,6 +286,10 @@ def DoImage(argv):
   if not os.path.exists(image) and not is_xbuddy_image:
     Usage(parser, 'Image file: ' + image + ' does not exist!')
 
+  own_stager = stager is None
+  if own_stager:
+    stager = ImageStager()
+
   try:
     should_unlock = False
     if not options.no_lock:
@@ -200,36 +304,30 @@ def DoImage(argv):
     local_image = False
     if not is_xbuddy_image:
       local_image = True
-      image_checksum = FileUtils().Md5File(image, log_level=log_level)
+      staged_image = stager.GetImage(options.chromeos_root, image, board,
+                                     log_level)
+      image_checksum = staged_image.GetChecksum()
 
       command = 'cat ' + checksum_file
       ret, device_checksum, _ = cmd_executer.CrosRunCommandWOutput(
           command, chromeos_root=options.chromeos_root, machine=options.remote)
 
       device_checksum = device_checksum.strip()
-      image_checksum = str(image_checksum)
 
       l.LogOutput('Image checksum: ' + image_checksum)
       l.LogOutput('Device checksum: ' + device_checksum)
 
       if image_checksum != device_checksum:
-        [found, located_image] = LocateOrCopyImage(
-            options.chromeos_root, image, board=board)
-
         reimage = True
         l.LogOutput('Checksums do not match. Re-imaging...')
 
-        chroot_image = FindChromeOSImage(located_image, options.chromeos_root)
-
-        is_test_image = IsImageModdedForTest(options.chromeos_root,
-                                             chroot_image, log_level)
+        chroot_image, is_test_image = staged_image.Locate()
 
         if not is_test_image and not options.force:
           logger.GetLogger().LogFatal('Have to pass --force to image a '
                                       'non-test image!')
     else:
       reimage = True
-      found = True
       l.LogOutput('Using non-local image; Re-imaging...')
 
     if reimage:
@@ -306,20 +404,21 @@ def DoImage(argv):
         logger.GetLogger().LogFatalIf(ret, 'Writing checksum failed.')
 
         successfully_imaged = VerifyChromeChecksum(
-            options.chromeos_root, chroot_image, options.remote, log_level)
+            options.chromeos_root,
+            chroot_image,
+            options.remote,
+            log_level,
+            image_chrome_checksum=staged_image.GetChromeChecksum())
         logger.GetLogger().LogFatalIf(not successfully_imaged,
                                       'Image verification failed!')
         TryRemountPartitionAsRW(options.chromeos_root, options.remote,
                                 log_level)
-
-      if found == False:
-        temp_dir = os.path.dirname(located_image)
-        l.LogOutput('Deleting temp image dir: %s' % temp_dir)
-        shutil.rmtree(temp_dir)
     else:
       l.LogOutput('Checksums match. Skipping reimage')
     return ret
   finally:
+    if own_stager:
+      stager.Cleanup()
     if should_unlock:
       locks.ReleaseLock(list(options.remote.split()), options.chromeos_root)
 
@@ -415,7 +514,7 @@ def IsImageModdedForTest(chromeos_root, image, log_level):
   return is_test_image
 
 
-def VerifyChromeChecksum(chromeos_root, image, remote, log_level):
+def GetImageChromeChecksum(chromeos_root, image, log_level):
   command = 'mktemp -d'
   cmd_executer = command_executer.GetCommandExecuter(log_level=log_level)
   _, rootfs_mp, _ = cmd_executer.ChrootRunCommandWOutput(chromeos_root, command)
@@ -435,7 +534,18 @@ def VerifyChromeChecksum(chromeos_root, image, remote, log_level):
   image_chrome_checksum = out.strip().split()[0]
   MountImage(
       chromeos_root, image, rootfs_mp, stateful_mp, log_level, unmount=True)
+  return image_chrome_checksum
 
+
+def VerifyChromeChecksum(chromeos_root,
+                         image,
+                         remote,
+                         log_level,
+                         image_chrome_checksum=None):
+  if image_chrome_checksum is None:
+    image_chrome_checksum = GetImageChromeChecksum(chromeos_root, image,
+                                                   log_level)
+  cmd_executer = command_executer.GetCommandExecuter(log_level=log_level)
   command = 'md5sum /opt/google/chrome/chrome'
   [_, o, _] = cmd_executer.CrosRunCommandWOutput(
       command, chromeos_root=chromeos_root, machine=remote)